@@ -12,6 +12,8 @@ needed if the refresh token expires (typically after 90 days of inactivity).
 import os
 import sys
 import logging
+import threading
+import time
 
 import msal
 
@@ -23,6 +25,16 @@ SCOPES = [
     "Files.ReadWrite",
 ]
 
+# Serializes token cache writes — ZIP members are uploaded from worker threads
+_cache_write_lock = threading.Lock()
+
+# Access tokens already acquired by this process: client_id -> (token, monotonic
+# deadline). Reused until _TOKEN_EXPIRY_MARGIN seconds before they expire, which
+# skips re-reading the cache file and MSAL work on every Graph call.
+_token_memo: dict[str, tuple[str, float]] = {}
+_token_lock = threading.Lock()
+_TOKEN_EXPIRY_MARGIN = 300
+
 
 def get_config() -> dict:
     from utils import load_config
@@ -49,13 +61,14 @@ def save_token_cache(cache: msal.SerializableTokenCache) -> None:
         cache_path = get_token_cache_path()
         os.makedirs(os.path.dirname(cache_path), exist_ok=True)
         # Write with restrictive permissions (owner-only read/write)
-        fd = os.open(cache_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
-        try:
-            with os.fdopen(fd, "w") as f:
-                f.write(cache.serialize())
-        except Exception:
-            os.close(fd)
-            raise
+        with _cache_write_lock:
+            fd = os.open(cache_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            try:
+                with os.fdopen(fd, "w") as f:
+                    f.write(cache.serialize())
+            except Exception:
+                os.close(fd)
+                raise
         logger.info("Token cache saved to %s", cache_path)
 
 
@@ -67,21 +80,38 @@ def build_app(client_id: str, cache: msal.SerializableTokenCache) -> msal.Public
     )
 
 
-def get_access_token(client_id: str) -> str:
+def get_access_token(client_id: str, force_refresh: bool = False) -> str:
     """
     Return a valid access token, using cache if possible,
     otherwise trigger Device Code Flow.
+
+    force_refresh bypasses both the in-process memo and MSAL's cached access
+    token (used after Graph rejects a token with 401).
     """
+    with _token_lock:
+        memo = _token_memo.get(client_id)
+        if memo and not force_refresh and time.monotonic() < memo[1]:
+            return memo[0]
+
+        result = _acquire_token(client_id, force_refresh)
+        if "expires_in" in result:
+            deadline = time.monotonic() + float(result["expires_in"]) - _TOKEN_EXPIRY_MARGIN
+            _token_memo[client_id] = (result["access_token"], deadline)
+        return result["access_token"]
+
+
+def _acquire_token(client_id: str, force_refresh: bool) -> dict:
+    """Acquire a token through MSAL and return the raw MSAL result."""
     cache = load_token_cache()
     app = build_app(client_id, cache)
 
     # Try silent acquisition first (uses refresh token)
     accounts = app.get_accounts()
     if accounts:
-        result = app.acquire_token_silent(SCOPES, account=accounts[0])
+        result = app.acquire_token_silent(SCOPES, account=accounts[0], force_refresh=force_refresh)
         if result and "access_token" in result:
             save_token_cache(cache)
-            return result["access_token"]
+            return result
 
     # Fall back to Device Code Flow
     flow = app.initiate_device_flow(scopes=SCOPES)
@@ -102,7 +132,7 @@ def get_access_token(client_id: str) -> str:
 
     save_token_cache(cache)
     logger.info("Authentication successful. Token cached.")
-    return result["access_token"]
+    return result
 
 
 if __name__ == "__main__":
@@ -22,11 +22,15 @@ from __future__ import annotations
 
 import base64
 import io
-import json
 import logging
 import math
 import re
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, NamedTuple
+
+try:
+    from orjson import loads as _json_loads
+except ImportError:  # optional — faster JSON parsing when installed
+    from json import loads as _json_loads
 
 if TYPE_CHECKING:
     from poller import Attachment
@@ -34,10 +38,22 @@ if TYPE_CHECKING:
 import anthropic
 import pdfplumber
 
-from utils import normalize_content_type
-
 logger = logging.getLogger(__name__)
 
+# Content types the classifier can read — anything else is routed to review
+_PDF_TYPES = {"application/pdf"}
+_IMAGE_MAP = {
+    "image/jpeg": "image/jpeg", "image/jpg": "image/jpeg",
+    "image/png": "image/png", "image/tiff": "image/tiff",
+}
+_XLSX_TYPES = {
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "application/vnd.ms-excel",
+}
+_IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".tiff")
+_XLSX_EXTS = (".xlsx", ".xls")
+_CLASSIFIABLE_EXTS = (".pdf",) + _IMAGE_EXTS + _XLSX_EXTS
+
 MODEL = "claude-haiku-4-5"
 MAX_TEXT_CHARS = 3000  # ~800 tokens — enough for a typical invoice header
 
@@ -121,10 +137,17 @@ def _extract_xlsx_text(data: bytes) -> str:
 # Claude API calls
 # ---------------------------------------------------------------------------
 
-# Return type: (is_invoice, confidence, reason, invoice_date, supplier,
-#               amount_ht, amount_ttc, amount_tva, currency)
 # NOTE: order is HT, TTC, TVA — consistent with the public is_invoice() API.
-_ClassifyResult = tuple[bool, float, str, str | None, str | None, float | None, float | None, float | None, str | None]
+class _ClassifyResult(NamedTuple):
+    is_invoice: bool
+    confidence: float
+    reason: str
+    invoice_date: str | None
+    supplier: str | None
+    amount_ht: float | None
+    amount_ttc: float | None
+    amount_tva: float | None
+    currency: str | None
 
 
 def _classify_text(
@@ -139,7 +162,7 @@ def _classify_text(
     """
     if not text.strip():
         logger.debug("No text to classify — returning review result immediately")
-        return False, 0.0, "No text extracted — sending to review", None, None, None, None, None, None
+        return _ClassifyResult(False, 0.0, "No text extracted — sending to review", None, None, None, None, None, None)
 
     prompt = USER_PROMPT_TEXT.format(text=text)
     if hint_supplier:
@@ -221,7 +244,7 @@ def _parse_response(raw: str, owner_names: set[str] | None = None) -> _ClassifyR
     """
     try:
         clean = raw.strip().removeprefix("```json").removeprefix("```").removesuffix("```").strip()
-        data = json.loads(clean)
+        data = _json_loads(clean)
         is_inv = bool(data.get("is_invoice", True))
         conf = float(data.get("confidence", 0.5))
         reason = str(data.get("reason", ""))
@@ -261,17 +284,26 @@ def _parse_response(raw: str, owner_names: set[str] | None = None) -> _ClassifyR
         else:
             currency = None
 
-        return is_inv, conf, reason, invoice_date, supplier, amount_ht, amount_ttc, amount_tva, currency
+        return _ClassifyResult(is_inv, conf, reason, invoice_date, supplier, amount_ht, amount_ttc, amount_tva, currency)
 
     except Exception as e:
         logger.warning("Failed to parse classifier response %r: %s", raw, e, exc_info=True)
-        return True, 0.0, "Parse error — sending to review", None, None, None, None, None, None
+        return _ClassifyResult(True, 0.0, "Parse error — sending to review", None, None, None, None, None, None)
 
 
 # ---------------------------------------------------------------------------
 # Public interface
 # ---------------------------------------------------------------------------
 
+def can_classify(attachment: Attachment) -> bool:
+    """Return True if is_invoice() can read this attachment (PDF, image or spreadsheet)."""
+    ct = attachment.ct_main
+    return (
+        ct in _PDF_TYPES or ct in _IMAGE_MAP or ct in _XLSX_TYPES
+        or attachment.name.lower().endswith(_CLASSIFIABLE_EXTS)
+    )
+
+
 def is_invoice(
     attachment: Attachment,
     config: dict,
@@ -311,7 +343,7 @@ def is_invoice(
     client = anthropic.Anthropic(api_key=api_key)
 
     name_lower = attachment.name.lower()
-    ct = normalize_content_type(attachment.content_type)
+    ct = attachment.ct_main
     data = attachment.content_bytes
     size_kb = len(data) / 1024
 
@@ -322,28 +354,18 @@ def is_invoice(
 
     try:
         # Dispatch by content type — extract text or send image to Claude
-        _PDF_TYPES = {"application/pdf"}
-        _IMAGE_MAP = {
-            "image/jpeg": "image/jpeg", "image/jpg": "image/jpeg",
-            "image/png": "image/png", "image/tiff": "image/tiff",
-        }
-        _XLSX_TYPES = {
-            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            "application/vnd.ms-excel",
-        }
-
         if ct in _PDF_TYPES or name_lower.endswith(".pdf"):
             text = _extract_pdf_text(data)
             is_inv, conf, reason, invoice_date, supplier, amount_ht, amount_ttc, amount_tva, currency = _classify_text(client, text, hint_supplier, owner_names)
 
-        elif ct in _IMAGE_MAP or name_lower.endswith((".jpg", ".jpeg", ".png", ".tiff")):
+        elif ct in _IMAGE_MAP or name_lower.endswith(_IMAGE_EXTS):
             media = _IMAGE_MAP.get(ct)
             if not media:
-                ext = name_lower.rsplit(".", 1)[-1]
+                ext = name_lower.rpartition(".")[2]
                 media = {"jpg": "image/jpeg", "jpeg": "image/jpeg", "png": "image/png", "tiff": "image/tiff"}.get(ext, "image/jpeg")
             is_inv, conf, reason, invoice_date, supplier, amount_ht, amount_ttc, amount_tva, currency = _classify_image(client, data, media, hint_supplier, owner_names)
 
-        elif ct in _XLSX_TYPES or name_lower.endswith((".xlsx", ".xls")):
+        elif ct in _XLSX_TYPES or name_lower.endswith(_XLSX_EXTS):
             text = _extract_xlsx_text(data)
             is_inv, conf, reason, invoice_date, supplier, amount_ht, amount_ttc, amount_tva, currency = _classify_text(client, text, hint_supplier, owner_names)
 
@@ -62,6 +62,21 @@ def init_db(data_dir: str) -> None:
                 sent_at     TEXT NOT NULL,
                 UNIQUE(year, month)
             );
+
+            CREATE TABLE IF NOT EXISTS uploaded_files (
+                content_hash    TEXT NOT NULL,
+                review          INTEGER NOT NULL DEFAULT 0,
+                drive_file_id   TEXT NOT NULL,
+                drive_web_link  TEXT,
+                uploaded_at     TEXT NOT NULL,
+                PRIMARY KEY (content_hash, review)
+            );
+
+            CREATE TABLE IF NOT EXISTS delta_links (
+                sync_key        TEXT PRIMARY KEY,
+                delta_link      TEXT NOT NULL,
+                updated_at      TEXT NOT NULL
+            );
         """)
         conn.commit()
 
@@ -164,6 +179,55 @@ def save_invoice(
         )
 
 
+def get_uploaded_file(data_dir: str, content_hash: str, review: bool = False) -> tuple[str, str] | None:
+    """Return (drive_file_id, drive_web_link) for an already-uploaded file, or None."""
+    with _connect(data_dir) as conn:
+        row = conn.execute(
+            "SELECT drive_file_id, drive_web_link FROM uploaded_files WHERE content_hash = ? AND review = ?",
+            (content_hash, int(review)),
+        ).fetchone()
+        if row is None:
+            return None
+        return row["drive_file_id"], row["drive_web_link"] or ""
+
+
+def save_uploaded_file(
+    data_dir: str,
+    content_hash: str,
+    drive_file_id: str,
+    drive_web_link: str | None,
+    review: bool = False,
+) -> None:
+    with _connect(data_dir) as conn:
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO uploaded_files
+                (content_hash, review, drive_file_id, drive_web_link, uploaded_at)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (content_hash, int(review), drive_file_id, drive_web_link,
+             datetime.now(timezone.utc).isoformat()),
+        )
+        conn.commit()
+
+
+def get_delta_links(data_dir: str) -> dict[str, str]:
+    """Return the Graph delta links saved by the last poll, keyed by sync key."""
+    with _connect(data_dir) as conn:
+        rows = conn.execute("SELECT sync_key, delta_link FROM delta_links").fetchall()
+        return {row["sync_key"]: row["delta_link"] for row in rows}
+
+
+def save_delta_links(data_dir: str, delta_links: dict[str, str]) -> None:
+    now = datetime.now(timezone.utc).isoformat()
+    with _connect(data_dir) as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO delta_links (sync_key, delta_link, updated_at) VALUES (?, ?, ?)",
+            [(key, link, now) for key, link in delta_links.items()],
+        )
+        conn.commit()
+
+
 def get_unreported_invoices(data_dir: str, year: int, month: int) -> list[dict]:
     """Return all invoices for a given year/month that have not been reported yet."""
     with _connect(data_dir) as conn:
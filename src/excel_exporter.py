@@ -14,11 +14,11 @@ Sheet layout:
 
 import io
 import logging
-from collections import defaultdict
 from datetime import datetime
+from functools import lru_cache
 
 from openpyxl import Workbook
-from openpyxl.styles import Alignment, Font, PatternFill, Border, Side
+from openpyxl.styles import Alignment, Font, NamedStyle, PatternFill, Border, Side
 from openpyxl.utils import get_column_letter
 
 from utils import sender_to_label
@@ -55,9 +55,30 @@ def _fmt_amount(value: float | None) -> str:
     """Format a float amount as a string, or empty string if None."""
     if value is None:
         return ""
+    # + 0.0 folds -0.0 into 0.0, which would otherwise share its cache slot
+    return _fmt_amount_cached(value + 0.0)
+
+
+@lru_cache(maxsize=4096)
+def _fmt_amount_cached(value: float) -> str:
+    # Recurring subscriptions repeat the same amounts month after month
     return f"{value:,.2f}".replace(",", " ").replace(".", ",")
 
 
+def _format_date(raw: str) -> str:
+    """Format an ISO date or datetime string as DD/MM/YYYY, or return it unchanged if unparseable."""
+    # Stored dates are "YYYY-MM-DD" or "YYYY-MM-DDTHH:MM:SS...": slice the date
+    # part directly and only go through fromisoformat for other shapes.
+    if len(raw) >= 10 and raw[4] == "-" and raw[7] == "-" and (len(raw) == 10 or raw[10] == "T"):
+        y, m, d = raw[:4], raw[5:7], raw[8:10]
+        if y.isdigit() and m.isdigit() and d.isdigit():
+            return f"{d}/{m}/{y}"
+    try:
+        return datetime.fromisoformat(raw).strftime("%d/%m/%Y")
+    except (TypeError, ValueError):
+        return raw
+
+
 def build_monthly_excel(invoices: list[dict], year: int, month: int) -> bytes:
     """
     Build a monthly invoice summary workbook.
@@ -70,6 +91,21 @@ def build_monthly_excel(invoices: list[dict], year: int, month: int) -> bytes:
     Returns:
         Raw .xlsx bytes.
     """
+    wb, supplier_count = _build_workbook(invoices, year, month)
+
+    buf = io.BytesIO()
+    wb.save(buf)
+    buf.seek(0)
+
+    logger.info(
+        "Built Excel summary for %s: %d invoice(s), %d suppliers, %d bytes",
+        wb.active.title, len(invoices), supplier_count, buf.getbuffer().nbytes,
+    )
+    return buf.read()
+
+
+def _build_workbook(invoices: list[dict], year: int, month: int) -> tuple[Workbook, int]:
+    """Build the summary workbook in memory; returns it with its number of suppliers."""
     month_label = f"{MONTH_NAMES_FR[month]} {year}"
     period_str = f"{month:02d}/{year}"
 
@@ -91,6 +127,16 @@ def build_monthly_excel(invoices: list[dict], year: int, month: int) -> bytes:
     left            = Alignment(horizontal="left",   vertical="center")
     right           = Alignment(horizontal="right",  vertical="center")
 
+    # Data cells share a few font/alignment/border combinations: register them
+    # once as named styles so each cell takes one style assignment, not three.
+    for style_name, font, align in (
+        ("row_center", row_font, center),
+        ("row_left", row_font, left),
+        ("row_num", num_font, right),
+        ("row_link", link_font, center),
+    ):
+        wb.add_named_style(NamedStyle(name=style_name, font=font, alignment=align, border=_BORDER))
+
     sum_hdr_font    = Font(bold=True, name="Calibri", size=10, color="2C5F8A")
     sum_hdr_fill    = PatternFill(fill_type="solid", fgColor=SUMMARY_BG)
     sum_row_font    = Font(name="Calibri", size=10)
@@ -113,15 +159,11 @@ def build_monthly_excel(invoices: list[dict], year: int, month: int) -> bytes:
     # -----------------------------------------------------------------------
     # Data rows
     # -----------------------------------------------------------------------
-    supplier_totals: dict[str, dict] = defaultdict(lambda: {"count": 0, "ht": 0.0, "tva": 0.0, "ttc": 0.0, "has_amounts": False})
+    # supplier -> [count, ht, tva, ttc, has_amounts]
+    supplier_totals: dict[str, list] = {}
 
     for row_idx, inv in enumerate(invoices, start=2):
-        raw_date = inv.get("invoice_date") or inv.get("received_at", "")
-        try:
-            dt = datetime.fromisoformat(raw_date.replace("Z", "+00:00"))
-            date_str = dt.strftime("%d/%m/%Y")
-        except Exception:
-            date_str = raw_date
+        date_str = _format_date(inv.get("invoice_date") or inv.get("received_at", ""))
 
         sender: str = inv.get("sender", "")
         supplier: str = inv.get("supplier") or sender_to_label(sender).capitalize()
@@ -133,52 +175,35 @@ def build_monthly_excel(invoices: list[dict], year: int, month: int) -> bytes:
         amount_tva = inv.get("amount_tva")
         amount_ttc = inv.get("amount_ttc")
 
-        st = supplier_totals[supplier]
-        st["count"] += 1
+        st = supplier_totals.get(supplier)
+        if st is None:
+            st = supplier_totals[supplier] = [0, 0.0, 0.0, 0.0, False]
+        st[0] += 1
         if amount_ht is not None:
-            st["ht"] += amount_ht
-            st["has_amounts"] = True
+            st[1] += amount_ht
+            st[4] = True
         if amount_tva is not None:
-            st["tva"] += amount_tva
-            st["has_amounts"] = True
+            st[2] += amount_tva
+            st[4] = True
         if amount_ttc is not None:
-            st["ttc"] += amount_ttc
-            st["has_amounts"] = True
-
-        c = ws.cell(row=row_idx, column=1, value=date_str)
-        c.font = row_font; c.alignment = center; c.border = _BORDER
-
-        c = ws.cell(row=row_idx, column=2, value=supplier)
-        c.font = row_font; c.alignment = left; c.border = _BORDER
-
-        c = ws.cell(row=row_idx, column=3, value=sender)
-        c.font = row_font; c.alignment = left; c.border = _BORDER
-
-        c = ws.cell(row=row_idx, column=4, value=filename)
-        c.font = row_font; c.alignment = left; c.border = _BORDER
-
-        c = ws.cell(row=row_idx, column=5, value=_fmt_amount(amount_ht))
-        c.font = num_font; c.alignment = right; c.border = _BORDER
-
-        c = ws.cell(row=row_idx, column=6, value=_fmt_amount(amount_tva))
-        c.font = num_font; c.alignment = right; c.border = _BORDER
-
-        c = ws.cell(row=row_idx, column=7, value=_fmt_amount(amount_ttc))
-        c.font = num_font; c.alignment = right; c.border = _BORDER
-
-        c = ws.cell(row=row_idx, column=8, value=currency)
-        c.font = row_font; c.alignment = center; c.border = _BORDER
+            st[3] += amount_ttc
+            st[4] = True
+
+        ws.cell(row=row_idx, column=1, value=date_str).style = "row_center"
+        ws.cell(row=row_idx, column=2, value=supplier).style = "row_left"
+        ws.cell(row=row_idx, column=3, value=sender).style = "row_left"
+        ws.cell(row=row_idx, column=4, value=filename).style = "row_left"
+        ws.cell(row=row_idx, column=5, value=_fmt_amount(amount_ht)).style = "row_num"
+        ws.cell(row=row_idx, column=6, value=_fmt_amount(amount_tva)).style = "row_num"
+        ws.cell(row=row_idx, column=7, value=_fmt_amount(amount_ttc)).style = "row_num"
+        ws.cell(row=row_idx, column=8, value=currency).style = "row_center"
 
         if drive_link:
-            c = ws.cell(row=row_idx, column=9, value=f'=HYPERLINK("{drive_link}","Ouvrir")')
-            c.font = link_font
+            ws.cell(row=row_idx, column=9, value=f'=HYPERLINK("{drive_link}","Ouvrir")').style = "row_link"
         else:
-            c = ws.cell(row=row_idx, column=9, value="—")
-            c.font = row_font
-        c.alignment = center; c.border = _BORDER
+            ws.cell(row=row_idx, column=9, value="—").style = "row_center"
 
-        c = ws.cell(row=row_idx, column=10, value=period_str)
-        c.font = row_font; c.alignment = center; c.border = _BORDER
+        ws.cell(row=row_idx, column=10, value=period_str).style = "row_center"
 
         ws.row_dimensions[row_idx].height = 16
 
@@ -199,25 +224,25 @@ def build_monthly_excel(invoices: list[dict], year: int, month: int) -> bytes:
 
     grand_ht = grand_tva = grand_ttc = 0.0
     grand_count = 0
-    has_any_amounts = any(s["has_amounts"] for s in supplier_totals.values())
+    has_any_amounts = any(st[4] for st in supplier_totals.values())
 
-    for i, (sup_name, st) in enumerate(sorted(supplier_totals.items())):
+    for i, (sup_name, (count, ht, tva, ttc, has_amounts)) in enumerate(sorted(supplier_totals.items())):
         r = summary_header_row + 1 + i
         ws.cell(row=r, column=1, value=sup_name).font = sum_bold_font
-        ws.cell(row=r, column=2, value=st["count"]).font = sum_row_font
+        ws.cell(row=r, column=2, value=count).font = sum_row_font
         ws.cell(row=r, column=2).alignment = center
-        ws.cell(row=r, column=3, value=_fmt_amount(st["ht"]) if st["has_amounts"] else "").font = sum_row_font
+        ws.cell(row=r, column=3, value=_fmt_amount(ht) if has_amounts else "").font = sum_row_font
         ws.cell(row=r, column=3).alignment = right
-        ws.cell(row=r, column=4, value=_fmt_amount(st["tva"]) if st["has_amounts"] else "").font = sum_row_font
+        ws.cell(row=r, column=4, value=_fmt_amount(tva) if has_amounts else "").font = sum_row_font
         ws.cell(row=r, column=4).alignment = right
-        ws.cell(row=r, column=5, value=_fmt_amount(st["ttc"]) if st["has_amounts"] else "").font = sum_row_font
+        ws.cell(row=r, column=5, value=_fmt_amount(ttc) if has_amounts else "").font = sum_row_font
         ws.cell(row=r, column=5).alignment = right
         ws.row_dimensions[r].height = 16
 
-        grand_count += st["count"]
-        grand_ht    += st["ht"]
-        grand_tva   += st["tva"]
-        grand_ttc   += st["ttc"]
+        grand_count += count
+        grand_ht    += ht
+        grand_tva   += tva
+        grand_ttc   += ttc
 
     total_row = summary_header_row + 1 + len(supplier_totals)
     for col_idx, val in enumerate([
@@ -247,12 +272,4 @@ def build_monthly_excel(invoices: list[dict], year: int, month: int) -> bytes:
     ws.freeze_panes = "A2"
     ws.auto_filter.ref = f"A1:{get_column_letter(len(COLUMNS))}{len(invoices) + 1}"
 
-    buf = io.BytesIO()
-    wb.save(buf)
-    buf.seek(0)
-
-    logger.info(
-        "Built Excel summary for %s: %d invoice(s), %d suppliers, %d bytes",
-        month_label, len(invoices), len(supplier_totals), buf.getbuffer().nbytes,
-    )
-    return buf.read()
+    return wb, len(supplier_totals)
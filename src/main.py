@@ -53,6 +53,9 @@ def poll_inbox(config: dict) -> None:
     else:
         logger.info("No subject keyword filter — all subjects accepted")
 
+    # Optional sender -> canonical supplier hints, resolved once per poll
+    sender_suppliers: dict[str, str] = (config.get("invoices") or {}).get("sender_suppliers") or {}
+
     graph = GraphClient(client_id)
 
     # Optional date floor — ignore emails older than this date
@@ -62,13 +65,18 @@ def poll_inbox(config: dict) -> None:
     else:
         logger.info("No date filter — processing all emails")
 
-    # Fetch emails — subject filter pre-screens, AI classifier does final check
+    # Fetch emails — subject filter pre-screens, AI classifier does final check.
+    # With delta_sync on, delta links make each poll read only what changed
+    # since the previous one; otherwise every poll rescans the folders.
     link_keywords: list[str] = config.get("link_detection", {}).get("keywords", [])
+    delta_sync = bool((config.get("schedule") or {}).get("delta_sync", False))
+    delta_links = db.get_delta_links(data_dir) if delta_sync else None
     emails = graph.fetch_emails_with_attachments(
         whitelisted_senders=whitelisted_senders,
         since=since_date,
         link_keywords=link_keywords,
         subject_keywords=subject_keywords,
+        delta_links=delta_links,
     )
 
     logger.info("Fetched %d email(s) with qualifying attachments.", len(emails))
@@ -93,6 +101,7 @@ def poll_inbox(config: dict) -> None:
                     data_dir=data_dir,
                     client_id=client_id,
                     root_folder_name=root_folder_name,
+                    sender_suppliers=sender_suppliers,
                 )
                 if status == "invoice":
                     new_count += 1
@@ -115,6 +124,10 @@ def poll_inbox(config: dict) -> None:
             received_at=email.received_at,
         )
 
+    # Saved only once every email is handled, so a crash replays this batch
+    if delta_links is not None:
+        db.save_delta_links(data_dir, delta_links)
+
     logger.info("Poll complete. %d new invoice(s) stored.", new_count)
     logger.info("========== POLL END ==========\n")
 
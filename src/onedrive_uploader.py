@@ -13,13 +13,22 @@ falling back to the second-level domain of the sender (e.g. 'amazon', 'edf', 'fr
 Uncertain/rejected files go to ROOT/YYYY/MM/_a_verifier/ (flat, no supplier subfolder).
 """
 
+import hashlib
 import logging
 import re
 import unicodedata
 from datetime import datetime
+from functools import lru_cache
 
 import requests
+from requests.adapters import HTTPAdapter
 
+try:
+    import orjson
+except ImportError:  # optional — faster JSON parsing when installed
+    orjson = None
+
+import db
 from auth_setup import get_access_token
 from utils import GRAPH_BASE, sanitize_filename, sender_to_label
 
@@ -30,6 +39,11 @@ logger = logging.getLogger(__name__)
 # Filename helpers
 # ---------------------------------------------------------------------------
 
+# Runs of anything but lowercase ASCII letters/digits collapse to one hyphen
+_LABEL_SEP_RE = re.compile(r"[^a-z0-9]+")
+
+
+@lru_cache(maxsize=1024)
 def _supplier_to_label(supplier: str) -> str:
     """
     Convert a free-text supplier name to a compact filename-safe label.
@@ -39,12 +53,17 @@ def _supplier_to_label(supplier: str) -> str:
         "Free SAS"                   -> "free-sas"
         "Orange S.A."                -> "orange-sa"
     """
-    nfkd = unicodedata.normalize("NFKD", supplier)
-    ascii_str = nfkd.encode("ascii", "ignore").decode("ascii")
-    label = re.sub(r"[^a-z0-9]+", "-", ascii_str.lower()).strip("-")
+    if supplier.isascii():
+        # Nothing to decompose or drop — skip NFKD and the ASCII round trip
+        ascii_str = supplier
+    else:
+        nfkd = unicodedata.normalize("NFKD", supplier)
+        ascii_str = nfkd.encode("ascii", "ignore").decode("ascii")
+    label = _LABEL_SEP_RE.sub("-", ascii_str.lower()).strip("-")
     return label[:40]
 
 
+@lru_cache(maxsize=2048)
 def build_filename(
     received_at: str,
     sender: str,
@@ -61,12 +80,16 @@ def build_filename(
       - supplier (from document) when provided — used for internal senders
       - otherwise the second-level domain of the sender address
         (e.g. billing@notifications.amazon.fr -> amazon)
+
+    Pure function of its (string) arguments, so results are memoized: the
+    pipeline and the uploader both build the name for every attachment.
     """
     if invoice_date:
         date_str = invoice_date
     else:
         try:
-            dt = datetime.fromisoformat(received_at.replace("Z", "+00:00"))
+            # fromisoformat accepts the trailing "Z" natively since Python 3.11
+            dt = datetime.fromisoformat(received_at)
             date_str = dt.strftime("%Y-%m-%d")
         except Exception:
             date_str = "0000-00-00"
@@ -84,6 +107,19 @@ def build_filename(
 # Graph API helpers
 # ---------------------------------------------------------------------------
 
+# One pooled session for every Graph call made by this module: keep-alive
+# reuses the TCP+TLS connection instead of a fresh handshake per request.
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+
+def _json(resp: requests.Response) -> dict:
+    """Decode a Graph JSON response body (orjson when available, else stdlib)."""
+    if orjson is not None:
+        return orjson.loads(resp.content)
+    return resp.json()
+
+
 def _headers(client_id: str) -> dict:
     token = get_access_token(client_id)
     return {
@@ -92,6 +128,12 @@ def _headers(client_id: str) -> dict:
     }
 
 
+# Resolved folder IDs for the lifetime of the process, keyed by (parent_path, name).
+# The bot never deletes folders, but a user can: _upload_file clears the cache
+# when an upload to a cached folder ID comes back 404.
+_FOLDER_CACHE: dict[tuple[str, str], str] = {}
+
+
 def _get_or_create_folder(client_id: str, parent_path: str, name: str) -> str:
     """
     Return the OneDrive item ID of a folder named `name` under `parent_path`.
@@ -104,12 +146,22 @@ def _get_or_create_folder(client_id: str, parent_path: str, name: str) -> str:
         "/me/drive/root"         (OneDrive root)
         "/me/drive/items/{id}"   (subfolder by ID)
     """
+    cached = _FOLDER_CACHE.get((parent_path, name))
+    if cached:
+        return cached
+    folder_id = _resolve_or_create_folder(client_id, parent_path, name)
+    _FOLDER_CACHE[(parent_path, name)] = folder_id
+    return folder_id
+
+
+def _resolve_or_create_folder(client_id: str, parent_path: str, name: str) -> str:
+    """Uncached body of _get_or_create_folder (one GET, plus a POST if missing)."""
     # Try to resolve the folder by path directly (404 = does not exist yet)
     get_url = f"{GRAPH_BASE}{parent_path}:/{name}?$select=id,name,folder"
-    resp = requests.get(get_url, headers=_headers(client_id), timeout=30)
+    resp = _session.get(get_url, headers=_headers(client_id), timeout=30)
 
     if resp.status_code == 200:
-        item = resp.json()
+        item = _json(resp)
         if "folder" in item:
             return item["id"]
         # Item exists but is not a folder — fall through to create with a suffix
@@ -124,7 +176,7 @@ def _get_or_create_folder(client_id: str, parent_path: str, name: str) -> str:
         "folder": {},
         "@microsoft.graph.conflictBehavior": "fail",
     }
-    resp = requests.post(
+    resp = _session.post(
         create_url,
         headers=_headers(client_id),
         json=payload,
@@ -132,11 +184,11 @@ def _get_or_create_folder(client_id: str, parent_path: str, name: str) -> str:
     )
     # 409 Conflict = already exists (race condition) — re-fetch by path
     if resp.status_code == 409:
-        resp2 = requests.get(get_url, headers=_headers(client_id), timeout=30)
+        resp2 = _session.get(get_url, headers=_headers(client_id), timeout=30)
         resp2.raise_for_status()
-        return resp2.json()["id"]
+        return _json(resp2)["id"]
     resp.raise_for_status()
-    folder_id = resp.json()["id"]
+    folder_id = _json(resp)["id"]
     logger.info("Created OneDrive folder: %s (id=%s)", name, folder_id)
     return folder_id
 
@@ -181,6 +233,78 @@ _SIMPLE_UPLOAD_LIMIT = 4 * 1024 * 1024  # 4 MB
 _CHUNK_SIZE = 3_276_800  # ~3.125 MB — must be a multiple of 320 KiB per Graph API docs
 
 
+def _one_shot_upload(
+    client_id: str,
+    folder_path: str,
+    filename: str,
+    file_bytes: bytes,
+    content_type: str,
+) -> tuple[str, str] | None:
+    """
+    Upload a small file straight to its path under the drive root.
+
+    OneDrive creates any missing parent folders on a path-addressed PUT, so a
+    first upload to a new year/month/supplier costs one request instead of a
+    GET/POST per folder level plus the content PUT. The parent folder ID from
+    the response is stored in _FOLDER_CACHE for later uploads that cannot use
+    this path (e.g. chunked uploads).
+
+    Returns:
+        (onedrive_file_id, onedrive_web_url), or None if the caller should fall
+        back to resolving the folder chain (404 or 403 on the path).
+
+    Raises:
+        requests.HTTPError: on any other error status (throttling, 5xx), so a
+        throttled upload is not multiplied into a folder-chain resolution.
+    """
+    item_path = f"{GRAPH_BASE}/me/drive/root:/{folder_path}/{filename}"
+    token = get_access_token(client_id)
+    resp = _session.put(
+        f"{item_path}:/content?@microsoft.graph.conflictBehavior=fail",
+        headers={
+            "Authorization": f"Bearer {token}",
+            "Content-Type": content_type,
+        },
+        data=file_bytes,
+        timeout=120,
+    )
+
+    # 409 Conflict = file already uploaded — resolve the existing item by path
+    if resp.status_code == 409:
+        existing = _session.get(
+            f"{item_path}?$select=id,webUrl", headers=_headers(client_id), timeout=30,
+        )
+        existing.raise_for_status()
+        item = _json(existing)
+        logger.info("File already exists in %s (skipping upload): %s", folder_path, filename)
+        return item["id"], item.get("webUrl", "")
+
+    if resp.status_code in (403, 404):
+        logger.debug(
+            "Path upload of %s to %s failed with HTTP %d — falling back to folder resolution",
+            filename, folder_path, resp.status_code,
+        )
+        return None
+    resp.raise_for_status()
+
+    item = _json(resp)
+    parent_id = (item.get("parentReference") or {}).get("id")
+    if parent_id:
+        _FOLDER_CACHE[("/me/drive/root", folder_path)] = parent_id
+    return item["id"], item.get("webUrl", "")
+
+
+def _get_existing_item(client_id: str, folder_id: str, filename: str) -> tuple[str, str] | None:
+    """Return (id, webUrl) of `filename` inside `folder_id`, or None if absent."""
+    check_url = f"{GRAPH_BASE}/me/drive/items/{folder_id}:/{filename}?$select=id,webUrl"
+    resp = _session.get(check_url, headers=_headers(client_id), timeout=30)
+    if resp.status_code == 404:
+        return None
+    resp.raise_for_status()
+    item = _json(resp)
+    return item["id"], item.get("webUrl", "")
+
+
 def _upload_to_folder(
     client_id: str,
     folder_id: str,
@@ -193,21 +317,20 @@ def _upload_to_folder(
     Upload a file to a specific OneDrive folder, choosing simple PUT or
     chunked upload session depending on file size.
 
+    Simple uploads are idempotent through conflictBehavior=fail (a 409 means
+    the file is already there). Chunked uploads only learn about a conflict
+    after every chunk has been sent, so they still check for the file first.
+
     Returns:
         (onedrive_file_id, onedrive_web_url)
     """
-    # Idempotency — skip if already uploaded (resolve by path)
-    check_url = f"{GRAPH_BASE}/me/drive/items/{folder_id}:/{filename}?$select=id,webUrl"
-    resp = requests.get(check_url, headers=_headers(client_id), timeout=30)
-    if resp.status_code == 200:
-        existing = resp.json()
-        logger.info("File already exists in %s (skipping upload): %s", log_label, filename)
-        return existing["id"], existing.get("webUrl", "")
-    if resp.status_code != 404:
-        resp.raise_for_status()
-
     if len(file_bytes) <= _SIMPLE_UPLOAD_LIMIT:
-        return _simple_upload(client_id, folder_id, filename, file_bytes, content_type)
+        return _simple_upload(client_id, folder_id, filename, file_bytes, content_type, log_label)
+
+    existing = _get_existing_item(client_id, folder_id, filename)
+    if existing:
+        logger.info("File already exists in %s (skipping upload): %s", log_label, filename)
+        return existing
     return _chunked_upload(client_id, folder_id, filename, file_bytes, content_type)
 
 
@@ -217,11 +340,15 @@ def _simple_upload(
     filename: str,
     file_bytes: bytes,
     content_type: str,
+    log_label: str,
 ) -> tuple[str, str]:
     """Simple PUT upload for files <= 4 MB."""
-    upload_url = f"{GRAPH_BASE}/me/drive/items/{folder_id}:/{filename}:/content"
+    upload_url = (
+        f"{GRAPH_BASE}/me/drive/items/{folder_id}:/{filename}:/content"
+        f"?@microsoft.graph.conflictBehavior=fail"
+    )
     token = get_access_token(client_id)
-    resp = requests.put(
+    resp = _session.put(
         upload_url,
         headers={
             "Authorization": f"Bearer {token}",
@@ -230,8 +357,14 @@ def _simple_upload(
         data=file_bytes,
         timeout=120,
     )
+    # 409 Conflict = already uploaded — return the existing item
+    if resp.status_code == 409:
+        existing = _get_existing_item(client_id, folder_id, filename)
+        if existing:
+            logger.info("File already exists in %s (skipping upload): %s", log_label, filename)
+            return existing
     resp.raise_for_status()
-    item = resp.json()
+    item = _json(resp)
     return item["id"], item.get("webUrl", "")
 
 
@@ -246,7 +379,7 @@ def _chunked_upload(
     # 1. Create upload session
     session_url = f"{GRAPH_BASE}/me/drive/items/{folder_id}:/{filename}:/createUploadSession"
     token = get_access_token(client_id)
-    resp = requests.post(
+    resp = _session.post(
         session_url,
         headers={
             "Authorization": f"Bearer {token}",
@@ -261,17 +394,19 @@ def _chunked_upload(
         timeout=30,
     )
     resp.raise_for_status()
-    upload_url = resp.json()["uploadUrl"]
+    upload_url = _json(resp)["uploadUrl"]
 
     # 2. Upload in chunks
     total = len(file_bytes)
     logger.info("Starting chunked upload: file=%r size=%d bytes chunks=%d", filename, total, -(-total // _CHUNK_SIZE))
+    # Slice through a memoryview so each chunk shares file_bytes' buffer instead of copying it
+    view = memoryview(file_bytes)
     offset = 0
     item = None
     while offset < total:
         end = min(offset + _CHUNK_SIZE, total)
-        chunk = file_bytes[offset:end]
-        resp = requests.put(
+        chunk = view[offset:end]
+        resp = _session.put(
             upload_url,
             headers={
                 "Content-Length": str(len(chunk)),
@@ -282,7 +417,7 @@ def _chunked_upload(
         )
         resp.raise_for_status()
         if resp.status_code in (200, 201):
-            item = resp.json()
+            item = _json(resp)
         offset = end
 
     if item is None:
@@ -298,6 +433,33 @@ def _chunked_upload(
 REVIEW_SUBFOLDER = "_a_verifier"
 
 
+def _content_hash(file_bytes: bytes) -> str:
+    """Return a short content fingerprint used to detect already-uploaded files."""
+    return hashlib.blake2b(file_bytes, digest_size=16).hexdigest()
+
+
+def _resolve_upload_folder(
+    client_id: str,
+    root_folder_name: str,
+    folder_path: str,
+    year: int,
+    month: int,
+    leaf_folder: str | None,
+    review: bool,
+) -> str:
+    """Return the ID of the destination folder, from the cache or by resolving the chain."""
+    folder_id = _FOLDER_CACHE.get(("/me/drive/root", folder_path))
+    if folder_id:
+        return folder_id
+    root_id = _get_or_create_root_folder(client_id, root_folder_name)
+    if review:
+        month_folder_id = _get_invoice_folder_id(client_id, root_id, year, month)
+        return _get_or_create_folder(
+            client_id, f"/me/drive/items/{month_folder_id}", REVIEW_SUBFOLDER
+        )
+    return _get_invoice_folder_id(client_id, root_id, year, month, leaf_folder)
+
+
 def _upload_file(
     client_id: str,
     root_folder_name: str,
@@ -311,6 +473,7 @@ def _upload_file(
     invoice_date: str | None = None,
     supplier: str | None = None,
     review: bool = False,
+    data_dir: str | None = None,
 ) -> tuple[str, str]:
     """
     Upload a single attachment to OneDrive.
@@ -318,23 +481,35 @@ def _upload_file(
     When review=False, uploads to ROOT/YYYY/MM/<supplier>/.
     When review=True,  uploads to ROOT/YYYY/MM/_a_verifier/.
 
+    When data_dir is given, identical content that was already uploaded to the
+    same destination kind is looked up in the local DB by content hash and the
+    Graph round-trips are skipped entirely (catches the same invoice arriving
+    twice under different filenames).
+
     Returns:
         (onedrive_file_id, onedrive_web_url)
     """
-    root_id = _get_or_create_root_folder(client_id, root_folder_name)
+    content_hash = None
+    if data_dir:
+        content_hash = _content_hash(attachment_bytes)
+        existing = db.get_uploaded_file(data_dir, content_hash, review=review)
+        if existing:
+            logger.info(
+                "Identical content already uploaded (skipping upload): file=%r hash=%s id=%s",
+                attachment_name, content_hash, existing[0],
+            )
+            return existing
 
     if review:
-        month_folder_id = _get_invoice_folder_id(client_id, root_id, year, month)
-        folder_id = _get_or_create_folder(
-            client_id, f"/me/drive/items/{month_folder_id}", REVIEW_SUBFOLDER
-        )
-        dest_label = f"{root_folder_name}/{year}/{month:02d}/_a_verifier/"
+        leaf_folder = REVIEW_SUBFOLDER
         log_label = "_a_verifier"
     else:
-        supplier_label = (_supplier_to_label(supplier) if supplier else None) or sender_to_label(sender)
-        folder_id = _get_invoice_folder_id(client_id, root_id, year, month, supplier_label)
-        dest_label = f"{root_folder_name}/{year}/{month:02d}/{supplier_label or '(root)'}/"
+        leaf_folder = (_supplier_to_label(supplier) if supplier else None) or sender_to_label(sender)
         log_label = "OneDrive"
+    dest_label = f"{root_folder_name}/{year}/{month:02d}/{leaf_folder or '(root)'}/"
+    folder_path = "/".join(
+        part for part in (root_folder_name, str(year), f"{month:02d}", leaf_folder) if part
+    )
 
     filename = build_filename(received_at, sender, attachment_name, invoice_date=invoice_date, supplier=supplier)
     size_kb = len(attachment_bytes) / 1024
@@ -344,11 +519,35 @@ def _upload_file(
         filename, size_kb, dest_label,
     )
 
-    file_id, web_url = _upload_to_folder(
-        client_id, folder_id, filename, attachment_bytes, content_type,
-        log_label=log_label,
-    )
+    result = None
+    if len(attachment_bytes) <= _SIMPLE_UPLOAD_LIMIT:
+        result = _one_shot_upload(client_id, folder_path, filename, attachment_bytes, content_type)
+
+    if result is None:
+        folder_args = (client_id, root_folder_name, folder_path, year, month, leaf_folder, review)
+        try:
+            folder_id = _resolve_upload_folder(*folder_args)
+            result = _upload_to_folder(
+                client_id, folder_id, filename, attachment_bytes, content_type,
+                log_label=log_label,
+            )
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 404:
+                raise
+            # A cached folder (or one of its parents) was deleted or renamed in
+            # OneDrive — forget every cached ID and resolve the chain again
+            logger.warning("OneDrive folder for %s not found (HTTP 404) — resolving it again", dest_label)
+            _FOLDER_CACHE.clear()
+            folder_id = _resolve_upload_folder(*folder_args)
+            result = _upload_to_folder(
+                client_id, folder_id, filename, attachment_bytes, content_type,
+                log_label=log_label,
+            )
+
+    file_id, web_url = result
     logger.info("Upload complete: file=%r id=%s url=%s", filename, file_id, web_url)
+    if content_hash:
+        db.save_uploaded_file(data_dir, content_hash, file_id, web_url, review=review)
     return file_id, web_url
 
 
@@ -364,6 +563,7 @@ def upload_attachment(
     month: int,
     invoice_date: str | None = None,
     supplier: str | None = None,
+    data_dir: str | None = None,
 ) -> tuple[str, str]:
     """Upload a single attachment to the correct OneDrive supplier folder.
 
@@ -373,6 +573,7 @@ def upload_attachment(
         client_id, root_folder_name, attachment_name, attachment_bytes,
         content_type, sender, received_at, year, month,
         invoice_date=invoice_date, supplier=supplier, review=False,
+        data_dir=data_dir,
     )
 
 
@@ -388,6 +589,7 @@ def upload_to_review(
     month: int,
     invoice_date: str | None = None,
     supplier: str | None = None,
+    data_dir: str | None = None,
 ) -> tuple[str, str]:
     """Upload an attachment to the _a_verifier/ subfolder.
 
@@ -397,5 +599,6 @@ def upload_to_review(
         client_id, root_folder_name, attachment_name, attachment_bytes,
         content_type, sender, received_at, year, month,
         invoice_date=invoice_date, supplier=supplier, review=True,
+        data_dir=data_dir,
     )
 
@@ -6,65 +6,254 @@ Classifies each email attachment and routes it to the appropriate OneDrive folde
 
 import io
 import logging
+import os
+import struct
+import threading
 import zipfile
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from datetime import datetime
+from functools import lru_cache
+from itertools import chain, islice
+
+try:
+    from isal import isal_zlib as _isal_zlib
+except ImportError:  # optional — ISA-L accelerated inflate for ZIP members
+    _isal_zlib = None
 
 import db
-from classifier import is_invoice
+from classifier import can_classify, is_invoice
 from onedrive_uploader import build_filename, upload_attachment, upload_to_review
 from poller import Attachment, Email
-from utils import normalize_content_type
 
 logger = logging.getLogger(__name__)
 
-# Supported member types inside a ZIP archive
-_ZIP_SUPPORTED_EXTENSIONS = (".pdf", ".jpg", ".jpeg", ".png", ".tiff", ".xlsx", ".xls")
+# Content types identifying an attachment as a ZIP archive
+_ZIP_CTS = frozenset(("application/zip", "application/x-zip-compressed"))
 
+# Local file header / empty-archive signatures at the start of a ZIP file
+_ZIP_MAGIC = (b"PK\x03\x04", b"PK\x05\x06")
 
-def _unpack_zip(attachment: Attachment) -> list[Attachment]:
+# Supported member types inside a ZIP archive, keyed by lowercase extension
+_EXT_TO_CT = {
+    "pdf": "application/pdf",
+    "jpg": "image/jpeg", "jpeg": "image/jpeg",
+    "png": "image/png",
+    "tiff": "image/tiff",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "xls": "application/vnd.ms-excel",
+}
+_SUPPORTED_CTS = frozenset(_EXT_TO_CT.values())
+
+
+# Worker threads used to decompress ZIP members (zlib releases the GIL)
+_ZIP_WORKERS = min(4, os.cpu_count() or 1)
+
+# Decompression caps guarding against zip bombs. The per-member cap matches
+# the poller's 20 MB attachment limit.
+_ZIP_MAX_MEMBER_BYTES = 20 * 1024 * 1024
+_ZIP_MAX_TOTAL_BYTES = 100 * 1024 * 1024
+_ZIP_READ_CHUNK = 1024 * 1024
+
+# Deflated members declared smaller than this are inflated in one call with
+# ISA-L (when installed) straight from the archive bytes
+_ZIP_FAST_INFLATE_MAX = 2 * 1024 * 1024
+
+# ZIP local file header: fixed 30 bytes, name/extra lengths at offset 26
+_ZIP_LOCAL_HEADER = struct.Struct("<4s22xHH")
+
+# Per-worker ZipFile — a single ZipFile instance is not safe for concurrent reads
+_zip_local = threading.local()
+
+
+def _open_worker_zip(content_bytes: bytes) -> None:
+    _zip_local.zf = zipfile.ZipFile(io.BytesIO(content_bytes))
+    _zip_local.archive = content_bytes
+
+
+def _inflate_zip_member(archive: bytes, info: zipfile.ZipInfo) -> bytes:
     """
-    Extract all supported files from a ZIP attachment and return them as
-    individual Attachment objects, preserving the original content_type.
-    Nested ZIPs are skipped.
+    Inflate a deflated member directly from the archive bytes with ISA-L,
+    bypassing zipfile's streaming reader. Applies the same size cap and
+    checks the CRC-32 from the central directory.
     """
-    members: list[Attachment] = []
+    offset = info.header_offset
     try:
-        with zipfile.ZipFile(io.BytesIO(attachment.content_bytes)) as zf:
-            for info in zf.infolist():
-                if info.is_dir():
-                    continue
-                # Skip macOS resource fork files (.__MACOSX/, ._filename)
-                basename = info.filename.replace("\\", "/").rsplit("/", 1)[-1]
-                if basename.startswith("._") or "__MACOSX" in info.filename:
-                    logger.debug("ZIP member %s: skipping macOS metadata file", info.filename)
-                    continue
-                name_lower = info.filename.lower()
-                if not any(name_lower.endswith(ext) for ext in _ZIP_SUPPORTED_EXTENSIONS):
-                    logger.debug("ZIP member %s: unsupported type, skipping", info.filename)
-                    continue
-                try:
-                    data = zf.read(info.filename)
-                except Exception as e:
-                    logger.warning("Could not read ZIP member %s: %s", info.filename, e)
-                    continue
-                ext = name_lower.rsplit(".", 1)[-1]
-                ct_map = {
-                    "pdf": "application/pdf",
-                    "jpg": "image/jpeg", "jpeg": "image/jpeg",
-                    "png": "image/png",
-                    "tiff": "image/tiff",
-                    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    "xls": "application/vnd.ms-excel",
-                }
-                content_type = ct_map.get(ext, "application/octet-stream")
-                members.append(Attachment(
-                    name=basename,
-                    content_type=content_type,
-                    content_bytes=data,
-                ))
+        magic, name_len, extra_len = _ZIP_LOCAL_HEADER.unpack_from(archive, offset)
+    except struct.error:
+        raise zipfile.BadZipFile(f"truncated local header for {info.filename}") from None
+    if magic != b"PK\x03\x04":
+        raise zipfile.BadZipFile(f"bad local header magic for {info.filename}")
+    start = offset + _ZIP_LOCAL_HEADER.size + name_len + extra_len
+    raw = memoryview(archive)[start:start + info.compress_size]
+    data = _isal_zlib.decompressobj(-15).decompress(raw, _ZIP_MAX_MEMBER_BYTES + 1)
+    if len(data) > _ZIP_MAX_MEMBER_BYTES:
+        raise ValueError(f"decompressed size exceeds {_ZIP_MAX_MEMBER_BYTES} bytes")
+    if _isal_zlib.crc32(data) != info.CRC:
+        raise zipfile.BadZipFile(f"bad CRC-32 for {info.filename}")
+    return data
+
+
+def _read_zip_member(
+    info: zipfile.ZipInfo,
+    zf: zipfile.ZipFile | None = None,
+    archive: bytes | None = None,
+) -> bytes:
+    """
+    Decompress one member in chunks, raising ValueError as soon as it grows
+    past _ZIP_MAX_MEMBER_BYTES (the declared file_size can't be trusted).
+    Reads from zf, or from the calling worker thread's ZipFile by default.
+    Small unencrypted deflated members take the ISA-L path when archive (the
+    raw ZIP bytes) is available.
+    """
+    if zf is None:
+        zf = _zip_local.zf
+        archive = _zip_local.archive
+    if (
+        _isal_zlib is not None
+        and archive is not None
+        and info.compress_type == zipfile.ZIP_DEFLATED
+        and info.file_size < _ZIP_FAST_INFLATE_MAX
+        and not info.flag_bits & 0x1  # encrypted
+    ):
+        return _inflate_zip_member(archive, info)
+    chunks: list[bytes] = []
+    size = 0
+    # Open by ZipInfo: no by-name lookup in the central directory
+    with zf.open(info) as fh:
+        while chunk := fh.read(_ZIP_READ_CHUNK):
+            size += len(chunk)
+            if size > _ZIP_MAX_MEMBER_BYTES:
+                raise ValueError(f"decompressed size exceeds {_ZIP_MAX_MEMBER_BYTES} bytes")
+            chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def _iter_zip_members(attachment: Attachment) -> Iterator[Attachment]:
+    """
+    Yield each supported file of a ZIP attachment as an individual Attachment,
+    preserving the original content_type. Nested ZIPs are skipped.
+
+    Members are decompressed on a small thread pool, at most _ZIP_WORKERS
+    ahead of the caller, and yielded in archive order — so only the archive
+    and a handful of members are held in memory at once.
+    """
+    try:
+        # BytesIO shares an immutable bytes buffer (no copy) until written to
+        zf = zipfile.ZipFile(io.BytesIO(attachment.content_bytes))
     except zipfile.BadZipFile as e:
         logger.warning("Could not open ZIP %s: %s", attachment.name, e)
-    return members
+        return
+    candidates: list[tuple[zipfile.ZipInfo, str, str]] = []
+    with zf:
+        # Resolved once: archives can hold thousands of skipped entries
+        debug = logger.isEnabledFor(logging.DEBUG)
+        for info in zf.infolist():
+            if info.is_dir():
+                continue
+            fn = info.filename
+            # Skip macOS resource fork files (.__MACOSX/, ._filename)
+            if "__MACOSX" in fn:
+                if debug:
+                    logger.debug("ZIP member %s: skipping macOS metadata file", fn)
+                continue
+            # ZIP paths use "/", but some Windows tools write "\\"
+            basename = fn.rpartition("/")[2].rpartition("\\")[2]
+            if basename.startswith("._"):
+                if debug:
+                    logger.debug("ZIP member %s: skipping macOS metadata file", fn)
+                continue
+            _, dot, ext = basename.rpartition(".")
+            content_type = _EXT_TO_CT.get(ext.lower()) if dot else None
+            if content_type is None:
+                if debug:
+                    logger.debug("ZIP member %s: unsupported type, skipping", fn)
+                continue
+            if info.file_size > _ZIP_MAX_MEMBER_BYTES:
+                logger.warning("ZIP member %s: too large (%d bytes), skipping", fn, info.file_size)
+                continue
+            candidates.append((info, basename, content_type))
+
+        if len(candidates) == 1:
+            # Single member (the common case): decompress inline, no pool
+            info, basename, content_type = candidates[0]
+            try:
+                data = _read_zip_member(info, zf, attachment.content_bytes)
+            except Exception as e:
+                logger.warning("Could not read ZIP member %s: %s", info.filename, e)
+                return
+            yield Attachment(name=basename, content_type=content_type, content_bytes=data)
+            return
+    if not candidates:
+        return
+
+    remaining = iter(candidates)
+    total_bytes = 0
+    with ThreadPoolExecutor(
+        max_workers=_ZIP_WORKERS,
+        initializer=_open_worker_zip,
+        initargs=(attachment.content_bytes,),
+    ) as pool:
+        pending = deque(
+            (c, pool.submit(_read_zip_member, c[0])) for c in islice(remaining, _ZIP_WORKERS)
+        )
+        while pending:
+            (info, basename, content_type), future = pending.popleft()
+            nxt = next(remaining, None)
+            if nxt is not None:
+                pending.append((nxt, pool.submit(_read_zip_member, nxt[0])))
+            try:
+                data = future.result()
+            except Exception as e:
+                logger.warning("Could not read ZIP member %s: %s", info.filename, e)
+                continue
+            total_bytes += len(data)
+            if total_bytes > _ZIP_MAX_TOTAL_BYTES:
+                logger.warning(
+                    "ZIP %s: decompressed size exceeds %d bytes, ignoring remaining members",
+                    attachment.name, _ZIP_MAX_TOTAL_BYTES,
+                )
+                return
+            yield Attachment(
+                name=basename,
+                content_type=content_type,
+                content_bytes=data,
+            )
+
+
+def _is_zip(attachment: Attachment) -> bool:
+    """
+    Return True if the attachment is a ZIP archive to unpack.
+
+    Sniffs the content first so renamed archives are caught. XLSX files are
+    ZIP containers too, so a ZIP signature on a supported document (by name
+    or declared MIME type) doesn't count. Falls back to the declared MIME
+    type / .zip extension.
+    """
+    if attachment.content_bytes.startswith(_ZIP_MAGIC):
+        if attachment.ct_main in _SUPPORTED_CTS:
+            return False
+        _, dot, ext = attachment.name.rpartition(".")
+        return not (dot and ext.lower() in _EXT_TO_CT)
+    return (
+        attachment.ct_main in _ZIP_CTS
+        or attachment.name[-4:].lower() == ".zip"
+    )
+
+
+def _unpack_zip(attachment: Attachment) -> list[Attachment]:
+    """Extract all supported files from a ZIP attachment (see _iter_zip_members)."""
+    return list(_iter_zip_members(attachment))
+
+
+@lru_cache(maxsize=1024)
+def _parse_iso_date(value: str) -> datetime | None:
+    """Parse an ISO date string, or return None if it is not one. Invoices often share dates."""
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
 
 
 def process_attachment(
@@ -76,62 +265,128 @@ def process_attachment(
     data_dir: str,
     client_id: str,
     root_folder_name: str,
+    sender_suppliers: dict[str, str] | None = None,
 ) -> str:
     """
     Classify a single attachment and upload it to the appropriate OneDrive folder.
-    ZIP files are unpacked and each member is processed individually — the ZIP
-    itself is never uploaded.
+    ZIP files are unpacked and each member is processed individually via
+    _process_single — the ZIP itself is never uploaded.
 
     Returns the status string: "invoice", "review", or "rejected".
     For ZIPs, returns "invoice" if at least one member was an invoice.
 
+    sender_suppliers is the resolved invoices.sender_suppliers map; callers
+    processing many attachments should resolve it once and pass it in,
+    otherwise it is read from config on every call.
+
     Raises on unexpected errors — callers should catch and log.
     """
-    # --- ZIP: unpack and recurse into each member ---
-    name_lower = attachment.name.lower()
-    ct = normalize_content_type(attachment.content_type)
-    if ct in ("application/zip", "application/x-zip-compressed") or name_lower.endswith(".zip"):
-        members = _unpack_zip(attachment)
-        if not members:
+    # Look up canonical supplier hint for this sender (shared by all ZIP members)
+    if sender_suppliers is None:
+        sender_suppliers = (config.get("invoices") or {}).get("sender_suppliers") or {}
+    hint_supplier: str | None = sender_suppliers.get(email.sender_key)
+
+    # --- ZIP: unpack and process each member ---
+    if _is_zip(attachment):
+        logger.info("ZIP %s: unpacking members for individual classification", attachment.name)
+        members = _iter_zip_members(attachment)
+        first = next(members, None)
+        if first is None:
             logger.info("ZIP %s: no supported members found, skipping", attachment.name)
             return "rejected"
-        logger.info("ZIP %s: unpacking %d member(s) for individual classification", attachment.name, len(members))
-        any_invoice = False
-        for member in members:
+        member_kwargs = dict(
+            email=email,
+            year=year,
+            month=month,
+            config=config,
+            data_dir=data_dir,
+            client_id=client_id,
+            root_folder_name=root_folder_name,
+            hint_supplier=hint_supplier,
+        )
+
+        second = next(members, None)
+        if second is None:
+            # Single-member archive (the common case): no pool, no batching
             try:
-                member_status = process_attachment(
-                    attachment=member,
-                    email=email,
-                    year=year,
-                    month=month,
-                    config=config,
-                    data_dir=data_dir,
-                    client_id=client_id,
-                    root_folder_name=root_folder_name,
-                )
-                if member_status == "invoice":
-                    any_invoice = True
+                status = _process_single(attachment=first, **member_kwargs)
             except Exception as e:
-                logger.error("Failed to process ZIP member %s: %s", member.name, e, exc_info=True)
+                logger.error("Failed to process ZIP member %s: %s", first.name, e, exc_info=True)
+                return "rejected"
+            return "invoice" if status == "invoice" else "rejected"
+
+        max_workers = max(1, int((config.get("onedrive") or {}).get("upload_concurrency", 4)))
+        any_invoice = False
+        in_flight: dict[Future, str] = {}
+
+        def _collect(done) -> None:
+            nonlocal any_invoice
+            for future in done:
+                member_name = in_flight.pop(future)
+                try:
+                    if future.result() == "invoice":
+                        any_invoice = True
+                except Exception as e:
+                    logger.error("Failed to process ZIP member %s: %s", member_name, e, exc_info=True)
+
+        # Classify and upload members concurrently, with at most max_workers in flight
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for member in chain((first, second), members):
+                if len(in_flight) >= max_workers:
+                    _collect(wait(in_flight, return_when=FIRST_COMPLETED).done)
+                future = pool.submit(
+                    _process_single, attachment=member, **member_kwargs,
+                )
+                in_flight[future] = member.name
+            _collect(wait(in_flight).done)
         return "invoice" if any_invoice else "rejected"
 
-    # --- Normal (non-ZIP) attachment ---
+    return _process_single(
+        attachment=attachment,
+        email=email,
+        year=year,
+        month=month,
+        config=config,
+        data_dir=data_dir,
+        client_id=client_id,
+        root_folder_name=root_folder_name,
+        hint_supplier=hint_supplier,
+    )
+
+
+def _process_single(
+    attachment: Attachment,
+    email: Email,
+    year: int,
+    month: int,
+    config: dict,
+    data_dir: str,
+    client_id: str,
+    root_folder_name: str,
+    hint_supplier: str | None,
+) -> str:
+    """
+    Classify and upload one non-ZIP attachment (a top-level attachment or a
+    ZIP member). Returns "invoice", "review", or "rejected".
+    """
     logger.info(
         "Processing attachment: file=%r type=%s size=%d bytes from=%s",
         attachment.name,
-        attachment.content_type.split(";")[0].strip(),
+        attachment.ct_main,
         len(attachment.content_bytes),
         email.sender,
     )
 
-    # Look up canonical supplier hint for this sender
-    sender_key = email.sender.lower().strip()
-    sender_suppliers: dict[str, str] = (config.get("invoices") or {}).get("sender_suppliers") or {}
-    hint_supplier: str | None = sender_suppliers.get(sender_key)
-
-    status, invoice_date, doc_supplier, amount_ht, amount_ttc, amount_tva, currency = is_invoice(
-        attachment, config, hint_supplier=hint_supplier
-    )
+    if can_classify(attachment):
+        status, invoice_date, doc_supplier, amount_ht, amount_ttc, amount_tva, currency = is_invoice(
+            attachment, config, hint_supplier=hint_supplier
+        )
+    else:
+        # Nothing the classifier can read — skip it and route straight to review
+        logger.info("Unsupported type for classification: file=%r, routing to review", attachment.name)
+        status, invoice_date, doc_supplier, amount_ht, amount_ttc, amount_tva, currency = (
+            "review", None, None, None, None, None, None
+        )
 
     # Use AI-extracted supplier name for folder/filename (falls back to sender domain in uploader)
     filename_supplier: str | None = doc_supplier
@@ -139,14 +394,14 @@ def process_attachment(
     # Derive folder year/month from invoice date when available
     inv_year, inv_month = year, month
     if invoice_date:
-        try:
-            inv_dt = datetime.fromisoformat(invoice_date)
+        inv_dt = _parse_iso_date(invoice_date)
+        if inv_dt is not None:
             inv_year, inv_month = inv_dt.year, inv_dt.month
             logger.info(
                 "Using invoice date %s for %s (received %s)",
                 invoice_date, attachment.name, email.received_at,
             )
-        except ValueError:
+        else:
             logger.warning(
                 "Could not parse invoice_date %r for %s — falling back to received date",
                 invoice_date, attachment.name,
@@ -178,6 +433,7 @@ def process_attachment(
             month=inv_month,
             invoice_date=invoice_date,
             supplier=filename_supplier,
+            data_dir=data_dir,
         )
         db.save_invoice(
             data_dir,
@@ -218,5 +474,6 @@ def process_attachment(
             month=inv_month,
             invoice_date=invoice_date,
             supplier=filename_supplier,
+            data_dir=data_dir,
         )
     return status
@@ -7,17 +7,38 @@ and returns them for further processing.
 """
 
 import base64
+import html
 import ipaddress
 import logging
 import mimetypes
 import re
 import socket
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass, field
 from datetime import datetime, timezone
-from html.parser import HTMLParser
-from urllib.parse import urlparse
+from functools import cached_property, lru_cache
+from urllib.parse import quote, unquote, urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    from selectolax.parser import HTMLParser as _FastHTMLParser
+except ImportError:  # optional — C-backed HTML parsing when installed
+    _FastHTMLParser = None
+
+try:
+    import lxml.html as _lxml_html
+    from lxml.etree import ParserError as _LxmlParserError
+except ImportError:  # optional — used when selectolax is not installed
+    _lxml_html = None
+else:
+    # Bodies are fed as UTF-8 bytes: lxml rejects str input that carries an
+    # XML encoding declaration, and the declared charset no longer applies
+    _LXML_PARSER = _lxml_html.HTMLParser(encoding="utf-8")
 
 from auth_setup import get_access_token
 from utils import GRAPH_BASE, normalize_content_type
@@ -25,7 +46,7 @@ from utils import GRAPH_BASE, normalize_content_type
 logger = logging.getLogger(__name__)
 
 # MIME types considered as invoice attachments
-INVOICE_MIME_TYPES = {
+INVOICE_MIME_TYPES = frozenset({
     "application/pdf",
     "application/x-pdf",  # non-standard alias used by some mail servers
     "image/jpeg",
@@ -35,7 +56,7 @@ INVOICE_MIME_TYPES = {
     "application/vnd.ms-excel",  # xls
     "application/zip",
     "application/x-zip-compressed",
-}
+})
 
 # Fallback extension map for download filename guessing
 _MIME_TO_EXT = {
@@ -50,34 +71,85 @@ _MIME_TO_EXT = {
     "application/x-zip-compressed": ".zip",
 }
 
+# Bare URLs in plain-text bodies (and HTML the parser choked on)
+_URL_RE = re.compile(r'https?://[^\s"\'<>]+')
+
+# Content-Disposition filename parameters: RFC 5987 filename*= first, then filename=
+_CD_FILENAME_STAR_RE = re.compile(r"filename\*\s*=\s*(?:[^']*'[^']*')?([^;]+)", re.IGNORECASE)
+_CD_FILENAME_RE = re.compile(r'filename\s*=\s*"?([^";\r\n]+)"?', re.IGNORECASE)
+
+# href of each <a> tag (double-quoted, single-quoted or bare value)
+_HREF_RE = re.compile(
+    r"""<a\s[^>]*?(?<![\w-])href\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""",
+    re.IGNORECASE,
+)
+
 
 # ---------------------------------------------------------------------------
-# HTML link extractor (stdlib html.parser — no extra dependency)
+# HTML link extractors (selectolax / lxml when installed, else a regex scan)
 # ---------------------------------------------------------------------------
 
-class _AnchorExtractor(HTMLParser):
-    """Minimal HTML parser that collects all href values from <a> tags."""
+class _AnchorExtractor:
+    """
+    Collects href values from <a> tags with a single regex pass per feed().
 
-    def __init__(self):
-        super().__init__()
+    If keywords (lowercase) are given, only hrefs containing at least one of
+    them are kept, so non-matching links are dropped as they are found.
+    Tags must not be split across feed() calls — pass the whole document.
+    """
+
+    __slots__ = ("links", "_keywords")
+
+    def __init__(self, keywords: list[str] | None = None):
         self.links: list[str] = []
+        self._keywords = keywords
 
-    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
-        if tag == "a":
-            for attr, value in attrs:
-                if attr == "href" and value:
-                    self.links.append(value)
+    def feed(self, data: str) -> None:
+        keywords = self._keywords
+        for m in _HREF_RE.finditer(data):
+            value = m[m.lastindex]
+            if not value:
+                continue
+            if "&" in value:
+                value = html.unescape(value)
+            if keywords is not None:
+                value_lower = value.lower()
+                if not any(kw in value_lower for kw in keywords):
+                    continue
+            self.links.append(value)
+
+
+def _fast_html_hrefs(content: str) -> list[str] | None:
+    """
+    Return the href of every <a> tag using selectolax or lxml, whichever is
+    installed, or None when neither is (the caller then uses _AnchorExtractor).
+    """
+    if _FastHTMLParser is not None:
+        tree = _FastHTMLParser(content)
+        return [href for a in tree.css("a[href]") if (href := a.attributes.get("href"))]
+    if _lxml_html is not None:
+        try:
+            root = _lxml_html.fromstring(content.encode("utf-8"), parser=_LXML_PARSER)
+        except _LxmlParserError:  # "Document is empty": blank or comment-only body
+            return []
+        return [str(href) for href in root.xpath("//a/@href") if href]
+    return None
 
 
 # ---------------------------------------------------------------------------
 # Dataclasses
 # ---------------------------------------------------------------------------
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Attachment:
     name: str
     content_type: str
     content_bytes: bytes
+    # content_type without parameters, lowercased (e.g. "application/pdf")
+    ct_main: str = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "ct_main", normalize_content_type(self.content_type))
 
 
 @dataclass
@@ -88,45 +160,171 @@ class Email:
     received_at: str  # ISO 8601
     attachments: list[Attachment] = field(default_factory=list)
 
-    @property
+    @cached_property
     def received_datetime(self) -> datetime:
-        return datetime.fromisoformat(self.received_at.replace("Z", "+00:00"))
+        # fromisoformat accepts the trailing "Z" natively since Python 3.11
+        return datetime.fromisoformat(self.received_at)
+
+    @cached_property
+    def sender_key(self) -> str:
+        """Normalized sender address used for per-sender config lookups."""
+        return self.sender.lower().strip()
 
 
 # ---------------------------------------------------------------------------
 # Graph client
 # ---------------------------------------------------------------------------
 
+# Retries for idempotent Graph GETs: throttling (429, honouring Retry-After)
+# and transient 5xx. The final response is returned so raise_for_status applies.
+_GRAPH_RETRY = Retry(
+    total=5,
+    backoff_factor=0.5,
+    status_forcelist=(429, 500, 502, 503, 504),
+    raise_on_status=False,
+)
+
+
+def _make_session(pool_maxsize: int, max_retries: Retry | int = 0) -> requests.Session:
+    """Return a keep-alive Session with a sized connection pool for http(s)."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=max_retries)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Graph's hard cap on sub-requests per $batch call
+_BATCH_LIMIT = 20
+
+# Concurrent attachment / link downloads per page of messages
+_FETCH_WORKERS = 8
+
+# Max messages per page when attachments are expanded inline
+_EXPAND_PAGE_SIZE = 50
+
+# Max messages per page of a plain (metadata and body only) listing
+_LIST_PAGE_SIZE = 1000
+
+# Max messages per delta page (delta queries cannot expand attachments, so
+# pages only carry metadata and bodies)
+_DELTA_PAGE_SIZE = 200
+
+# Attachments at least this large are downloaded raw from /$value instead of
+# base64-encoded inside a $batch response
+_RAW_FETCH_MIN_BYTES = 1024 * 1024
+
+# Invoice link downloads: size cap (same 20 MB as file attachments) and read chunk
+_MAX_DOWNLOAD_BYTES = 20 * 1024 * 1024
+_DOWNLOAD_CHUNK = 64 * 1024
+
+# Characters left readable when percent-encoding a $filter value
+_FILTER_SAFE = "'(),:"
+
+# receivedDateTime floor used when no `since` is configured: Graph only accepts
+# a $filter next to $orderby=receivedDateTime if the filter starts with it
+_RECEIVED_FLOOR = "1900-01-01T00:00:00Z"
+
+# Hostnames found to resolve to a private address: {host: expires_at}.
+# Only rejections are cached — a public verdict could be rebound to a private
+# address before the download, so those hosts are resolved on every check.
+_PRIVATE_HOST_TTL = 60.0
+_PRIVATE_HOST_CACHE_MAX = 1024
+_private_host_cache: dict[str, float] = {}
+
+
 class GraphClient:
     def __init__(self, client_id: str):
         self.client_id = client_id
-        self._token: str | None = None
+        # Keep-alive sessions reuse TCP+TLS connections across calls: one for
+        # Graph, a separate one for external invoice download links.
+        self._session = _make_session(pool_maxsize=32, max_retries=_GRAPH_RETRY)
+        self._download_session = _make_session(pool_maxsize=8)
+        # (token, headers) for the last token seen, rebuilt only when it changes.
+        # Kept as one tuple so concurrent readers never pair mismatched values.
+        self._auth_headers: tuple[str, dict] | None = None
 
     def _get_token(self) -> str:
-        if self._token is None:
-            self._token = get_access_token(self.client_id)
-        return self._token
+        # get_access_token reuses the process-wide token until it nears expiry
+        return get_access_token(self.client_id)
 
     def _headers(self) -> dict:
-        return {
-            "Authorization": f"Bearer {self._get_token()}",
-            "Content-Type": "application/json",
-        }
+        """Return the request headers for the current token (shared — do not mutate)."""
+        token = self._get_token()
+        cached = self._auth_headers
+        if cached is None or cached[0] != token:
+            cached = (token, {
+                "Authorization": f"Bearer {token}",
+                "Content-Type": "application/json",
+            })
+            self._auth_headers = cached
+        return cached[1]
 
     def _refresh_token(self) -> None:
         """Force a token refresh on 401."""
-        self._token = get_access_token(self.client_id)
+        get_access_token(self.client_id, force_refresh=True)
 
-    def _get(self, url: str, **kwargs) -> dict:
+    def _request(self, method: str, url: str, extra_headers: dict | None = None, **kwargs) -> requests.Response:
+        """
+        Send a Graph request and return the successful response.
+
+        Throttling and 5xx retries happen in the session's urllib3 Retry; the
+        only thing handled here is a 401, retried once with a refreshed token.
+        """
+        send = getattr(self._session, method)
         for attempt in range(2):
-            resp = requests.get(url, headers=self._headers(), timeout=30, **kwargs)
-            if resp.status_code == 401 and attempt == 0:
-                logger.warning("Token expired, refreshing...")
-                self._refresh_token()
-                continue
-            resp.raise_for_status()
-            return resp.json()
-        raise RuntimeError("Graph API request failed after token refresh")
+            headers = self._headers()
+            if extra_headers:
+                headers = {**headers, **extra_headers}
+            resp = send(url, headers=headers, **kwargs)
+            if resp.status_code != 401 or attempt == 1:
+                break
+            logger.warning("Token expired, refreshing...")
+            self._refresh_token()
+        resp.raise_for_status()
+        return resp
+
+    def _post(self, url: str, payload: dict) -> dict:
+        return self._request("post", url, json=payload, timeout=60).json()
+
+    def _get_many(self, paths: list[str]) -> list[dict | None]:
+        """
+        GET several Graph paths (relative to GRAPH_BASE, e.g. "/me/messages/x")
+        through JSON batching, _BATCH_LIMIT sub-requests per round trip.
+
+        Returns the response bodies in the order of paths, with None for
+        sub-requests that failed. Throttled (429) or 5xx sub-requests are
+        retried individually, where the session honours Retry-After.
+        """
+        results: list[dict | None] = [None] * len(paths)
+        for start in range(0, len(paths), _BATCH_LIMIT):
+            payload = {
+                "requests": [
+                    {"id": str(i), "method": "GET", "url": paths[i]}
+                    for i in range(start, min(start + _BATCH_LIMIT, len(paths)))
+                ]
+            }
+            data = self._post(f"{GRAPH_BASE}/$batch", payload)
+            for sub in data.get("responses", []):
+                idx = int(sub["id"])
+                status = sub.get("status", 0)
+                if status == 200:
+                    results[idx] = sub.get("body")
+                elif status == 429 or status >= 500:
+                    try:
+                        results[idx] = self._get(f"{GRAPH_BASE}{paths[idx]}")
+                    except requests.HTTPError as e:
+                        logger.warning("Graph request %s failed after retry: %s", paths[idx], e)
+                else:
+                    logger.warning("Batched Graph request %s failed: status=%s", paths[idx], status)
+        return results
+
+    def _get_raw(self, url: str) -> bytes:
+        """GET a binary Graph resource (e.g. an attachment's /$value)."""
+        return self._request("get", url, timeout=60).content
+
+    def _get(self, url: str, extra_headers: dict | None = None, **kwargs) -> dict:
+        return self._request("get", url, extra_headers, timeout=30, **kwargs).json()
 
     # -----------------------------------------------------------------------
     # Public fetch method
@@ -139,6 +337,7 @@ class GraphClient:
         link_keywords: list[str] | None = None,
         subject_keywords: list[str] | None = None,
         max_results: int | None = 50,
+        delta_links: dict[str, str] | None = None,
     ) -> list[Email]:
         """
         Fetch emails from inbox (and junk folder for whitelisted senders)
@@ -154,6 +353,11 @@ class GraphClient:
                                   subject are always passed through.
                                   None = all subjects accepted.
             max_results:          Max emails per page (None = no cap).
+            delta_links:          Delta links saved by the previous poll. If given,
+                                  folders are read incrementally through delta
+                                  queries and the dict is updated in place with
+                                  the new links, to be saved once the returned
+                                  emails are processed. None = full scan.
         """
         keywords = [k.lower() for k in (link_keywords or [])]
         sender_filter = set(whitelisted_senders) if whitelisted_senders else None
@@ -170,6 +374,7 @@ class GraphClient:
             since=since,
             max_results=max_results,
             whitelisted_only=False,
+            delta_links=delta_links,
         )
         emails.extend(inbox_emails)
 
@@ -186,6 +391,7 @@ class GraphClient:
                     since=since,
                     max_results=max_results,
                     whitelisted_only=True,
+                    delta_links=delta_links,
                 )
                 emails.extend(folder_emails)
                 extra_pages[folder] = folder_pages
@@ -210,6 +416,7 @@ class GraphClient:
         since: str | None,
         max_results: int | None,
         whitelisted_only: bool,
+        delta_links: dict[str, str] | None = None,
     ) -> tuple[list[Email], int]:
         """
         Scan a single mail folder and return qualifying emails.
@@ -223,11 +430,21 @@ class GraphClient:
             max_results:      Page size cap.
             whitelisted_only: If True, only process emails from whitelisted senders
                               (used for junk folder to avoid processing spam).
+            delta_links:      If given, read the folder through a delta query,
+                              resuming from the stored link, and store the new one.
+                              The link is not advanced if an attachment or link
+                              download failed transiently, so the next poll
+                              replays the folder's changes. This only recovers
+                              emails whose every download failed (they were
+                              never returned or marked processed); an email
+                              with at least one attachment fetched is processed
+                              and marked now, so its failed ones are not retried.
 
         Returns:
             Tuple of (list of qualifying emails, number of pages fetched).
         """
         folder_label = "junk" if folder == "junkemail" else folder
+        delta = delta_links is not None
 
         # Filtering logic:
         #   - If sender is whitelisted -> always accept (skip subject check)
@@ -235,113 +452,215 @@ class GraphClient:
         #   - Else if subject_filter set and subject non-empty -> must match a keyword
         #   - Else (no filters set, or empty subject) -> accept
 
-        # Build OData filter
-        filters: list[str] = []
-        if since:
-            filters.append(f"receivedDateTime gt {since}")
-
-        filter_clause = f"&$filter={' and '.join(filters)}" if filters else ""
-
-        page_size = min(max_results, 1000) if max_results is not None else 1000
+        # Without a whitelist every sender goes through the subject filter, so
+        # let Graph apply it and skip shipping bodies of non-matching emails.
+        # The client-side check below stays as the authoritative filter.
+        # Delta queries only support a receivedDateTime filter.
+        server_subject = bool(subject_filter) and sender_filter is None and not whitelisted_only and not delta
+
+        # Expand attachment contents into the page only when every sender can
+        # qualify: with a whitelist most messages are dropped client-side, so
+        # their attachments are fetched per message only once they pass.
+        expand = not delta and sender_filter is None and not whitelisted_only
+
+        # Expanded pages carry attachment contents, so keep them small enough
+        # to avoid gateway timeouts on large mailboxes.
+        if delta:
+            max_page = _DELTA_PAGE_SIZE
+        else:
+            max_page = _EXPAND_PAGE_SIZE if expand else _LIST_PAGE_SIZE
+        page_size = min(max_results, max_page) if max_results is not None else max_page
+
+        # The body is only read for link extraction, and is often the bulk of a page
+        select = "id,sender,subject,receivedDateTime,hasAttachments"
+        if keywords:
+            select += ",body"
+
+        # A delta link replays the query it was created from, so key it on
+        # everything that shapes that query
+        delta_key = f"{folder}|{select}|{since or ''}"
+        stored_link = delta_links.get(delta_key) if delta else None
+
+        def build_url(with_subject: bool) -> str:
+            if delta:
+                since_clause = f"&$filter=receivedDateTime ge {since}" if since else ""
+                return f"{GRAPH_BASE}/me/mailFolders/{folder}/messages/delta?$select={select}{since_clause}"
+
+            # Build OData filter
+            filters: list[str] = []
+            if since:
+                filters.append(f"receivedDateTime gt {since}")
+            elif with_subject:
+                filters.append(f"receivedDateTime ge {_RECEIVED_FLOOR}")
+            if with_subject:
+                filters.append(_subject_filter_clause(subject_filter))
+
+            # Percent-encoded: subject keywords may contain "+", "&" or "#"
+            filter_clause = f"&$filter={quote(' and '.join(filters), safe=_FILTER_SAFE)}" if filters else ""
+            expand_clause = "&$expand=attachments" if expand else ""
+
+            return (
+                f"{GRAPH_BASE}/me/mailFolders/{folder}/messages"
+                f"?$select={select}"
+                f"{expand_clause}"
+                f"{filter_clause}"
+                f"&$orderby=receivedDateTime desc"
+                f"&$top={page_size}"
+            )
 
-        url: str | None = (
-            f"{GRAPH_BASE}/me/mailFolders/{folder}/messages"
-            f"?$select=id,sender,subject,receivedDateTime,hasAttachments,body"
-            f"{filter_clause}"
-            f"&$orderby=receivedDateTime desc"
-            f"&$top={page_size}"
-        )
+        url: str | None = stored_link or build_url(server_subject)
+        extra_headers = {"Prefer": f"odata.maxpagesize={page_size}"} if delta else None
 
         emails: list[Email] = []
         page_count = 0
+        new_delta_link: str | None = None
+        # Set by fetch helpers on a transient failure (network, throttling, 5xx)
+        fetch_failed = threading.Event()
+        next_page: Future | None = None
+        with ThreadPoolExecutor(max_workers=_FETCH_WORKERS) as pool:
+            while url:
+                page_count += 1
+                logger.info("Fetching %s page %d", folder_label, page_count)
+                if next_page is not None:
+                    data = next_page.result()
+                else:
+                    try:
+                        data = self._get(url, extra_headers)
+                    except requests.HTTPError as e:
+                        status = e.response.status_code if e.response is not None else None
+                        if page_count == 1 and stored_link and status in (400, 404, 410):
+                            # Expired or invalid delta token: start a fresh sync
+                            logger.warning(
+                                "Delta link for %s rejected (%s), starting a full sync", folder_label, e
+                            )
+                            stored_link = None
+                        elif page_count == 1 and server_subject and status == 400:
+                            # Some mailboxes reject contains() on subject: filter locally
+                            logger.warning(
+                                "Server-side subject filter rejected for %s (%s), filtering locally",
+                                folder_label, e,
+                            )
+                            server_subject = False
+                        else:
+                            raise
+                        url = build_url(False)
+                        data = self._get(url, extra_headers)
+
+                # Handle pagination: request the next page now so it downloads
+                # while this one is processed. A delta sync ends with the link
+                # for the next poll instead.
+                url = data.get("@odata.nextLink")
+                if url is None:
+                    new_delta_link = data.get("@odata.deltaLink")
+                    next_page = None
+                else:
+                    next_page = pool.submit(self._get, url, extra_headers)
+
+                messages = data.get("value", [])
+                logger.debug("%s page %d: %d message(s) returned", folder_label, page_count, len(messages))
+
+                # Filter the page, submitting each kept message's attachment and
+                # link downloads to the pool so they run concurrently
+                queued: list[tuple[Email, list[Attachment] | Future | None, list[Future]]] = []
+                for msg in messages:
+                    if "@removed" in msg:
+                        continue  # delta entry for a deleted or moved message
+                    sender_address = (
+                        msg.get("sender", {})
+                        .get("emailAddress", {})
+                        .get("address", "")
+                        .lower()
+                        .strip()
+                    )
 
-        while url:
-            page_count += 1
-            logger.info("Fetching %s page %d", folder_label, page_count)
-            data = self._get(url)
-            messages = data.get("value", [])
-            logger.debug("%s page %d: %d message(s) returned", folder_label, page_count, len(messages))
-
-            for msg in messages:
-                sender_address = (
-                    msg.get("sender", {})
-                    .get("emailAddress", {})
-                    .get("address", "")
-                    .lower()
-                    .strip()
-                )
-
-                subject = msg.get("subject") or ""
-                sender_whitelisted = sender_filter is not None and sender_address in sender_filter
+                    subject = msg.get("subject") or ""
+                    sender_whitelisted = sender_filter is not None and sender_address in sender_filter
 
-                if not sender_whitelisted:
-                    if whitelisted_only or sender_filter is not None:
-                        # Junk folder: only whitelisted senders allowed
-                        # Inbox with whitelist: sender not in whitelist -> skip
-                        logger.debug(
-                            "Skipping email from %s in %s (not whitelisted)", sender_address, folder_label
-                        )
-                        continue
-                    # No whitelist: apply subject keyword filter if configured
-                    if subject_filter and subject.strip():
-                        subject_lower = subject.lower()
-                        if not any(kw in subject_lower for kw in subject_filter):
+                    if not sender_whitelisted:
+                        if whitelisted_only or sender_filter is not None:
+                            # Junk folder: only whitelisted senders allowed
+                            # Inbox with whitelist: sender not in whitelist -> skip
                             logger.debug(
-                                "Skipping email from %s — subject %r matched no keywords",
-                                sender_address, subject,
+                                "Skipping email from %s in %s (not whitelisted)", sender_address, folder_label
                             )
                             continue
+                        # No whitelist: apply subject keyword filter if configured
+                        if subject_filter and subject.strip():
+                            subject_lower = subject.lower()
+                            if not any(kw in subject_lower for kw in subject_filter):
+                                logger.debug(
+                                    "Skipping email from %s — subject %r matched no keywords",
+                                    sender_address, subject,
+                                )
+                                continue
+
+                    email = Email(
+                        email_id=msg["id"],
+                        sender=sender_address,
+                        subject=subject,
+                        received_at=msg["receivedDateTime"],
+                    )
 
-                email = Email(
-                    email_id=msg["id"],
-                    sender=sender_address,
-                    subject=subject,
-                    received_at=msg["receivedDateTime"],
-                )
-
-                # --- Step 1: file attachments (skip inline images / logos) ---
-                file_attachments: list[Attachment] = []
-                if msg.get("hasAttachments"):
-                    raw_attachments = self._fetch_attachments(msg["id"])
-                    file_attachments = [
-                        a for a in raw_attachments
-                        if a.content_type in INVOICE_MIME_TYPES
+                    # --- Step 1: file attachments (skip inline images / logos) ---
+                    # Use the contents expanded into the page; fetch separately only
+                    # when the expansion is incomplete.
+                    file_source: list[Attachment] | Future | None = None
+                    if msg.get("hasAttachments"):
+                        file_source = self._expanded_attachments(msg)
+                        if file_source is None:
+                            file_source = pool.submit(self._fetch_attachments, msg["id"], fetch_failed)
+
+                    # --- Step 2: download links from email body ---
+                    link_futures: list[Future] = []
+                    if keywords:
+                        body = msg.get("body", {})
+                        for url_str in self._extract_invoice_links(body, keywords):
+                            link_futures.append(pool.submit(self._download_link, url_str, fetch_failed))
+
+                    queued.append((email, file_source, link_futures))
+
+                # Gather in message order once every fetch for the page is submitted
+                for email, file_source, link_futures in queued:
+                    if isinstance(file_source, Future):
+                        file_source = file_source.result()
+                    file_attachments: list[Attachment] = [
+                        a for a in file_source or []
+                        if a.ct_main in INVOICE_MIME_TYPES
                     ]
+                    link_attachments = [att for f in link_futures if (att := f.result())]
+
+                    email.attachments = file_attachments + link_attachments
+
+                    if email.attachments:
+                        emails.append(email)
+                        logger.info(
+                            "Email queued: from=%s subject=%r received=%s "
+                            "file_attachments=%d link_attachments=%d source=%s",
+                            email.sender,
+                            email.subject,
+                            email.received_at,
+                            len(file_attachments),
+                            len(link_attachments),
+                            folder_label,
+                        )
+                    else:
+                        logger.debug(
+                            "Email from %s subject=%r in %s — no supported attachments or invoice links, skipping",
+                            email.sender,
+                            email.subject,
+                            folder_label,
+                        )
 
-                # --- Step 2: download links from email body ---
-                link_attachments: list[Attachment] = []
-                if keywords:
-                    body = msg.get("body", {})
-                    candidate_urls = self._extract_invoice_links(body, keywords)
-                    for url_str in candidate_urls:
-                        att = self._download_link(url_str)
-                        if att:
-                            link_attachments.append(att)
-
-                email.attachments = file_attachments + link_attachments
-
-                if email.attachments:
-                    emails.append(email)
-                    logger.info(
-                        "Email queued: from=%s subject=%r received=%s "
-                        "file_attachments=%d link_attachments=%d source=%s",
-                        email.sender,
-                        email.subject,
-                        email.received_at,
-                        len(file_attachments),
-                        len(link_attachments),
-                        folder_label,
-                    )
-                else:
-                    logger.debug(
-                        "Email from %s subject=%r in %s — no supported attachments or invoice links, skipping",
-                        sender_address,
-                        subject,
-                        folder_label,
-                    )
-
-            # Handle pagination
-            url = data.get("@odata.nextLink")
+        if delta and new_delta_link:
+            if fetch_failed.is_set():
+                logger.warning(
+                    "Some attachments or links in %s could not be fetched — keeping the "
+                    "previous delta link so emails left without attachments are retried "
+                    "on the next poll",
+                    folder_label,
+                )
+            else:
+                delta_links[delta_key] = new_delta_link
 
         return emails, page_count
 
@@ -349,25 +668,11 @@ class GraphClient:
     # Private helpers
     # -----------------------------------------------------------------------
 
-    def _fetch_attachments(self, message_id: str) -> list[Attachment]:
-        """Fetch all file attachments for a given message, skipping inline ones.
-
-        Graph API does not allow $select=contentBytes on the list endpoint —
-        we first list attachments (metadata only), then fetch contentBytes
-        individually for each qualifying attachment.
-        """
-        list_url = (
-            f"{GRAPH_BASE}/me/messages/{message_id}/attachments"
-            f"?$select=id,name,contentType,size,isInline"
-        )
-        try:
-            data = self._get(list_url)
-        except requests.HTTPError as e:
-            logger.error("Failed to list attachments for message %s: %s", message_id, e)
-            return []
-
-        attachments = []
-        for att in data.get("value", []):
+    @staticmethod
+    def _select_file_attachments(items: list[dict]) -> list[dict]:
+        """Return the attachment metadata worth downloading, applying the skip rules."""
+        wanted: list[dict] = []
+        for att in items:
             # Only process binary file attachments
             if att.get("@odata.type") != "#microsoft.graph.fileAttachment":
                 continue
@@ -390,40 +695,123 @@ class GraphClient:
                     att.get("size"),
                 )
                 continue
+            wanted.append(att)
+
+        return wanted
+
+    @staticmethod
+    def _decode_attachment(meta: dict, detail: dict) -> Attachment | None:
+        """Build an Attachment from a Graph fileAttachment object carrying contentBytes."""
+        content_b64 = detail.get("contentBytes", "")
+        try:
+            content_bytes = base64.b64decode(content_b64)
+        except Exception:
+            logger.warning("Could not decode attachment %s", meta.get("name"), exc_info=True)
+            return None
+
+        att_name = detail.get("name", meta.get("name", "attachment"))
+        att_ct = detail.get("contentType", "application/octet-stream")
+        logger.info(
+            "Attachment fetched: name=%r type=%s size=%d bytes",
+            att_name, att_ct, len(content_bytes),
+        )
+        return Attachment(
+            name=att_name,
+            content_type=att_ct,
+            content_bytes=content_bytes,
+        )
+
+    def _expanded_attachments(self, msg: dict) -> list[Attachment] | None:
+        """
+        Build attachments from a message fetched with $expand=attachments.
+
+        Returns None when the expansion can't be used — missing, paged, or an
+        item without contentBytes (Graph omits it for large files) — so the
+        caller falls back to _fetch_attachments.
+        """
+        expanded = msg.get("attachments")
+        if expanded is None or "attachments@odata.nextLink" in msg:
+            return None
+        wanted = self._select_file_attachments(expanded)
+        if any("contentBytes" not in att for att in wanted):
+            return None
+        return [a for att in wanted if (a := self._decode_attachment(att, att)) is not None]
 
-            # Fetch contentBytes individually
-            # Note: $select cannot be used here — contentBytes is not a property on
-            # the base microsoft.graph.attachment type, so Graph returns 400 if you
-            # try to select it. Fetch the full attachment object instead.
-            att_id = att["id"]
+    def _fetch_attachments(self, message_id: str, failed: threading.Event | None = None) -> list[Attachment]:
+        """Fetch all file attachments for a given message, skipping inline ones.
+
+        Graph API does not allow $select=contentBytes on the list endpoint —
+        we first list attachments (metadata only), then fetch contentBytes
+        for the small ones with one JSON batch request and the raw bytes of
+        large ones from their /$value endpoint.
+
+        Attachments that could not be fetched are left out; if `failed` is
+        given, it is set when one of those failures is worth retrying later.
+        """
+        list_url = (
+            f"{GRAPH_BASE}/me/messages/{message_id}/attachments"
+            f"?$select=id,name,contentType,size,isInline"
+        )
+        try:
+            data = self._get(list_url)
+        except requests.HTTPError as e:
+            logger.error("Failed to list attachments for message %s: %s", message_id, e)
+            if failed is not None and _is_transient(e):
+                failed.set()
+            return []
+
+        wanted = self._select_file_attachments(data.get("value", []))
+        if not wanted:
+            return []
+
+        fetched: dict[str, Attachment] = {}
+
+        # Small attachments: contentBytes for all of them in one $batch call
+        # Note: $select cannot be used here — contentBytes is not a property on
+        # the base microsoft.graph.attachment type, so Graph returns 400 if you
+        # try to select it. Fetch the full attachment object instead.
+        batched = [att for att in wanted if att.get("size", 0) < _RAW_FETCH_MIN_BYTES]
+        if batched:
             try:
-                att_detail = self._get(
-                    f"{GRAPH_BASE}/me/messages/{message_id}/attachments/{att_id}"
+                details = self._get_many(
+                    [f"/me/messages/{message_id}/attachments/{att['id']}" for att in batched]
                 )
             except requests.HTTPError as e:
-                logger.warning("Failed to fetch attachment %s content: %s", att.get("name"), e)
+                logger.error("Failed to fetch attachment contents for message %s: %s", message_id, e)
+                details = [None] * len(batched)
+            for att, att_detail in zip(batched, details):
+                if att_detail is None:
+                    # Listed a moment ago, so treat a missing body as retryable
+                    logger.warning("Failed to fetch attachment %s content", att.get("name"))
+                    if failed is not None:
+                        failed.set()
+                    continue
+                attachment = self._decode_attachment(att, att_detail)
+                if attachment is not None:
+                    fetched[att["id"]] = attachment
+
+        # Large attachments: raw bytes from /$value — no base64 inflation or decode
+        for att in wanted:
+            if att.get("size", 0) < _RAW_FETCH_MIN_BYTES:
                 continue
-
-            content_b64 = att_detail.get("contentBytes", "")
             try:
-                content_bytes = base64.b64decode(content_b64)
-            except Exception:
-                logger.warning("Could not decode attachment %s", att.get("name"), exc_info=True)
+                content_bytes = self._get_raw(
+                    f"{GRAPH_BASE}/me/messages/{message_id}/attachments/{att['id']}/$value"
+                )
+            except requests.RequestException as e:
+                logger.warning("Failed to fetch attachment %s content: %s", att.get("name"), e)
+                if failed is not None and _is_transient(e):
+                    failed.set()
                 continue
-
-            att_name = att_detail.get("name", att.get("name", "attachment"))
-            att_ct = att_detail.get("contentType", "application/octet-stream")
+            att_name = att.get("name", "attachment")
+            att_ct = att.get("contentType", "application/octet-stream")
             logger.info(
                 "Attachment fetched: name=%r type=%s size=%d bytes",
                 att_name, att_ct, len(content_bytes),
             )
-            attachments.append(
-                Attachment(
-                    name=att_name,
-                    content_type=att_ct,
-                    content_bytes=content_bytes,
-                )
-            )
+            fetched[att["id"]] = Attachment(name=att_name, content_type=att_ct, content_bytes=content_bytes)
+
+        attachments = [fetched[att["id"]] for att in wanted if att["id"] in fetched]
 
         logger.debug("Fetched %d attachment(s) for message %s", len(attachments), message_id)
         return attachments
@@ -432,7 +820,8 @@ class GraphClient:
         """
         Extract candidate invoice download URLs from an email body.
 
-        Parses HTML bodies with html.parser; falls back to regex for plain text.
+        Parses HTML bodies with selectolax or lxml when installed (a regex
+        scan of <a href> otherwise); falls back to a bare-URL regex for plain text.
         Only returns URLs whose string contains at least one of the given keywords.
 
         Args:
@@ -449,27 +838,35 @@ class GraphClient:
             return []
 
         raw_urls: list[str] = []
+        keyword_matched = False  # True once raw_urls are known to match a keyword
 
         if content_type == "html":
-            parser = _AnchorExtractor()
             try:
-                parser.feed(content)
-                raw_urls = parser.links
+                fast_urls = _fast_html_hrefs(content)
+                if fast_urls is not None:
+                    raw_urls = fast_urls
+                else:
+                    # The regex extractor applies the keyword filter itself as it sees each href
+                    parser = _AnchorExtractor(keywords)
+                    parser.feed(content)
+                    raw_urls = parser.links
+                    keyword_matched = True
             except Exception as e:
                 logger.warning("HTML parsing failed, falling back to regex: %s", e)
-                raw_urls = re.findall(r'https?://[^\s"\'<>]+', content)
+                raw_urls = _URL_RE.findall(content)
         else:
             # Plain text: extract raw URLs with a simple regex
-            raw_urls = re.findall(r'https?://[^\s"\'<>]+', content)
-
-        # Filter by keywords and deduplicate (preserve order)
-        seen: set[str] = set()
-        filtered: list[str] = []
+            raw_urls = _URL_RE.findall(content)
+
+        # Filter by keywords (unless already done), then deduplicate in order.
+        # The dict keeps the first URL seen for each scheme/host-normalised key.
+        if not keyword_matched:
+            kw_tuple = tuple(keywords)
+            raw_urls = [u for u in raw_urls if any(kw in u.lower() for kw in kw_tuple)]
+        unique: dict[str, str] = {}
         for url in raw_urls:
-            url_lower = url.lower()
-            if any(kw in url_lower for kw in keywords) and url not in seen:
-                seen.add(url)
-                filtered.append(url)
+            unique.setdefault(_url_dedup_key(url), url)
+        filtered = list(unique.values())
 
         if filtered:
             logger.debug(
@@ -487,16 +884,24 @@ class GraphClient:
             hostname = urlparse(url).hostname
             if not hostname:
                 return True
+            now = time.monotonic()
+            if _private_host_cache.get(hostname, 0.0) > now:
+                return True
             addr_info = socket.getaddrinfo(hostname, None, socket.AF_UNSPEC, socket.SOCK_STREAM)
             for _, _, _, _, sockaddr in addr_info:
                 ip = ipaddress.ip_address(sockaddr[0])
                 if ip.is_private or ip.is_loopback or ip.is_reserved or ip.is_link_local:
-                    return True
+                    break
+            else:
+                return False
         except Exception:
-            return True  # unresolvable or any DNS error = reject
-        return False
+            return True  # unresolvable or any DNS error = reject (not cached)
+        if len(_private_host_cache) >= _PRIVATE_HOST_CACHE_MAX:
+            _private_host_cache.clear()
+        _private_host_cache[hostname] = now + _PRIVATE_HOST_TTL
+        return True
 
-    def _download_link(self, url: str) -> Attachment | None:
+    def _download_link(self, url: str, failed: threading.Event | None = None) -> Attachment | None:
         """
         Download a file from a URL and return it as an Attachment.
 
@@ -506,6 +911,8 @@ class GraphClient:
 
         Args:
             url: URL to download.
+            failed: Optional event, set when the download failed in a way worth
+                    retrying later (network error, throttling, 5xx).
 
         Returns:
             Attachment on success, None on failure.
@@ -517,56 +924,64 @@ class GraphClient:
             return None
 
         try:
-            resp = requests.get(
+            resp = self._download_session.get(
                 url,
                 allow_redirects=True,
                 timeout=30,
                 headers={"User-Agent": "Mozilla/5.0 (invoice-bot)"},
+                stream=True,
             )
             resp.raise_for_status()
         except requests.RequestException as e:
             logger.warning("Failed to download invoice link %s: %s", url, e)
+            if failed is not None and _is_transient(e):
+                failed.set()
             return None
 
-        # Determine content-type (strip charset/boundary suffixes)
-        raw_ct = resp.headers.get("Content-Type", "")
-        content_type = normalize_content_type(raw_ct)
+        with resp:
+            # Determine content-type (strip charset/boundary suffixes)
+            raw_ct = resp.headers.get("Content-Type", "")
+            content_type = normalize_content_type(raw_ct)
 
-        if content_type not in INVOICE_MIME_TYPES:
-            logger.warning(
-                "Skipping download from %s: unsupported content-type %r",
-                url,
-                content_type,
-            )
-            return None
-
-        # Reject excessively large downloads (same 20 MB cap as file attachments)
-        content_length = resp.headers.get("Content-Length")
-        if content_length and int(content_length) > 20 * 1024 * 1024:
-            logger.warning(
-                "Skipping download from %s: Content-Length %s bytes exceeds 20 MB limit",
-                url,
-                content_length,
-            )
-            return None
+            if content_type not in INVOICE_MIME_TYPES:
+                logger.warning(
+                    "Skipping download from %s: unsupported content-type %r",
+                    url,
+                    content_type,
+                )
+                return None
 
-        # Derive filename
-        filename = _filename_from_response(resp, url, content_type)
+            # Reject excessively large downloads (same 20 MB cap as file attachments)
+            content_length = resp.headers.get("Content-Length")
+            if content_length and int(content_length) > _MAX_DOWNLOAD_BYTES:
+                logger.warning(
+                    "Skipping download from %s: Content-Length %s bytes exceeds 20 MB limit",
+                    url,
+                    content_length,
+                )
+                return None
 
-        try:
-            content_bytes = resp.content
-        except Exception as e:
-            logger.warning("Failed to read response body from %s: %s", url, e)
-            return None
+            # Derive filename
+            filename = _filename_from_response(resp, url, content_type)
 
-        # Double-check actual size (Content-Length can be absent or wrong)
-        if len(content_bytes) > 20 * 1024 * 1024:
-            logger.warning(
-                "Skipping download from %s: actual size %d bytes exceeds 20 MB limit",
-                url,
-                len(content_bytes),
-            )
-            return None
+            # Read the body in chunks, enforcing the cap as it arrives
+            # (Content-Length can be absent or wrong)
+            buf = bytearray()
+            try:
+                for chunk in resp.iter_content(chunk_size=_DOWNLOAD_CHUNK):
+                    buf += chunk
+                    if len(buf) > _MAX_DOWNLOAD_BYTES:
+                        logger.warning(
+                            "Skipping download from %s: body exceeds 20 MB limit, aborted",
+                            url,
+                        )
+                        return None
+            except requests.RequestException as e:
+                logger.warning("Failed to read response body from %s: %s", url, e)
+                if failed is not None:
+                    failed.set()
+                return None
+            content_bytes = bytes(buf)
 
         logger.info(
             "Downloaded invoice from link: filename=%r content_type=%r size=%d bytes",
@@ -581,6 +996,40 @@ class GraphClient:
 # Module-level helper
 # ---------------------------------------------------------------------------
 
+def _subject_filter_clause(subject_keywords: list[str]) -> str:
+    """
+    Build an OData clause matching messages whose subject contains any of the
+    keywords (Exchange compares case-insensitively) or is empty or missing,
+    mirroring the client-side subject filter. Single quotes are doubled per
+    OData syntax; the caller percent-encodes the result.
+    """
+    terms = ["subject eq ''", "subject eq null"]
+    terms += [f"contains(subject,'{kw.replace(chr(39), chr(39) * 2)}')" for kw in subject_keywords]
+    return f"({' or '.join(terms)})"
+
+
+def _is_transient(exc: requests.RequestException) -> bool:
+    """True for request errors worth retrying on a later poll: no response, 429 or 5xx."""
+    response = exc.response
+    return response is None or response.status_code == 429 or response.status_code >= 500
+
+
+def _url_dedup_key(url: str) -> str:
+    """
+    Return url with its scheme and host lowercased (both case-insensitive).
+    The path and query are left alone: download tokens are case-sensitive.
+    """
+    scheme, sep, rest = url.partition("://")
+    host, slash, tail = rest.partition("/")
+    return f"{scheme.lower()}{sep}{host.lower()}{slash}{tail}"
+
+
+@lru_cache(maxsize=64)
+def _guess_extension(content_type: str) -> str:
+    """mimetypes.guess_extension, cached: it scans the whole types map per call."""
+    return mimetypes.guess_extension(content_type) or ""
+
+
 def _filename_from_response(resp: requests.Response, url: str, content_type: str) -> str:
     """
     Derive a filename for a downloaded file.
@@ -594,22 +1043,21 @@ def _filename_from_response(resp: requests.Response, url: str, content_type: str
     cd = resp.headers.get("Content-Disposition", "")
     if cd:
         # filename*=UTF-8''encoded-name  (RFC 5987)
-        m = re.search(r"filename\*\s*=\s*(?:[^']*'[^']*')?(.+)", cd, re.IGNORECASE)
+        m = _CD_FILENAME_STAR_RE.search(cd)
         if m:
-            from urllib.parse import unquote
             return unquote(m.group(1).strip().strip('"'))
         # filename="name.pdf"
-        m = re.search(r'filename\s*=\s*"?([^";\r\n]+)"?', cd, re.IGNORECASE)
+        m = _CD_FILENAME_RE.search(cd)
         if m:
             return m.group(1).strip()
 
     # 2. URL path segment (use final URL after redirects)
     final_url = resp.url or url
     path = urlparse(final_url).path
-    segment = path.rstrip("/").rsplit("/", 1)[-1]
+    segment = path.rstrip("/").rpartition("/")[2]
     if segment and "." in segment:
         return segment
 
     # 3. Fallback: generic name + extension from MIME type
-    ext = _MIME_TO_EXT.get(content_type) or mimetypes.guess_extension(content_type) or ""
+    ext = _MIME_TO_EXT.get(content_type) or _guess_extension(content_type)
     return f"invoice{ext}"
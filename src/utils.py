@@ -5,11 +5,16 @@ Shared constants and utilities used across multiple modules.
 import logging
 import logging.handlers
 import os
-import re
 import sys
+from functools import lru_cache
 
 import yaml
 
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:  # PyYAML built without libyaml — pure-Python loader
+    from yaml import SafeLoader as _YamlLoader
+
 logger = logging.getLogger(__name__)
 
 # Microsoft Graph API base URL
@@ -19,15 +24,36 @@ GRAPH_BASE = "https://graph.microsoft.com/v1.0"
 DEFAULT_DATA_DIR = "/app/data"
 
 # French month names (1-indexed; index 0 is empty)
-MONTH_NAMES_FR = [
+MONTH_NAMES_FR = (
     "", "Janvier", "Février", "Mars", "Avril", "Mai", "Juin",
     "Juillet", "Août", "Septembre", "Octobre", "Novembre", "Décembre",
-]
+)
 
 LOG_FORMAT = "%(asctime)s %(levelname)s [%(name)s] %(message)s"
 LOG_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 
 
+def _stdout_handler() -> logging.Handler:
+    """Stdout handler — keeps existing Docker console output."""
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT))
+    return handler
+
+
+def _file_handler(data_dir: str, log_path: str) -> logging.Handler:
+    """Rotating file handler — 5 MB × 5 files = up to 25 MB on disk."""
+    os.makedirs(data_dir, exist_ok=True)
+    handler = logging.handlers.RotatingFileHandler(
+        log_path,
+        maxBytes=5 * 1024 * 1024,  # 5 MB
+        backupCount=5,
+        encoding="utf-8",
+        delay=True,  # open the file on the first record, not at start-up
+    )
+    handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT))
+    return handler
+
+
 def setup_logging(data_dir: str = "/app/data", log_level: str = "INFO") -> None:
     """
     Configure the root logger with:
@@ -39,33 +65,19 @@ def setup_logging(data_dir: str = "/app/data", log_level: str = "INFO") -> None:
     basicConfig / addHandler only add handlers when none exist yet.
     """
     level = getattr(logging, log_level.upper(), logging.INFO)
-
-    # Stdout handler — keeps existing Docker console output
-    stdout_handler = logging.StreamHandler(sys.stdout)
-    stdout_handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT))
-
-    # Rotating file handler — 5 MB × 5 files = up to 25 MB on disk
-    os.makedirs(data_dir, exist_ok=True)
     log_path = os.path.join(data_dir, "bot.log")
-    file_handler = logging.handlers.RotatingFileHandler(
-        log_path,
-        maxBytes=5 * 1024 * 1024,  # 5 MB
-        backupCount=5,
-        encoding="utf-8",
-    )
-    file_handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT))
 
     root = logging.getLogger()
-    # Only configure if no handlers are already attached (idempotent)
+    # Handlers are only built when missing, so repeat calls just adjust the level
     if not root.handlers:
         root.setLevel(level)
-        root.addHandler(stdout_handler)
-        root.addHandler(file_handler)
+        root.addHandler(_stdout_handler())
+        root.addHandler(_file_handler(data_dir, log_path))
     else:
         # Entry point called setup_logging after another basicConfig — add file handler if missing
         has_file = any(isinstance(h, logging.handlers.RotatingFileHandler) for h in root.handlers)
         if not has_file:
-            root.addHandler(file_handler)
+            root.addHandler(_file_handler(data_dir, log_path))
         root.setLevel(level)
 
     logging.getLogger(__name__).debug(
@@ -82,8 +94,10 @@ def load_config() -> dict:
     """
     config_path = os.environ.get("CONFIG_PATH", "/app/config.yaml")
     try:
-        with open(config_path) as f:
-            cfg = yaml.safe_load(f)
+        # Read in one call; libyaml decodes the raw bytes itself rather than
+        # pulling the file through Python-level read() calls
+        with open(config_path, "rb") as f:
+            cfg = yaml.load(f.read(), Loader=_YamlLoader)
         logger.info("Configuration loaded from %s", config_path)
     except FileNotFoundError:
         logger.error("config.yaml not found at %s", config_path)
@@ -110,22 +124,29 @@ def load_config() -> dict:
 
 def normalize_content_type(ct: str) -> str:
     """Strip charset/boundary suffixes and normalise a MIME content-type string."""
-    return ct.split(";")[0].strip().lower()
+    return ct.partition(";")[0].strip().lower()
+
+
+# Byte-level translation table: control characters and <>:"/\|?* map to "_".
+# UTF-8 multi-byte sequences only use bytes >= 0x80, so they pass through untouched.
+_FILENAME_BAD_BYTES = bytes(range(32)) + b'<>:"/\\|?*'
+_FILENAME_TABLE = bytes(ord("_") if b in _FILENAME_BAD_BYTES else b for b in range(256))
 
 
 def sanitize_filename(name: str) -> str:
     """Remove characters that are problematic in filenames."""
-    return re.sub(r'[<>:"/\\|?*\x00-\x1f]', "_", name)
+    return name.encode("utf-8", "surrogatepass").translate(_FILENAME_TABLE).decode("utf-8", "surrogatepass")
 
 
 # Common TLD suffixes to strip when extracting the company name from a domain.
-_COMPOUND_TLDS = {
+_COMPOUND_TLDS = frozenset({
     "co.uk", "co.jp", "co.nz", "co.za", "co.in", "co.kr",
     "com.au", "com.br", "com.fr", "com.mx", "com.ar",
     "org.uk", "net.au", "gov.uk",
-}
+})
 
 
+@lru_cache(maxsize=1024)
 def sender_to_label(sender: str) -> str:
     """
     Extract the company name from a sender email address.
@@ -140,14 +161,12 @@ def sender_to_label(sender: str) -> str:
         invoice@free.fr                   -> free
         support@company.co.uk             -> company
     """
-    if "@" in sender:
-        domain = sender.split("@")[-1].lower().strip()
-    else:
-        domain = sender.lower().strip()
+    domain = sender.rpartition("@")[2].lower().strip()
 
-    parts = domain.split(".")
+    # Only the last three labels matter
+    parts = domain.rsplit(".", 3)
 
-    if len(parts) >= 3 and ".".join(parts[-2:]) in _COMPOUND_TLDS:
+    if len(parts) >= 3 and f"{parts[-2]}.{parts[-1]}" in _COMPOUND_TLDS:
         company = parts[-3]
     elif len(parts) >= 2:
         company = parts[-2]
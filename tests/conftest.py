@@ -1,6 +1,7 @@
 """Shared fixtures for the invoice-bot test suite."""
 
 import os
+import shutil
 import tempfile
 
 import pytest
@@ -17,14 +18,31 @@ def tmp_data_dir(tmp_path):
     return str(tmp_path)
 
 
+@pytest.fixture(scope="session")
+def _db_template(tmp_path_factory):
+    """Path to an invoices.db with the schema applied, built once per session."""
+    import db
+    template_dir = str(tmp_path_factory.mktemp("db-template"))
+    db.init_db(template_dir)
+    return os.path.join(template_dir, "invoices.db")
+
+
 @pytest.fixture()
-def initialized_db(tmp_data_dir):
+def initialized_db(tmp_data_dir, _db_template):
     """Return a tmp data dir with an initialized SQLite database."""
-    import db
-    db.init_db(tmp_data_dir)
+    # Copying the template file is much cheaper than re-running the DDL
+    shutil.copyfile(_db_template, os.path.join(tmp_data_dir, "invoices.db"))
     return tmp_data_dir
 
 
+@pytest.fixture()
+def clean_env(monkeypatch):
+    """monkeypatch with the config-related env vars (and their overlays) unset."""
+    for key in ("CONFIG_PATH", "AZURE_CLIENT_ID", "ANTHROPIC_API_KEY"):
+        monkeypatch.delenv(key, raising=False)
+    return monkeypatch
+
+
 @pytest.fixture()
 def sample_config():
     """Minimal realistic config dict."""
@@ -6,6 +6,7 @@ from unittest.mock import patch, MagicMock
 
 import pytest
 
+import auth_setup
 from auth_setup import get_token_cache_path, load_token_cache, save_token_cache, get_access_token
 
 
@@ -68,6 +69,49 @@ class TestTokenCacheIO:
 # ---------------------------------------------------------------------------
 
 class TestGetAccessToken:
+    @pytest.fixture(autouse=True)
+    def _clear_token_memo(self):
+        auth_setup._token_memo.clear()
+        yield
+        auth_setup._token_memo.clear()
+
+    @staticmethod
+    def _silent_app(mock_build, *tokens, expires_in=3600):
+        mock_app = MagicMock()
+        mock_app.get_accounts.return_value = [{"username": "user@test.com"}]
+        mock_app.acquire_token_silent.side_effect = [
+            {"access_token": t, "expires_in": expires_in} for t in tokens
+        ]
+        mock_build.return_value = mock_app
+        return mock_app
+
+    @patch("auth_setup.save_token_cache")
+    @patch("auth_setup.build_app")
+    @patch("auth_setup.load_token_cache")
+    def test_token_reused_until_near_expiry(self, mock_load, mock_build, mock_save):
+        self._silent_app(mock_build, "tok-1", "tok-2")
+        assert get_access_token("cid") == "tok-1"
+        assert get_access_token("cid") == "tok-1"
+        assert mock_load.call_count == 1
+
+    @patch("auth_setup.save_token_cache")
+    @patch("auth_setup.build_app")
+    @patch("auth_setup.load_token_cache")
+    def test_short_lived_token_not_reused(self, mock_load, mock_build, mock_save):
+        self._silent_app(mock_build, "tok-1", "tok-2", expires_in=200)
+        assert get_access_token("cid") == "tok-1"
+        assert get_access_token("cid") == "tok-2"
+
+    @patch("auth_setup.save_token_cache")
+    @patch("auth_setup.build_app")
+    @patch("auth_setup.load_token_cache")
+    def test_force_refresh_bypasses_memo(self, mock_load, mock_build, mock_save):
+        mock_app = self._silent_app(mock_build, "tok-1", "tok-2")
+        get_access_token("cid")
+        assert get_access_token("cid", force_refresh=True) == "tok-2"
+        assert mock_app.acquire_token_silent.call_args.kwargs["force_refresh"] is True
+        assert get_access_token("cid") == "tok-2"
+
     @patch("auth_setup.save_token_cache")
     @patch("auth_setup.build_app")
     @patch("auth_setup.load_token_cache")
@@ -7,11 +7,13 @@ from unittest.mock import MagicMock, patch
 
 import pytest
 
+import classifier
 from classifier import (
     _parse_amount,
     _parse_response,
     _classify_text,
     _classify_image,
+    can_classify,
     is_invoice,
 )
 from poller import Attachment
@@ -54,120 +56,122 @@ class TestParseAmount:
 # _parse_response
 # ---------------------------------------------------------------------------
 
+_RESPONSE_BASE = {
+    "is_invoice": True,
+    "confidence": 0.95,
+    "reason": "Document is an invoice",
+    "invoice_date": "2025-03-15",
+    "supplier": "Acme Corp",
+    "amount_ht": 100.0,
+    "amount_tva": 20.0,
+    "amount_ttc": 120.0,
+    "currency": "EUR",
+}
+_RESPONSE_BASE_JSON = json.dumps(_RESPONSE_BASE)
+
+
 class TestParseResponse:
     def _make_json(self, **overrides):
-        base = {
-            "is_invoice": True,
-            "confidence": 0.95,
-            "reason": "Document is an invoice",
-            "invoice_date": "2025-03-15",
-            "supplier": "Acme Corp",
-            "amount_ht": 100.0,
-            "amount_tva": 20.0,
-            "amount_ttc": 120.0,
-            "currency": "EUR",
-        }
-        base.update(overrides)
-        return json.dumps(base)
+        if not overrides:
+            return _RESPONSE_BASE_JSON
+        return json.dumps({**_RESPONSE_BASE, **overrides})
 
     def test_valid_json(self):
         raw = self._make_json()
-        is_inv, conf, reason, date, supplier, ht, ttc, tva, cur = _parse_response(raw)
-        assert is_inv is True
-        assert conf == 0.95
-        assert date == "2025-03-15"
-        assert supplier == "Acme Corp"
-        assert ht == 100.0
-        assert ttc == 120.0
-        assert tva == 20.0
-        assert cur == "EUR"
+        r = _parse_response(raw)
+        assert r.is_invoice is True
+        assert r.confidence == 0.95
+        assert r.invoice_date == "2025-03-15"
+        assert r.supplier == "Acme Corp"
+        assert r.amount_ht == 100.0
+        assert r.amount_ttc == 120.0
+        assert r.amount_tva == 20.0
+        assert r.currency == "EUR"
 
     def test_markdown_wrapped_json(self):
         raw = "```json\n" + self._make_json() + "\n```"
-        is_inv, conf, *_ = _parse_response(raw)
-        assert is_inv is True
-        assert conf == 0.95
+        r = _parse_response(raw)
+        assert r.is_invoice is True
+        assert r.confidence == 0.95
 
     def test_malformed_json_returns_fallback(self):
-        is_inv, conf, reason, *_ = _parse_response("{bad json!!")
+        r = _parse_response("{bad json!!")
         # Fallback: is_invoice=True, confidence=0.0, reason starts with "Parse error"
-        assert is_inv is True
-        assert conf == 0.0
-        assert "Parse error" in reason
+        assert r.is_invoice is True
+        assert r.confidence == 0.0
+        assert "Parse error" in r.reason
 
     def test_invalid_date_format_ignored(self):
         raw = self._make_json(invoice_date="15/03/2025")
-        _, _, _, date, *_ = _parse_response(raw)
-        assert date is None
+        assert _parse_response(raw).invoice_date is None
 
     def test_null_date_string(self):
         raw = self._make_json(invoice_date="null")
-        _, _, _, date, *_ = _parse_response(raw)
-        assert date is None
+        assert _parse_response(raw).invoice_date is None
 
-    def test_supplier_null_string_cleaned(self):
-        for null_val in ("null", "None", "n/a", ""):
-            raw = self._make_json(supplier=null_val)
-            _, _, _, _, supplier, *_ = _parse_response(raw)
-            assert supplier is None, f"supplier should be None for value {null_val!r}"
+    @pytest.mark.parametrize("null_val", ["null", "None", "n/a", ""])
+    def test_supplier_null_string_cleaned(self, null_val):
+        raw = self._make_json(supplier=null_val)
+        assert _parse_response(raw).supplier is None
 
     def test_supplier_truncated_at_80(self):
         long_name = "A" * 100
         raw = self._make_json(supplier=long_name)
-        _, _, _, _, supplier, *_ = _parse_response(raw)
-        assert len(supplier) == 80
+        assert len(_parse_response(raw).supplier) == 80
 
     def test_owner_name_filtered(self):
         raw = self._make_json(supplier="My Own Company SAS")
-        _, _, _, _, supplier, *_ = _parse_response(raw, owner_names={"my own company"})
-        assert supplier is None
+        assert _parse_response(raw, owner_names={"my own company"}).supplier is None
 
     def test_currency_normalised_uppercase(self):
         raw = self._make_json(currency="eur")
-        *_, cur = _parse_response(raw)
-        assert cur == "EUR"
+        assert _parse_response(raw).currency == "EUR"
 
     def test_currency_null_string(self):
         raw = self._make_json(currency="null")
-        *_, cur = _parse_response(raw)
-        assert cur is None
+        assert _parse_response(raw).currency is None
+
+    def test_uses_orjson_when_available(self):
+        try:
+            import orjson
+        except ImportError:
+            assert classifier._json_loads is json.loads
+        else:
+            assert classifier._json_loads is orjson.loads
 
 
 # ---------------------------------------------------------------------------
 # _classify_text
 # ---------------------------------------------------------------------------
 
+def _client_returning(text: str) -> MagicMock:
+    """A mock Anthropic client whose messages.create returns a plain response stub."""
+    client = MagicMock()
+    client.messages.create.return_value = SimpleNamespace(content=[SimpleNamespace(text=text)])
+    return client
+
+
 class TestClassifyText:
     def test_empty_text_returns_review(self):
         client = MagicMock()
-        is_inv, conf, reason, *_ = _classify_text(client, "")
-        assert is_inv is False
-        assert conf == 0.0
-        assert "No text extracted" in reason
+        r = _classify_text(client, "")
+        assert r.is_invoice is False
+        assert r.confidence == 0.0
+        assert "No text extracted" in r.reason
         client.messages.create.assert_not_called()
 
     def test_calls_api_with_text(self):
-        mock_response = MagicMock()
-        mock_response.content = [
-            SimpleNamespace(text='{"is_invoice": true, "confidence": 0.9, "reason": "ok"}')
-        ]
-        client = MagicMock()
-        client.messages.create.return_value = mock_response
+        client = _client_returning('{"is_invoice": true, "confidence": 0.9, "reason": "ok"}')
 
-        is_inv, conf, reason, *_ = _classify_text(client, "FACTURE #123")
-        assert is_inv is True
-        assert conf == 0.9
+        r = _classify_text(client, "FACTURE #123")
+        assert r.is_invoice is True
+        assert r.confidence == 0.9
         client.messages.create.assert_called_once()
         call_kwargs = client.messages.create.call_args
         assert "FACTURE #123" in call_kwargs.kwargs.get("messages", call_kwargs[1].get("messages", [{}]))[0].get("content", "")
 
     def test_hint_supplier_appended_to_prompt(self):
-        mock_response = MagicMock()
-        mock_response.content = [
-            SimpleNamespace(text='{"is_invoice": true, "confidence": 0.8, "reason": "ok"}')
-        ]
-        client = MagicMock()
-        client.messages.create.return_value = mock_response
+        client = _client_returning('{"is_invoice": true, "confidence": 0.8, "reason": "ok"}')
 
         _classify_text(client, "Some text", hint_supplier="Amazon")
         call_args = client.messages.create.call_args
@@ -182,18 +186,11 @@ class TestClassifyText:
 
 class TestClassifyImage:
     def test_calls_api_with_base64_image(self):
-        mock_response = MagicMock()
-        mock_response.content = [
-            SimpleNamespace(text='{"is_invoice": false, "confidence": 0.85, "reason": "photo"}')
-        ]
-        client = MagicMock()
-        client.messages.create.return_value = mock_response
+        client = _client_returning('{"is_invoice": false, "confidence": 0.85, "reason": "photo"}')
 
-        is_inv, conf, reason, *_ = _classify_image(
-            client, b"\x89PNG fake image", "image/png"
-        )
-        assert is_inv is False
-        assert conf == 0.85
+        r = _classify_image(client, b"\x89PNG fake image", "image/png")
+        assert r.is_invoice is False
+        assert r.confidence == 0.85
         client.messages.create.assert_called_once()
 
 
@@ -201,7 +198,34 @@ class TestClassifyImage:
 # is_invoice (public interface)
 # ---------------------------------------------------------------------------
 
+class TestCanClassify:
+    @pytest.mark.parametrize("name,ct", [
+        ("a.pdf", "application/pdf"),
+        ("scan.bin", "image/png"),
+        ("export.xlsx", "application/octet-stream"),
+        ("FACTURE.PDF", "application/x-pdf"),
+    ])
+    def test_supported(self, name, ct):
+        assert can_classify(Attachment(name=name, content_type=ct, content_bytes=b""))
+
+    @pytest.mark.parametrize("name,ct", [
+        ("doc.docx", "application/msword"),
+        ("page.html", "text/html; charset=utf-8"),
+    ])
+    def test_unsupported(self, name, ct):
+        assert not can_classify(Attachment(name=name, content_type=ct, content_bytes=b""))
+
+
 class TestIsInvoice:
+    @pytest.fixture(autouse=True)
+    def _patch_client(self):
+        """Install the Anthropic client and PDF text extraction mocks once per test."""
+        with patch("classifier.anthropic.Anthropic") as mock_anthropic, \
+                patch("classifier._extract_pdf_text", return_value="text") as mock_extract:
+            self.mock_anthropic = mock_anthropic
+            self.mock_extract = mock_extract
+            yield
+
     def test_missing_api_key_returns_review(self):
         att = Attachment(name="test.pdf", content_type="application/pdf", content_bytes=b"data")
         config = {"classifier": {"api_key": ""}}
@@ -217,14 +241,12 @@ class TestIsInvoice:
     def test_unsupported_mime_returns_review(self):
         att = Attachment(name="doc.docx", content_type="application/msword", content_bytes=b"data")
         config = {"classifier": {"api_key": "sk-real-key"}}
-        with patch("classifier.anthropic.Anthropic"):
-            status, *_ = is_invoice(att, config)
+        status, *_ = is_invoice(att, config)
         assert status == "review"
 
-    @patch("classifier._extract_pdf_text", return_value="FACTURE #123 Total: 100 EUR")
     @patch("classifier._classify_text")
-    @patch("classifier.anthropic.Anthropic")
-    def test_pdf_invoice_confirmed(self, mock_anthropic, mock_classify, mock_extract):
+    def test_pdf_invoice_confirmed(self, mock_classify):
+        self.mock_extract.return_value = "FACTURE #123 Total: 100 EUR"
         mock_classify.return_value = (True, 0.9, "Invoice", "2025-03-15", "Acme", 100.0, 120.0, 20.0, "EUR")
         att = Attachment(name="facture.pdf", content_type="application/pdf", content_bytes=b"%PDF")
         config = {"classifier": {"api_key": "sk-key", "confidence_threshold": 0.5}}
@@ -234,10 +256,9 @@ class TestIsInvoice:
         assert date == "2025-03-15"
         assert supplier == "Acme"
 
-    @patch("classifier._extract_pdf_text", return_value="Contract agreement terms")
     @patch("classifier._classify_text")
-    @patch("classifier.anthropic.Anthropic")
-    def test_pdf_rejected(self, mock_anthropic, mock_classify, mock_extract):
+    def test_pdf_rejected(self, mock_classify):
+        self.mock_extract.return_value = "Contract agreement terms"
         mock_classify.return_value = (False, 0.9, "Not an invoice", None, None, None, None, None, None)
         att = Attachment(name="contract.pdf", content_type="application/pdf", content_bytes=b"%PDF")
         config = {"classifier": {"api_key": "sk-key", "confidence_threshold": 0.5}}
@@ -245,10 +266,9 @@ class TestIsInvoice:
         status, *_ = is_invoice(att, config)
         assert status == "rejected"
 
-    @patch("classifier._extract_pdf_text", return_value="Ambiguous document")
     @patch("classifier._classify_text")
-    @patch("classifier.anthropic.Anthropic")
-    def test_low_confidence_returns_review(self, mock_anthropic, mock_classify, mock_extract):
+    def test_low_confidence_returns_review(self, mock_classify):
+        self.mock_extract.return_value = "Ambiguous document"
         mock_classify.return_value = (True, 0.3, "Uncertain", None, None, None, None, None, None)
         att = Attachment(name="maybe.pdf", content_type="application/pdf", content_bytes=b"%PDF")
         config = {"classifier": {"api_key": "sk-key", "confidence_threshold": 0.5}}
@@ -257,8 +277,7 @@ class TestIsInvoice:
         assert status == "review"
 
     @patch("classifier._classify_image")
-    @patch("classifier.anthropic.Anthropic")
-    def test_image_jpeg_classified(self, mock_anthropic, mock_classify_img):
+    def test_image_jpeg_classified(self, mock_classify_img):
         mock_classify_img.return_value = (True, 0.95, "Receipt image", "2025-01-10", "Shop", 50.0, 60.0, 10.0, "EUR")
         att = Attachment(name="receipt.jpg", content_type="image/jpeg", content_bytes=b"\xff\xd8")
         config = {"classifier": {"api_key": "sk-key", "confidence_threshold": 0.5}}
@@ -267,10 +286,8 @@ class TestIsInvoice:
         assert status == "invoice"
         assert supplier == "Shop"
 
-    @patch("classifier._extract_pdf_text", return_value="text")
     @patch("classifier._classify_text", side_effect=Exception("API timeout"))
-    @patch("classifier.anthropic.Anthropic")
-    def test_api_error_returns_review(self, mock_anthropic, mock_classify, mock_extract):
+    def test_api_error_returns_review(self, mock_classify):
         att = Attachment(name="file.pdf", content_type="application/pdf", content_bytes=b"%PDF")
         config = {"classifier": {"api_key": "sk-key", "confidence_threshold": 0.5}}
 
@@ -159,3 +159,35 @@ class TestMonthlyReport:
         db.save_monthly_report(initialized_db, 2025, 3)
         db.save_monthly_report(initialized_db, 2025, 3)  # INSERT OR IGNORE
         assert db.has_monthly_report_been_sent(initialized_db, 2025, 3) is True
+
+
+# ---------------------------------------------------------------------------
+# Uploaded-file content index
+# ---------------------------------------------------------------------------
+
+class TestUploadedFiles:
+    def test_unknown_hash_returns_none(self, initialized_db):
+        assert db.get_uploaded_file(initialized_db, "abc123") is None
+
+    def test_save_and_lookup(self, initialized_db):
+        db.save_uploaded_file(initialized_db, "abc123", "file-id-1", "https://link/1")
+        assert db.get_uploaded_file(initialized_db, "abc123") == ("file-id-1", "https://link/1")
+
+    def test_review_and_invoice_are_separate(self, initialized_db):
+        db.save_uploaded_file(initialized_db, "abc123", "review-id", "https://link/r", review=True)
+        assert db.get_uploaded_file(initialized_db, "abc123") is None
+        assert db.get_uploaded_file(initialized_db, "abc123", review=True) == ("review-id", "https://link/r")
+
+
+# ---------------------------------------------------------------------------
+# Delta links
+# ---------------------------------------------------------------------------
+
+class TestDeltaLinks:
+    def test_empty_initially(self, initialized_db):
+        assert db.get_delta_links(initialized_db) == {}
+
+    def test_save_and_replace(self, initialized_db):
+        db.save_delta_links(initialized_db, {"inbox|id|": "https://graph/delta?t=1", "archive|id|": "a1"})
+        db.save_delta_links(initialized_db, {"inbox|id|": "https://graph/delta?t=2"})
+        assert db.get_delta_links(initialized_db) == {"inbox|id|": "https://graph/delta?t=2", "archive|id|": "a1"}
@@ -1,11 +1,12 @@
 """Tests for src/excel_exporter.py — amount formatting and Excel generation."""
 
 import io
+from types import MappingProxyType
 
 import pytest
 from openpyxl import load_workbook
 
-from excel_exporter import _fmt_amount, build_monthly_excel
+from excel_exporter import _build_workbook, _fmt_amount, _format_date, build_monthly_excel
 
 
 # ---------------------------------------------------------------------------
@@ -36,82 +37,118 @@ class TestFmtAmount:
         result = _fmt_amount(0.99)
         assert result == "0,99"
 
+    def test_negative_zero_does_not_poison_cache(self):
+        assert _fmt_amount(-0.0) == "0,00"
+        assert _fmt_amount(0.0) == "0,00"
+
+
+# ---------------------------------------------------------------------------
+# _format_date
+# ---------------------------------------------------------------------------
+
+class TestFormatDate:
+    def test_date_only(self):
+        assert _format_date("2025-03-01") == "01/03/2025"
+
+    def test_datetime_keeps_its_own_date(self):
+        assert _format_date("2025-03-31T23:30:00Z") == "31/03/2025"
+        assert _format_date("2025-03-31T23:30:00+02:00") == "31/03/2025"
+
+    def test_other_iso_shape_parsed(self):
+        assert _format_date("20250301") == "01/03/2025"
+
+    def test_unparseable_returned_unchanged(self):
+        assert _format_date("") == ""
+        assert _format_date("not a date") == "not a date"
+
 
 # ---------------------------------------------------------------------------
 # build_monthly_excel
 # ---------------------------------------------------------------------------
 
-def _sample_invoices():
-    return [
-        {
-            "invoice_date": "2025-03-01",
-            "received_at": "2025-03-02T10:00:00Z",
-            "sender": "billing@acme.com",
-            "supplier": "Acme Corp",
-            "filename": "2025-03-01_acme_facture.pdf",
-            "drive_web_link": "https://onedrive.example/file1",
-            "currency": "EUR",
-            "amount_ht": 100.0,
-            "amount_tva": 20.0,
-            "amount_ttc": 120.0,
-        },
-        {
-            "invoice_date": "2025-03-15",
-            "received_at": "2025-03-16T08:00:00Z",
-            "sender": "noreply@bigcorp.fr",
-            "supplier": "BigCorp",
-            "filename": "2025-03-15_bigcorp_invoice.pdf",
-            "drive_web_link": "https://onedrive.example/file2",
-            "currency": "EUR",
-            "amount_ht": 200.0,
-            "amount_tva": 40.0,
-            "amount_ttc": 240.0,
-        },
-    ]
+# Read-only so module-scoped fixtures can share it without copying
+_SAMPLE_INVOICES = (
+    MappingProxyType({
+        "invoice_date": "2025-03-01",
+        "received_at": "2025-03-02T10:00:00Z",
+        "sender": "billing@acme.com",
+        "supplier": "Acme Corp",
+        "filename": "2025-03-01_acme_facture.pdf",
+        "drive_web_link": "https://onedrive.example/file1",
+        "currency": "EUR",
+        "amount_ht": 100.0,
+        "amount_tva": 20.0,
+        "amount_ttc": 120.0,
+    }),
+    MappingProxyType({
+        "invoice_date": "2025-03-15",
+        "received_at": "2025-03-16T08:00:00Z",
+        "sender": "noreply@bigcorp.fr",
+        "supplier": "BigCorp",
+        "filename": "2025-03-15_bigcorp_invoice.pdf",
+        "drive_web_link": "https://onedrive.example/file2",
+        "currency": "EUR",
+        "amount_ht": 200.0,
+        "amount_tva": 40.0,
+        "amount_ttc": 240.0,
+    }),
+)
+
+
+@pytest.fixture(scope="module")
+def built_xlsx():
+    """The sample month's workbook bytes, built once for the whole module."""
+    return build_monthly_excel(_SAMPLE_INVOICES, 2025, 3)
+
+
+@pytest.fixture(scope="module")
+def sample_ws():
+    """The sample month's in-memory sheet, built once (tests must not modify it)."""
+    wb, _ = _build_workbook(_SAMPLE_INVOICES, 2025, 3)
+    return wb.active
+
+
+def _sheet(invoices, year=2025, month=3):
+    """Build a workbook in memory, skipping the .xlsx save/load round trip."""
+    wb, _ = _build_workbook(invoices, year, month)
+    return wb.active
 
 
 class TestBuildMonthlyExcel:
-    def test_returns_bytes(self):
-        result = build_monthly_excel(_sample_invoices(), 2025, 3)
-        assert isinstance(result, bytes)
-        assert len(result) > 0
-
-    def test_valid_xlsx(self):
-        result = build_monthly_excel(_sample_invoices(), 2025, 3)
-        wb = load_workbook(io.BytesIO(result))
-        assert len(wb.sheetnames) >= 1
-
-    def test_sheet_name_matches_month(self):
-        result = build_monthly_excel(_sample_invoices(), 2025, 3)
-        wb = load_workbook(io.BytesIO(result))
-        assert wb.sheetnames[0] == "Mars 2025"
-
-    def test_header_row(self):
-        result = build_monthly_excel(_sample_invoices(), 2025, 3)
-        wb = load_workbook(io.BytesIO(result))
-        ws = wb.active
-        headers = [ws.cell(row=1, column=c).value for c in range(1, 11)]
+    def test_returns_bytes(self, built_xlsx):
+        assert isinstance(built_xlsx, bytes)
+        assert len(built_xlsx) > 0
+
+    def test_valid_xlsx(self, built_xlsx):
+        # The one test that round-trips the saved bytes through openpyxl's reader
+        wb = load_workbook(io.BytesIO(built_xlsx), read_only=True, keep_links=False)
+        try:
+            assert wb.sheetnames == ["Mars 2025"]
+            assert wb.active.cell(row=1, column=1).value == "Date"
+        finally:
+            wb.close()
+
+    def test_sheet_name_matches_month(self, sample_ws):
+        assert sample_ws.parent.sheetnames[0] == "Mars 2025"
+
+    def test_header_row(self, sample_ws):
+        headers = [sample_ws.cell(row=1, column=c).value for c in range(1, 11)]
         assert "Date" in headers
         assert "Fournisseur" in headers
         assert "HT" in headers
         assert "TTC" in headers
 
-    def test_data_row_count(self):
-        invoices = _sample_invoices()
-        result = build_monthly_excel(invoices, 2025, 3)
-        wb = load_workbook(io.BytesIO(result))
-        ws = wb.active
+    def test_data_row_count(self, sample_ws):
+        invoices = _SAMPLE_INVOICES
         # Row 1 = header, rows 2..N+1 = data
         data_rows = 0
         for row in range(2, 2 + len(invoices)):
-            if ws.cell(row=row, column=1).value is not None:
+            if sample_ws.cell(row=row, column=1).value is not None:
                 data_rows += 1
         assert data_rows == len(invoices)
 
     def test_empty_invoices(self):
-        result = build_monthly_excel([], 2025, 1)
-        wb = load_workbook(io.BytesIO(result))
-        ws = wb.active
+        ws = _sheet([], 2025, 1)
         # Should still have header row
         assert ws.cell(row=1, column=1).value == "Date"
 
@@ -130,8 +167,28 @@ class TestBuildMonthlyExcel:
         assert isinstance(result, bytes)
         assert len(result) > 0
 
-    def test_frozen_panes(self):
-        result = build_monthly_excel(_sample_invoices(), 2025, 3)
-        wb = load_workbook(io.BytesIO(result))
-        ws = wb.active
-        assert ws.freeze_panes == "A2"
+    def test_frozen_panes(self, sample_ws):
+        assert sample_ws.freeze_panes == "A2"
+
+    def test_data_cell_styles(self, sample_ws):
+        amount = sample_ws.cell(row=2, column=5)
+        assert amount.alignment.horizontal == "right"
+        assert amount.border.bottom.style == "thin"
+        link = sample_ws.cell(row=2, column=9)
+        assert link.font.underline == "single"
+        assert link.alignment.horizontal == "center"
+
+    def test_supplier_summary_aggregates(self):
+        invoices = list(_SAMPLE_INVOICES) + [dict(_SAMPLE_INVOICES[0], amount_ht=None, amount_tva=None,
+                                              amount_ttc=50.0)]
+        ws = _sheet(invoices)
+        # 3 data rows, blank row 5, summary header row 6, then suppliers sorted by name
+        acme = [ws.cell(row=7, column=c).value for c in range(1, 6)]
+        assert acme == ["Acme Corp", 2, "100,00", "20,00", "170,00"]
+        total = [ws.cell(row=9, column=c).value for c in range(1, 6)]
+        assert total == ["TOTAL — 3 facture(s)", 3, "300,00", "60,00", "410,00"]
+
+    def test_supplier_summary_sorted_by_name(self):
+        invoices = [dict(_SAMPLE_INVOICES[0], supplier=name) for name in ("beta", "Alpha", "Gamma")]
+        ws = _sheet(invoices)
+        assert [ws.cell(row=r, column=1).value for r in (7, 8, 9)] == ["Alpha", "Gamma", "beta"]
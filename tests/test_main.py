@@ -1,7 +1,7 @@
 """Tests for src/main.py — poll_inbox and send_report orchestration."""
 
 import os
-from unittest.mock import patch, MagicMock, call
+from unittest.mock import MagicMock, call
 from datetime import datetime, timezone
 
 import pytest
@@ -10,131 +10,146 @@ from main import poll_inbox, send_report
 from poller import Attachment, Email
 
 
+@pytest.fixture(autouse=True, scope="module")
+def data_dir(tmp_path_factory):
+    """DATA_DIR for the whole module — db is mocked, so nothing is written there."""
+    path = str(tmp_path_factory.mktemp("data"))
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("DATA_DIR", path)
+        yield path
+
+
 # ---------------------------------------------------------------------------
 # poll_inbox
 # ---------------------------------------------------------------------------
 
+# Shared across tests — poll_inbox only reads them
+_EMAIL_BASIC = Email(
+    email_id="e1",
+    sender="a@b.com",
+    subject="Facture",
+    received_at="2025-03-15T10:00:00Z",
+    attachments=[Attachment("inv.pdf", "application/pdf", b"%PDF")],
+)
+_EMAIL_TWO_ATTACHMENTS = Email(
+    email_id="e1",
+    sender="a@b.com",
+    subject="Facture",
+    received_at="2025-03-15T10:00:00Z",
+    attachments=[
+        Attachment("inv1.pdf", "application/pdf", b"%PDF"),
+        Attachment("inv2.pdf", "application/pdf", b"%PDF"),
+    ],
+)
+
+_POLL_CFG = {
+    "microsoft": {"client_id": "cid"},
+    "onedrive": {"folder_name": "Root"},
+    "invoices": {
+        "whitelisted_senders": [],
+        "subject_keywords": [],
+        "sender_suppliers": {},
+    },
+    "link_detection": {"keywords": []},
+}
+
+
 class TestPollInbox:
-    def _base_config(self):
-        return {
-            "microsoft": {"client_id": "cid"},
-            "onedrive": {"folder_name": "Root"},
-            "invoices": {
-                "whitelisted_senders": [],
-                "subject_keywords": [],
-                "sender_suppliers": {},
-            },
-            "link_detection": {"keywords": []},
-        }
-
-    @patch("main.process_attachment", return_value="invoice")
-    @patch("main.db")
-    @patch("main.GraphClient")
-    def test_processes_new_emails(self, MockGraph, mock_db, mock_process, monkeypatch):
-        monkeypatch.setenv("DATA_DIR", "/tmp/test-data")
-        mock_db.is_email_processed.return_value = False
-
-        email = Email(
-            email_id="e1",
-            sender="a@b.com",
-            subject="Facture",
-            received_at="2025-03-15T10:00:00Z",
-            attachments=[Attachment("inv.pdf", "application/pdf", b"%PDF")],
-        )
-        MockGraph.return_value.fetch_emails_with_attachments.return_value = [email]
-
-        poll_inbox(self._base_config())
-        mock_process.assert_called_once()
-        mock_db.mark_email_processed.assert_called_once()
-
-    @patch("main.process_attachment")
-    @patch("main.db")
-    @patch("main.GraphClient")
-    def test_skips_already_processed(self, MockGraph, mock_db, mock_process, monkeypatch):
-        monkeypatch.setenv("DATA_DIR", "/tmp/test-data")
-        mock_db.is_email_processed.return_value = True
-
-        email = Email(
-            email_id="e1",
-            sender="a@b.com",
-            subject="Facture",
-            received_at="2025-03-15T10:00:00Z",
-            attachments=[Attachment("inv.pdf", "application/pdf", b"%PDF")],
-        )
-        MockGraph.return_value.fetch_emails_with_attachments.return_value = [email]
-
-        poll_inbox(self._base_config())
-        mock_process.assert_not_called()
-        mock_db.mark_email_processed.assert_not_called()
-
-    @patch("main.process_attachment", side_effect=Exception("upload failed"))
-    @patch("main.db")
-    @patch("main.GraphClient")
-    def test_continues_on_attachment_error(self, MockGraph, mock_db, mock_process, monkeypatch):
-        monkeypatch.setenv("DATA_DIR", "/tmp/test-data")
-        mock_db.is_email_processed.return_value = False
-
-        email = Email(
-            email_id="e1",
-            sender="a@b.com",
-            subject="Facture",
-            received_at="2025-03-15T10:00:00Z",
-            attachments=[
-                Attachment("inv1.pdf", "application/pdf", b"%PDF"),
-                Attachment("inv2.pdf", "application/pdf", b"%PDF"),
-            ],
-        )
-        MockGraph.return_value.fetch_emails_with_attachments.return_value = [email]
+    @pytest.fixture(autouse=True)
+    def _patches(self, monkeypatch, data_dir):
+        self.data_dir = data_dir
+        self.db = MagicMock()
+        self.graph = MagicMock()
+        self.process = MagicMock(return_value="invoice")
+        monkeypatch.setattr("main.db", self.db)
+        monkeypatch.setattr("main.GraphClient", self.graph)
+        monkeypatch.setattr("main.process_attachment", self.process)
+
+    def test_processes_new_emails(self):
+        self.db.is_email_processed.return_value = False
+        self.graph.return_value.fetch_emails_with_attachments.return_value = [_EMAIL_BASIC]
+
+        poll_inbox(_POLL_CFG)
+        self.process.assert_called_once()
+        self.db.mark_email_processed.assert_called_once()
+        # Full scan by default: no delta links read or saved
+        assert self.graph.return_value.fetch_emails_with_attachments.call_args.kwargs["delta_links"] is None
+        self.db.save_delta_links.assert_not_called()
+
+    def test_delta_sync_opt_in(self):
+        self.db.is_email_processed.return_value = False
+        self.graph.return_value.fetch_emails_with_attachments.return_value = [_EMAIL_BASIC]
+
+        poll_inbox({**_POLL_CFG, "schedule": {"delta_sync": True}})
+        delta_links = self.db.get_delta_links.return_value
+        assert self.graph.return_value.fetch_emails_with_attachments.call_args.kwargs["delta_links"] is delta_links
+        self.db.save_delta_links.assert_called_once_with(self.data_dir, delta_links)
+
+    def test_skips_already_processed(self):
+        self.db.is_email_processed.return_value = True
+        self.graph.return_value.fetch_emails_with_attachments.return_value = [_EMAIL_BASIC]
+
+        poll_inbox(_POLL_CFG)
+        self.process.assert_not_called()
+        self.db.mark_email_processed.assert_not_called()
+
+    def test_continues_on_attachment_error(self):
+        self.db.is_email_processed.return_value = False
+        self.process.side_effect = Exception("upload failed")
+        self.graph.return_value.fetch_emails_with_attachments.return_value = [_EMAIL_TWO_ATTACHMENTS]
 
         # Should not raise even though process_attachment fails
-        poll_inbox(self._base_config())
+        poll_inbox(_POLL_CFG)
         # Email still marked as processed after all attachments attempted
-        mock_db.mark_email_processed.assert_called_once()
+        self.db.mark_email_processed.assert_called_once()
 
 
 # ---------------------------------------------------------------------------
 # send_report
 # ---------------------------------------------------------------------------
 
+_SEND_CFG = {
+    "microsoft": {"client_id": "cid"},
+    "onedrive": {"folder_name": "Root"},
+}
+
+
 class TestSendReport:
-    def _base_config(self):
-        return {
-            "microsoft": {"client_id": "cid"},
-            "onedrive": {"folder_name": "Root"},
-        }
-
-    @patch("main.db")
-    def test_skips_if_already_sent(self, mock_db, monkeypatch):
-        monkeypatch.setenv("DATA_DIR", "/tmp/test-data")
-        mock_db.has_monthly_report_been_sent.return_value = True
-
-        send_report(self._base_config())
-        mock_db.get_unreported_invoices.assert_not_called()
-
-    @patch("main.db")
-    def test_skips_if_no_invoices(self, mock_db, monkeypatch):
-        monkeypatch.setenv("DATA_DIR", "/tmp/test-data")
-        mock_db.has_monthly_report_been_sent.return_value = False
-        mock_db.get_unreported_invoices.return_value = []
-
-        send_report(self._base_config())
-        mock_db.save_monthly_report.assert_called_once()
-
-    @patch("main.upload_attachment", return_value=("fid", "https://link"))
-    @patch("main.build_monthly_excel", return_value=b"xlsx-bytes")
-    @patch("main.db")
-    def test_builds_and_uploads_report(self, mock_db, mock_excel, mock_upload, monkeypatch):
-        monkeypatch.setenv("DATA_DIR", "/tmp/test-data")
-        mock_db.has_monthly_report_been_sent.return_value = False
-        mock_db.get_unreported_invoices.return_value = [
+    @pytest.fixture(autouse=True)
+    def _patches(self, monkeypatch, data_dir):
+        self.data_dir = data_dir
+        self.db = MagicMock()
+        self.excel = MagicMock(return_value=b"xlsx-bytes")
+        self.upload = MagicMock(return_value=("fid", "https://link"))
+        monkeypatch.setattr("main.db", self.db)
+        monkeypatch.setattr("main.build_monthly_excel", self.excel)
+        monkeypatch.setattr("main.upload_attachment", self.upload)
+
+    def test_skips_if_already_sent(self):
+        self.db.has_monthly_report_been_sent.return_value = True
+
+        send_report(_SEND_CFG)
+        self.db.get_unreported_invoices.assert_not_called()
+
+    def test_skips_if_no_invoices(self):
+        self.db.has_monthly_report_been_sent.return_value = False
+        self.db.get_unreported_invoices.return_value = []
+
+        send_report(_SEND_CFG)
+        self.db.save_monthly_report.assert_called_once()
+        self.excel.assert_not_called()
+
+    def test_builds_and_uploads_report(self):
+        self.db.has_monthly_report_been_sent.return_value = False
+        self.db.get_unreported_invoices.return_value = [
             {"id": 1, "filename": "inv.pdf"},
             {"id": 2, "filename": "inv2.pdf"},
         ]
 
-        send_report(self._base_config())
-        mock_excel.assert_called_once()
-        mock_upload.assert_called_once()
-        mock_db.mark_invoices_reported.assert_called_once_with(
-            "/tmp/test-data", [1, 2]
+        send_report(_SEND_CFG)
+        self.excel.assert_called_once()
+        self.upload.assert_called_once()
+        self.db.mark_invoices_reported.assert_called_once_with(
+            self.data_dir, [1, 2]
         )
-        mock_db.save_monthly_report.assert_called_once()
+        self.db.save_monthly_report.assert_called_once()
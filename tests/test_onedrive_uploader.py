@@ -1,10 +1,20 @@
 """Tests for src/onedrive_uploader.py — filename building and supplier labels."""
 
+import json
 from unittest.mock import patch, MagicMock
 
 import pytest
+import requests
 
-from onedrive_uploader import _supplier_to_label, build_filename
+from onedrive_uploader import (
+    _FOLDER_CACHE,
+    _chunked_upload,
+    _one_shot_upload,
+    _upload_to_folder,
+    _supplier_to_label,
+    build_filename,
+    upload_attachment,
+)
 
 
 # ---------------------------------------------------------------------------
@@ -22,6 +32,9 @@ class TestSupplierToLabel:
         result = _supplier_to_label("EDF Électricité de France")
         assert result == "edf-electricite-de-france"
 
+    def test_compatibility_forms_folded(self):
+        assert _supplier_to_label("Ｆｒｅｅ ﬁbre") == "free-fibre"
+
     def test_dots_replaced(self):
         assert _supplier_to_label("Orange S.A.") == "orange-s-a"
 
@@ -93,6 +106,14 @@ class TestBuildFilename:
         )
         assert result.startswith("0000-00-00_")
 
+    def test_impossible_received_at_fallback(self):
+        result = build_filename(
+            received_at="2025-13-45T00:00:00Z",
+            sender="a@b.com",
+            original_name="file.pdf",
+        )
+        assert result.startswith("0000-00-00_")
+
     def test_z_suffix_handled(self):
         result = build_filename(
             received_at="2025-12-31T23:59:59Z",
@@ -113,3 +134,182 @@ class TestBuildFilename:
         assert ">" not in result
         assert "|" not in result
         assert '"' not in result
+
+
+# ---------------------------------------------------------------------------
+# Content-hash deduplication
+# ---------------------------------------------------------------------------
+
+class TestUploadDeduplication:
+    _ARGS = (
+        "cid", "Root", "facture.pdf", b"%PDF-same-bytes", "application/pdf",
+        "billing@example.com", "2025-03-15T10:00:00Z", 2025, 3,
+    )
+
+    @patch("onedrive_uploader._one_shot_upload", return_value=("file-id", "https://link"))
+    def test_second_upload_of_same_bytes_skips_graph(self, mock_upload, initialized_db):
+        first = upload_attachment(*self._ARGS, data_dir=initialized_db)
+        second = upload_attachment(*self._ARGS, data_dir=initialized_db)
+
+        assert first == second == ("file-id", "https://link")
+        mock_upload.assert_called_once()
+
+    @patch("onedrive_uploader._one_shot_upload", return_value=("file-id", "https://link"))
+    def test_without_data_dir_always_uploads(self, mock_upload):
+        upload_attachment(*self._ARGS)
+        upload_attachment(*self._ARGS)
+        assert mock_upload.call_count == 2
+
+
+# ---------------------------------------------------------------------------
+# Path-addressed (one-shot) upload
+# ---------------------------------------------------------------------------
+
+def _response(status_code, payload=None):
+    resp = MagicMock()
+    resp.status_code = status_code
+    resp.json.return_value = payload or {}
+    resp.content = json.dumps(payload or {}).encode()
+    return resp
+
+
+class TestOneShotUpload:
+    @pytest.fixture(autouse=True)
+    def _clear_folder_cache(self):
+        _FOLDER_CACHE.clear()
+        yield
+        _FOLDER_CACHE.clear()
+
+    @patch("onedrive_uploader.get_access_token", return_value="tok")
+    @patch("onedrive_uploader._session.put")
+    def test_created_backfills_folder_cache(self, mock_put, mock_token):
+        mock_put.return_value = _response(201, {
+            "id": "file-id", "webUrl": "https://link",
+            "parentReference": {"id": "supplier-folder-id"},
+        })
+
+        result = _one_shot_upload("cid", "Root/2025/03/acme", "f.pdf", b"%PDF", "application/pdf")
+
+        assert result == ("file-id", "https://link")
+        assert "/me/drive/root:/Root/2025/03/acme/f.pdf:/content" in mock_put.call_args.args[0]
+        assert _FOLDER_CACHE[("/me/drive/root", "Root/2025/03/acme")] == "supplier-folder-id"
+
+    @patch("onedrive_uploader.get_access_token", return_value="tok")
+    @patch("onedrive_uploader._session.get")
+    @patch("onedrive_uploader._session.put")
+    def test_conflict_returns_existing_item(self, mock_put, mock_get, mock_token):
+        mock_put.return_value = _response(409)
+        mock_get.return_value = _response(200, {"id": "existing-id", "webUrl": "https://old"})
+
+        result = _one_shot_upload("cid", "Root/2025/03/acme", "f.pdf", b"%PDF", "application/pdf")
+        assert result == ("existing-id", "https://old")
+
+    @patch("onedrive_uploader.get_access_token", return_value="tok")
+    @patch("onedrive_uploader._session.put")
+    def test_not_found_signals_fallback(self, mock_put, mock_token):
+        mock_put.return_value = _response(404)
+        assert _one_shot_upload("cid", "Root/2025/03/acme", "f.pdf", b"%PDF", "application/pdf") is None
+
+    @patch("onedrive_uploader.get_access_token", return_value="tok")
+    @patch("onedrive_uploader._session.put")
+    def test_forbidden_signals_fallback(self, mock_put, mock_token):
+        mock_put.return_value = _response(403)
+        assert _one_shot_upload("cid", "Root/2025/03/acme", "f.pdf", b"%PDF", "application/pdf") is None
+
+    @pytest.mark.parametrize("status", [429, 503])
+    @patch("onedrive_uploader.get_access_token", return_value="tok")
+    @patch("onedrive_uploader._session.put")
+    def test_throttling_and_server_errors_raise(self, mock_put, mock_token, status):
+        resp = _response(status)
+        resp.raise_for_status.side_effect = requests.HTTPError(response=resp)
+        mock_put.return_value = resp
+        with pytest.raises(requests.HTTPError):
+            _one_shot_upload("cid", "Root/2025/03/acme", "f.pdf", b"%PDF", "application/pdf")
+
+    @patch("onedrive_uploader._upload_to_folder", return_value=("file-id", "https://link"))
+    @patch("onedrive_uploader._get_invoice_folder_id", return_value="folder-id")
+    @patch("onedrive_uploader._get_or_create_root_folder", return_value="root-id")
+    @patch("onedrive_uploader._one_shot_upload", return_value=None)
+    def test_fallback_resolves_folder_chain(self, mock_one_shot, mock_root, mock_folder, mock_upload):
+        result = upload_attachment(
+            "cid", "Root", "f.pdf", b"%PDF", "application/pdf",
+            "billing@acme.com", "2025-03-15T10:00:00Z", 2025, 3,
+        )
+        assert result == ("file-id", "https://link")
+        mock_one_shot.assert_called_once()
+        mock_folder.assert_called_once_with("cid", "root-id", 2025, 3, "acme")
+        assert mock_upload.call_args.args[1] == "folder-id"
+
+    @patch("onedrive_uploader._upload_to_folder")
+    @patch("onedrive_uploader._get_invoice_folder_id", return_value="new-folder-id")
+    @patch("onedrive_uploader._get_or_create_root_folder", return_value="root-id")
+    @patch("onedrive_uploader._one_shot_upload", return_value=None)
+    def test_stale_cached_folder_resolved_again(self, mock_one_shot, mock_root, mock_folder, mock_upload):
+        _FOLDER_CACHE[("/me/drive/root", "Root/2025/03/acme")] = "deleted-folder-id"
+        _FOLDER_CACHE[("/me/drive/items/root-id", "2025")] = "deleted-year-id"
+        not_found = _response(404)
+        mock_upload.side_effect = [
+            requests.HTTPError(response=not_found),
+            ("file-id", "https://link"),
+        ]
+
+        result = upload_attachment(
+            "cid", "Root", "f.pdf", b"%PDF", "application/pdf",
+            "billing@acme.com", "2025-03-15T10:00:00Z", 2025, 3,
+        )
+
+        assert result == ("file-id", "https://link")
+        assert [c.args[1] for c in mock_upload.call_args_list] == ["deleted-folder-id", "new-folder-id"]
+        assert ("/me/drive/items/root-id", "2025") not in _FOLDER_CACHE
+
+
+# ---------------------------------------------------------------------------
+# Folder-addressed upload
+# ---------------------------------------------------------------------------
+
+class TestUploadToFolder:
+    @patch("onedrive_uploader.get_access_token", return_value="tok")
+    @patch("onedrive_uploader._session.get")
+    @patch("onedrive_uploader._session.put")
+    def test_small_file_uploaded_without_existence_check(self, mock_put, mock_get, mock_token):
+        mock_put.return_value = _response(201, {"id": "file-id", "webUrl": "https://link"})
+
+        result = _upload_to_folder("cid", "folder-id", "f.pdf", b"%PDF", "application/pdf", "OneDrive")
+
+        assert result == ("file-id", "https://link")
+        assert "conflictBehavior=fail" in mock_put.call_args.args[0]
+        mock_get.assert_not_called()
+
+    @patch("onedrive_uploader.get_access_token", return_value="tok")
+    @patch("onedrive_uploader._session.get")
+    @patch("onedrive_uploader._session.put")
+    def test_conflict_returns_existing_item(self, mock_put, mock_get, mock_token):
+        mock_put.return_value = _response(409)
+        mock_get.return_value = _response(200, {"id": "existing-id", "webUrl": "https://old"})
+
+        result = _upload_to_folder("cid", "folder-id", "f.pdf", b"%PDF", "application/pdf", "OneDrive")
+        assert result == ("existing-id", "https://old")
+
+
+class TestChunkedUpload:
+    @patch("onedrive_uploader._CHUNK_SIZE", 4)
+    @patch("onedrive_uploader.get_access_token", return_value="tok")
+    @patch("onedrive_uploader._session.post")
+    @patch("onedrive_uploader._session.put")
+    def test_chunks_cover_file_without_copying(self, mock_put, mock_post, mock_token):
+        mock_post.return_value = _response(200, {"uploadUrl": "https://upload"})
+        mock_put.side_effect = [
+            _response(202),
+            _response(202),
+            _response(201, {"id": "new-id", "webUrl": "https://new"}),
+        ]
+        file_bytes = b"0123456789"
+
+        assert _chunked_upload("cid", "folder-id", "big.pdf", file_bytes, "application/pdf") == ("new-id", "https://new")
+        chunks = [c.kwargs["data"] for c in mock_put.call_args_list]
+        assert all(isinstance(c, memoryview) for c in chunks)
+        assert b"".join(chunks) == file_bytes
+        assert [c.kwargs["headers"]["Content-Range"] for c in mock_put.call_args_list] == [
+            "bytes 0-3/10", "bytes 4-7/10", "bytes 8-9/10",
+        ]
+
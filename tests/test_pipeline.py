@@ -2,11 +2,13 @@
 
 import io
 import zipfile
+import zlib
 from unittest.mock import patch, MagicMock
 
 import pytest
 
-from pipeline import _unpack_zip, process_attachment
+import pipeline
+from pipeline import _is_zip, _iter_zip_members, _read_zip_member, _unpack_zip, process_attachment
 from poller import Attachment, Email
 
 
@@ -14,15 +16,60 @@ from poller import Attachment, Email
 # _unpack_zip
 # ---------------------------------------------------------------------------
 
-def _make_zip(*members: tuple[str, bytes]) -> bytes:
+def _make_zip(*members: tuple[str, bytes], compression: int = zipfile.ZIP_STORED) -> bytes:
     """Create an in-memory ZIP archive with given (name, content) pairs."""
     buf = io.BytesIO()
-    with zipfile.ZipFile(buf, "w") as zf:
+    with zipfile.ZipFile(buf, "w", compression=compression) as zf:
         for name, data in members:
             zf.writestr(name, data)
     return buf.getvalue()
 
 
+# Archives shared by several tests — built once per module, read-only bytes
+
+@pytest.fixture(scope="module")
+def tiny_pdf_zip():
+    return _make_zip(("inv.pdf", b"%PDF"))
+
+
+@pytest.fixture(scope="module")
+def two_pdf_zip():
+    return _make_zip(("invoice.pdf", b"%PDF-data"), ("contract.pdf", b"%PDF-data"))
+
+
+@pytest.fixture(scope="module")
+def mixed_zip():
+    return _make_zip(("readme.txt", b"hello"), ("invoice.pdf", b"%PDF"))
+
+
+@pytest.fixture(scope="module")
+def macos_zip():
+    return _make_zip(
+        ("__MACOSX/._invoice.pdf", b"metadata"),
+        ("._hidden.pdf", b"metadata"),
+        ("real.pdf", b"%PDF"),
+    )
+
+
+@pytest.fixture(scope="module")
+def types_zip():
+    return _make_zip(("file.pdf", b"data"), ("file.png", b"data"), ("file.xlsx", b"data"))
+
+
+@pytest.fixture(scope="module")
+def dir_zip():
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr("subdir/", "")  # directory entry
+        zf.writestr("subdir/file.pdf", b"%PDF")
+    return buf.getvalue()
+
+
+@pytest.fixture(scope="module")
+def empty_zip():
+    return _make_zip()
+
+
 class TestUnpackZip:
     def test_extracts_supported_members(self):
         zip_bytes = _make_zip(
@@ -36,34 +83,20 @@ class TestUnpackZip:
         assert "invoice.pdf" in names
         assert "receipt.jpg" in names
 
-    def test_skips_unsupported_extensions(self):
-        zip_bytes = _make_zip(
-            ("readme.txt", b"hello"),
-            ("invoice.pdf", b"%PDF"),
-        )
-        att = Attachment(name="mixed.zip", content_type="application/zip", content_bytes=zip_bytes)
+    def test_skips_unsupported_extensions(self, mixed_zip):
+        att = Attachment(name="mixed.zip", content_type="application/zip", content_bytes=mixed_zip)
         members = _unpack_zip(att)
         assert len(members) == 1
         assert members[0].name == "invoice.pdf"
 
-    def test_skips_macos_metadata(self):
-        zip_bytes = _make_zip(
-            ("__MACOSX/._invoice.pdf", b"metadata"),
-            ("._hidden.pdf", b"metadata"),
-            ("real.pdf", b"%PDF"),
-        )
-        att = Attachment(name="mac.zip", content_type="application/zip", content_bytes=zip_bytes)
+    def test_skips_macos_metadata(self, macos_zip):
+        att = Attachment(name="mac.zip", content_type="application/zip", content_bytes=macos_zip)
         members = _unpack_zip(att)
         assert len(members) == 1
         assert members[0].name == "real.pdf"
 
-    def test_correct_content_types(self):
-        zip_bytes = _make_zip(
-            ("file.pdf", b"data"),
-            ("file.png", b"data"),
-            ("file.xlsx", b"data"),
-        )
-        att = Attachment(name="types.zip", content_type="application/zip", content_bytes=zip_bytes)
+    def test_correct_content_types(self, types_zip):
+        att = Attachment(name="types.zip", content_type="application/zip", content_bytes=types_zip)
         members = _unpack_zip(att)
         ct_map = {m.name: m.content_type for m in members}
         assert ct_map["file.pdf"] == "application/pdf"
@@ -75,22 +108,125 @@ class TestUnpackZip:
         members = _unpack_zip(att)
         assert members == []
 
-    def test_empty_zip_returns_empty(self):
-        zip_bytes = _make_zip()
-        att = Attachment(name="empty.zip", content_type="application/zip", content_bytes=zip_bytes)
+    def test_empty_zip_returns_empty(self, empty_zip):
+        att = Attachment(name="empty.zip", content_type="application/zip", content_bytes=empty_zip)
         members = _unpack_zip(att)
         assert members == []
 
-    def test_directories_skipped(self):
-        buf = io.BytesIO()
-        with zipfile.ZipFile(buf, "w") as zf:
-            zf.writestr("subdir/", "")  # directory entry
-            zf.writestr("subdir/file.pdf", b"%PDF")
-        att = Attachment(name="withdir.zip", content_type="application/zip", content_bytes=buf.getvalue())
+    def test_directories_skipped(self, dir_zip):
+        att = Attachment(name="withdir.zip", content_type="application/zip", content_bytes=dir_zip)
         members = _unpack_zip(att)
         assert len(members) == 1
         assert members[0].name == "file.pdf"
 
+    def test_backslash_paths_use_basename(self):
+        zip_bytes = _make_zip(("docs\\2025\\facture.pdf", b"%PDF"))
+        att = Attachment(name="win.zip", content_type="application/zip", content_bytes=zip_bytes)
+        members = _unpack_zip(att)
+        assert [m.name for m in members] == ["facture.pdf"]
+
+    def test_oversized_member_skipped(self, monkeypatch):
+        monkeypatch.setattr(pipeline, "_ZIP_MAX_MEMBER_BYTES", 100)
+        zip_bytes = _make_zip(("big.pdf", b"x" * 500), ("small.pdf", b"%PDF"))
+        att = Attachment(name="bomb.zip", content_type="application/zip", content_bytes=zip_bytes)
+        assert [m.name for m in _unpack_zip(att)] == ["small.pdf"]
+
+    def test_member_read_aborts_past_cap(self, monkeypatch):
+        monkeypatch.setattr(pipeline, "_ZIP_MAX_MEMBER_BYTES", 100)
+        monkeypatch.setattr(pipeline, "_ZIP_READ_CHUNK", 64)
+        zip_bytes = _make_zip(("big.pdf", b"x" * 500))
+        pipeline._open_worker_zip(zip_bytes)
+        info = pipeline._zip_local.zf.infolist()[0]
+        with pytest.raises(ValueError):
+            _read_zip_member(info)
+
+    def test_total_size_cap_stops_extraction(self, monkeypatch):
+        monkeypatch.setattr(pipeline, "_ZIP_MAX_TOTAL_BYTES", 25)
+        zip_bytes = _make_zip(*((f"inv{i}.pdf", b"x" * 10) for i in range(4)))
+        att = Attachment(name="many.zip", content_type="application/zip", content_bytes=zip_bytes)
+        assert [m.name for m in _unpack_zip(att)] == ["inv0.pdf", "inv1.pdf"]
+
+    def test_members_yielded_lazily(self):
+        zip_bytes = _make_zip(("a.pdf", b"%PDF-a"), ("b.pdf", b"%PDF-b"))
+        att = Attachment(name="lazy.zip", content_type="application/zip", content_bytes=zip_bytes)
+        it = _iter_zip_members(att)
+        first = next(it)
+        assert (first.name, first.content_bytes) == ("a.pdf", b"%PDF-a")
+        assert [m.name for m in it] == ["b.pdf"]
+
+    def test_many_members_keep_archive_order(self):
+        names = [f"inv{i:02d}.pdf" for i in range(20)]
+        zip_bytes = _make_zip(*((n, n.encode() * 50) for n in names))
+        att = Attachment(name="many.zip", content_type="application/zip", content_bytes=zip_bytes)
+        members = _unpack_zip(att)
+        assert [m.name for m in members] == names
+        assert all(m.content_bytes == m.name.encode() * 50 for m in members)
+
+
+class TestFastInflate:
+    """The ISA-L path, exercised with stdlib zlib standing in (same API)."""
+
+    @pytest.fixture(autouse=True)
+    def _fake_isal(self, monkeypatch):
+        monkeypatch.setattr(pipeline, "_isal_zlib", zlib)
+
+    def test_matches_zipfile_output(self):
+        payloads = [(f"inv{i}.pdf", b"%PDF-" + bytes([i]) * 3000) for i in range(3)]
+        zip_bytes = _make_zip(*payloads, compression=zipfile.ZIP_DEFLATED)
+        att = Attachment(name="z.zip", content_type="application/zip", content_bytes=zip_bytes)
+        with patch.object(pipeline, "_inflate_zip_member", wraps=pipeline._inflate_zip_member) as spy:
+            assert [(m.name, m.content_bytes) for m in _unpack_zip(att)] == payloads
+        assert spy.call_count == 3
+
+    def test_stored_members_use_zipfile_reader(self, tiny_pdf_zip):
+        att = Attachment(name="z.zip", content_type="application/zip", content_bytes=tiny_pdf_zip)
+        with patch.object(pipeline, "_inflate_zip_member") as spy:
+            assert [m.content_bytes for m in _unpack_zip(att)] == [b"%PDF"]
+        spy.assert_not_called()
+
+    def test_cap_enforced(self, monkeypatch):
+        monkeypatch.setattr(pipeline, "_ZIP_MAX_MEMBER_BYTES", 100)
+        zip_bytes = _make_zip(("big.pdf", b"x" * 500), compression=zipfile.ZIP_DEFLATED)
+        zf = zipfile.ZipFile(io.BytesIO(zip_bytes))
+        info = zf.infolist()[0]
+        with pytest.raises(ValueError):
+            _read_zip_member(info, zf, zip_bytes)
+
+    def test_crc_mismatch_rejected(self):
+        zip_bytes = _make_zip(("inv.pdf", b"%PDF-data" * 50), compression=zipfile.ZIP_DEFLATED)
+        zf = zipfile.ZipFile(io.BytesIO(zip_bytes))
+        info = zf.infolist()[0]
+        info.CRC ^= 1
+        with pytest.raises(zipfile.BadZipFile):
+            _read_zip_member(info, zf, zip_bytes)
+
+
+class TestIsZip:
+    def test_renamed_archive_detected_by_signature(self, tiny_pdf_zip):
+        att = Attachment(name="documents.dat", content_type="application/octet-stream",
+                         content_bytes=tiny_pdf_zip)
+        assert _is_zip(att)
+
+    def test_xlsx_container_not_unpacked(self):
+        xlsx_ct = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        att = Attachment(name="facture.xlsx", content_type=xlsx_ct,
+                         content_bytes=_make_zip(("xl/workbook.xml", b"<x/>")))
+        assert not _is_zip(att)
+
+    def test_xlsx_without_extension_not_unpacked(self):
+        xlsx_ct = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        att = Attachment(name="Facture_2025_03", content_type=xlsx_ct,
+                         content_bytes=_make_zip(("xl/workbook.xml", b"<x/>")))
+        assert not _is_zip(att)
+
+    def test_declared_type_fallback(self):
+        att = Attachment(name="bundle.zip", content_type="application/zip", content_bytes=b"")
+        assert _is_zip(att)
+
+    def test_pdf_is_not_zip(self):
+        att = Attachment(name="inv.pdf", content_type="application/pdf", content_bytes=b"%PDF-1.7")
+        assert not _is_zip(att)
+
 
 # ---------------------------------------------------------------------------
 # process_attachment
@@ -164,27 +300,39 @@ class TestProcessAttachment:
     @patch("pipeline.upload_to_review", return_value=("fid", "https://link"))
     @patch("pipeline.build_filename", return_value="fname.pdf")
     @patch("pipeline.is_invoice")
-    def test_zip_processes_members(self, mock_classify, mock_fname, mock_review, mock_upload, mock_db):
+    def test_zip_processes_members(self, mock_classify, mock_fname, mock_review, mock_upload, mock_db,
+                                   two_pdf_zip):
         # First call -> invoice, second call -> rejected
         mock_classify.side_effect = [
             ("invoice", "2025-03-01", "Acme", 100.0, 120.0, 20.0, "EUR"),
             ("rejected", None, None, None, None, None, None),
         ]
-        zip_bytes = _make_zip(
-            ("invoice.pdf", b"%PDF-data"),
-            ("contract.pdf", b"%PDF-data"),
-        )
-        att = Attachment(name="bundle.zip", content_type="application/zip", content_bytes=zip_bytes)
+        att = Attachment(name="bundle.zip", content_type="application/zip", content_bytes=two_pdf_zip)
         email = self._make_email()
 
         status = process_attachment(att, email, 2025, 3, {}, "/data", "cid", "Root")
         assert status == "invoice"  # at least one member was an invoice
         assert mock_classify.call_count == 2
+        # Each member's invoice row is saved as soon as that member is uploaded
+        mock_db.save_invoice.assert_called_once()
+        assert mock_db.save_invoice.call_args.kwargs["supplier"] == "Acme"
+
+    @patch("pipeline.db")
+    @patch("pipeline.upload_attachment", return_value=("fid", "https://link"))
+    @patch("pipeline.build_filename", return_value="fname.pdf")
+    @patch("pipeline.is_invoice", side_effect=RuntimeError("API down"))
+    def test_zip_member_failure_does_not_abort_others(self, mock_classify, mock_fname, mock_upload, mock_db):
+        zip_bytes = _make_zip(*((f"inv{i}.pdf", b"%PDF") for i in range(5)))
+        att = Attachment(name="bundle.zip", content_type="application/zip", content_bytes=zip_bytes)
+        config = {"onedrive": {"upload_concurrency": 2}}
+
+        status = process_attachment(att, self._make_email(), 2025, 3, config, "/data", "cid", "Root")
+        assert status == "rejected"
+        assert mock_classify.call_count == 5
 
     @patch("pipeline.is_invoice")
-    def test_empty_zip_returns_rejected(self, mock_classify):
-        zip_bytes = _make_zip()  # empty archive
-        att = Attachment(name="empty.zip", content_type="application/zip", content_bytes=zip_bytes)
+    def test_empty_zip_returns_rejected(self, mock_classify, empty_zip):
+        att = Attachment(name="empty.zip", content_type="application/zip", content_bytes=empty_zip)
         email = self._make_email()
 
         status = process_attachment(att, email, 2025, 3, {}, "/data", "cid", "Root")
@@ -208,3 +356,44 @@ class TestProcessAttachment:
         # Verify hint_supplier was passed to is_invoice
         call_kwargs = mock_classify.call_args
         assert call_kwargs.kwargs.get("hint_supplier") == "Example Corp"
+
+    @patch("pipeline.db")
+    @patch("pipeline.upload_attachment", return_value=("fid", "https://link"))
+    @patch("pipeline.build_filename", return_value="fname.pdf")
+    @patch("pipeline.is_invoice", return_value=("invoice", None, None, None, None, None, None))
+    def test_resolved_sender_suppliers_used(self, mock_classify, mock_fname, mock_upload, mock_db):
+        att = Attachment(name="inv.pdf", content_type="application/pdf", content_bytes=b"%PDF")
+        email = self._make_email()
+        email.sender = "  Billing@Example.com "
+
+        process_attachment(
+            att, email, 2025, 3, {}, "/data", "cid", "Root",
+            sender_suppliers={"billing@example.com": "Example Corp"},
+        )
+        assert mock_classify.call_args.kwargs.get("hint_supplier") == "Example Corp"
+
+    @patch("pipeline.db")
+    @patch("pipeline.upload_to_review", return_value=("fid", "https://link"))
+    @patch("pipeline.build_filename", return_value="fname.html")
+    @patch("pipeline.is_invoice")
+    def test_unclassifiable_type_skips_classifier(self, mock_classify, mock_fname, mock_review, mock_db):
+        att = Attachment(name="page.html", content_type="text/html", content_bytes=b"<html>")
+
+        status = process_attachment(att, self._make_email(), 2025, 3, {}, "/data", "cid", "Root")
+        assert status == "review"
+        mock_classify.assert_not_called()
+        mock_review.assert_called_once()
+
+    @patch("pipeline.db")
+    @patch("pipeline.upload_attachment", return_value=("fid", "https://link"))
+    @patch("pipeline.build_filename", return_value="fname.pdf")
+    @patch("pipeline.ThreadPoolExecutor")
+    @patch("pipeline.is_invoice", return_value=("invoice", None, "Acme", None, None, None, None))
+    def test_single_member_zip_processed_inline(self, mock_classify, mock_pool, mock_fname, mock_upload, mock_db,
+                                                tiny_pdf_zip):
+        att = Attachment(name="one.zip", content_type="application/zip", content_bytes=tiny_pdf_zip)
+
+        status = process_attachment(att, self._make_email(), 2025, 3, {}, "/data", "cid", "Root")
+        assert status == "invoice"
+        mock_pool.assert_not_called()
+        mock_db.save_invoice.assert_called_once()
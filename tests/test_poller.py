@@ -1,20 +1,31 @@
 """Tests for src/poller.py — link extraction, filename derivation, Email properties."""
 
+import base64
 import re
+import threading
 from types import SimpleNamespace
 from unittest.mock import patch, MagicMock, PropertyMock
+from urllib.parse import parse_qs, urlsplit
 
 import pytest
 import requests
 
+import poller
 from poller import (
     _AnchorExtractor,
     _filename_from_response,
+    _url_dedup_key,
     Attachment,
     Email,
     GraphClient,
     INVOICE_MIME_TYPES,
 )
+from utils import GRAPH_BASE
+
+
+def _query(url: str) -> dict[str, str]:
+    """Decode a URL's query string the way the server does."""
+    return {k: v[0] for k, v in parse_qs(urlsplit(url).query).items()}
 
 
 # ---------------------------------------------------------------------------
@@ -50,6 +61,23 @@ class TestAnchorExtractor:
         parser.feed('<a href="">empty</a><a>no href</a>')
         assert parser.links == []
 
+    def test_keyword_filter_applied_while_parsing(self):
+        parser = _AnchorExtractor(["facture"])
+        parser.feed(
+            '<a href="https://shop.com/promo">Promo</a>'
+            '<a href="https://shop.com/Facture/42.pdf">Facture</a>'
+        )
+        assert parser.links == ["https://shop.com/Facture/42.pdf"]
+
+    def test_quoting_styles_and_entities(self):
+        parser = _AnchorExtractor()
+        parser.feed(
+            "<a title='x' href='https://a.com/1'>1</a>"
+            '<a href=https://b.com/2>2</a>'
+            '<a data-href="https://skip.com" href="https://c.com/?p=1&amp;q=2">3</a>'
+        )
+        assert parser.links == ["https://a.com/1", "https://b.com/2", "https://c.com/?p=1&q=2"]
+
 
 # ---------------------------------------------------------------------------
 # Email.received_datetime
@@ -77,6 +105,25 @@ class TestEmailDatetime:
         assert dt.year == 2025
         assert dt.month == 6
 
+    def test_parsed_once(self):
+        email = Email(
+            email_id="3", sender="a@b.com", subject="s",
+            received_at="2025-03-15T10:30:00Z",
+        )
+        assert email.received_datetime is email.received_datetime
+        assert email.received_datetime.utcoffset().total_seconds() == 0
+
+
+class TestAttachmentContentType:
+    def test_ct_main_strips_parameters(self):
+        att = Attachment(name="a.pdf", content_type="Application/PDF; name=a.pdf", content_bytes=b"")
+        assert att.ct_main == "application/pdf"
+
+    def test_attachment_is_immutable(self):
+        att = Attachment(name="a.pdf", content_type="application/pdf", content_bytes=b"")
+        with pytest.raises(AttributeError):
+            att.name = "b.pdf"
+
 
 # ---------------------------------------------------------------------------
 # _filename_from_response
@@ -102,6 +149,13 @@ class TestFilenameFromResponse:
         result = _filename_from_response(resp, "https://example.com", "application/pdf")
         assert result == "facture mars.pdf"
 
+    def test_content_disposition_filename_star_stops_at_next_param(self):
+        resp = self._mock_response(
+            headers={"Content-Disposition": "attachment; filename*=UTF-8''f%C3%A9v.pdf; size=1024"}
+        )
+        result = _filename_from_response(resp, "https://example.com", "application/pdf")
+        assert result == "fév.pdf"
+
     def test_url_path_fallback(self):
         resp = self._mock_response(
             headers={},
@@ -176,6 +230,70 @@ class TestExtractInvoiceLinks:
         urls = client._extract_invoice_links(body, ["facture"])
         assert len(urls) == 1
 
+    def test_regex_extractor_used_without_fast_parser(self):
+        client = self._make_client()
+        body = {
+            "contentType": "html",
+            "content": "<p>" + "x" * 70_000 + '</p><A class="btn" HREF="https://x.com/facture/9?a=1&amp;b=2">f</A>',
+        }
+        with patch("poller._fast_html_hrefs", return_value=None):
+            urls = client._extract_invoice_links(body, ["facture"])
+        assert urls == ["https://x.com/facture/9?a=1&b=2"]
+
+    def test_fast_parser_hrefs_are_keyword_filtered(self):
+        client = self._make_client()
+        body = {"contentType": "html", "content": "<html></html>"}
+        hrefs = ["https://x.com/facture/1", "https://x.com/about", "https://x.com/facture/1"]
+        with patch("poller._fast_html_hrefs", return_value=hrefs):
+            urls = client._extract_invoice_links(body, ["facture"])
+        assert urls == ["https://x.com/facture/1"]
+
+    def test_fast_parser_error_falls_back_to_regex(self):
+        client = self._make_client()
+        body = {"contentType": "html", "content": "see https://x.com/facture/2 now"}
+        with patch("poller._fast_html_hrefs", side_effect=ValueError("bad html")):
+            urls = client._extract_invoice_links(body, ["facture"])
+        assert urls == ["https://x.com/facture/2"]
+
+    def test_selectolax_hrefs(self):
+        pytest.importorskip("selectolax")
+        html = '<a href="https://x.com/facture/1">a</a><a>no href</a><A HREF="https://x.com/b">b</A>'
+        assert poller._fast_html_hrefs(html) == ["https://x.com/facture/1", "https://x.com/b"]
+        assert poller._fast_html_hrefs("  ") == []
+
+    @pytest.mark.parametrize("content,expected", [
+        ('<a href="https://x.com/facture/1">a</a><a>no href</a>', ["https://x.com/facture/1"]),
+        ("", []),
+        ("  \n ", []),
+        ("<!-- tracking pixel -->", []),
+        (
+            '<?xml version="1.0" encoding="iso-8859-1"?><html><body>'
+            '<a href="https://x.com/facturé">a</a></body></html>',
+            ["https://x.com/facturé"],
+        ),
+    ], ids=["anchors", "empty", "whitespace", "comment-only", "xml-declaration"])
+    def test_lxml_hrefs(self, monkeypatch, content, expected):
+        pytest.importorskip("lxml.html")
+        monkeypatch.setattr(poller, "_FastHTMLParser", None)
+        assert poller._fast_html_hrefs(content) == expected
+
+    def test_deduplication_ignores_host_case_only(self):
+        client = self._make_client()
+        body = {
+            "contentType": "text",
+            "content": (
+                "https://Example.COM/facture?t=AbC "
+                "https://example.com/facture?t=AbC "
+                "https://example.com/facture?t=abc"
+            ),
+        }
+        urls = client._extract_invoice_links(body, ["facture"])
+        assert urls == ["https://Example.COM/facture?t=AbC", "https://example.com/facture?t=abc"]
+
+    def test_url_dedup_key(self):
+        assert _url_dedup_key("HTTPS://Shop.Example/Path/Token") == "https://shop.example/Path/Token"
+        assert _url_dedup_key("https://shop.example") == "https://shop.example"
+
     def test_empty_body(self):
         client = self._make_client()
         body = {"contentType": "html", "content": ""}
@@ -190,6 +308,12 @@ class TestExtractInvoiceLinks:
 class TestIsPrivateUrl:
     """Tests for SSRF protection in _download_link."""
 
+    @pytest.fixture(autouse=True)
+    def _clear_host_cache(self):
+        poller._private_host_cache.clear()
+        yield
+        poller._private_host_cache.clear()
+
     def _make_client(self):
         with patch("poller.get_access_token", return_value="fake-token"):
             return GraphClient("test-client-id")
@@ -227,13 +351,457 @@ class TestIsPrivateUrl:
         client = self._make_client()
         assert client._is_private_url("http://unresolvable.test/x") is True
 
+    @patch("poller.socket.getaddrinfo", return_value=[
+        (2, 1, 6, "", ("10.0.0.1", 0)),
+    ])
+    def test_private_verdict_cached_per_host(self, mock_dns):
+        client = self._make_client()
+        assert client._is_private_url("https://internal.example.com/a.pdf") is True
+        assert client._is_private_url("https://INTERNAL.example.com/b.pdf") is True
+        assert mock_dns.call_count == 1
+
+    def test_public_verdict_not_cached(self):
+        client = self._make_client()
+        with patch("poller.socket.getaddrinfo", return_value=[(2, 1, 6, "", ("93.184.216.34", 0))]):
+            assert client._is_private_url("https://example.com/a.pdf") is False
+        # Rebound to a private address between two checks
+        with patch("poller.socket.getaddrinfo", return_value=[(2, 1, 6, "", ("127.0.0.1", 0))]):
+            assert client._is_private_url("https://example.com/a.pdf") is True
+
+    @patch("poller.socket.getaddrinfo", return_value=[
+        (2, 1, 6, "", ("10.0.0.1", 0)),
+    ])
+    def test_expired_entry_resolved_again(self, mock_dns, monkeypatch):
+        monkeypatch.setattr(poller, "_PRIVATE_HOST_TTL", 0.0)
+        client = self._make_client()
+        client._is_private_url("https://internal.example.com/a.pdf")
+        client._is_private_url("https://internal.example.com/a.pdf")
+        assert mock_dns.call_count == 2
+
+    def test_dns_failure_not_cached(self):
+        client = self._make_client()
+        with patch("poller.socket.getaddrinfo", side_effect=OSError("temporary failure")):
+            assert client._is_private_url("https://example.com/a.pdf") is True
+        with patch("poller.socket.getaddrinfo", return_value=[(2, 1, 6, "", ("93.184.216.34", 0))]):
+            assert client._is_private_url("https://example.com/a.pdf") is False
+
+
+class TestSessions:
+    def test_graph_session_retries_throttling(self):
+        client = GraphClient("test-client-id")
+        retry = client._session.get_adapter("https://graph.microsoft.com").max_retries
+        assert retry.total == 5
+        assert 429 in retry.status_forcelist
+
+    def test_download_session_is_separate(self):
+        client = GraphClient("test-client-id")
+        assert client._download_session is not client._session
+        assert client._download_session.get_adapter("https://example.com").max_retries.total == 0
+
+
+def _json_response(status_code, payload):
+    resp = MagicMock()
+    resp.status_code = status_code
+    resp.json.return_value = payload
+    return resp
+
+
+class TestRequest:
+    def test_headers_reused_until_token_changes(self):
+        client = GraphClient("cid")
+        with patch("poller.get_access_token", side_effect=["t1", "t1", "t2"]):
+            first, second, third = client._headers(), client._headers(), client._headers()
+        assert first is second
+        assert third["Authorization"] == "Bearer t2"
+
+    @patch("poller.get_access_token", return_value="fake-token")
+    @patch("poller.requests.Session.get")
+    def test_extra_headers_do_not_leak_into_shared_headers(self, mock_get, mock_token):
+        mock_get.return_value = _json_response(200, {})
+        client = GraphClient("cid")
+        client._get("https://graph/x", {"Prefer": "odata.maxpagesize=10"})
+        assert mock_get.call_args.kwargs["headers"]["Prefer"] == "odata.maxpagesize=10"
+        assert "Prefer" not in client._headers()
+
+    @patch("poller.get_access_token", return_value="fake-token")
+    @patch("poller.requests.Session.get")
+    def test_401_refreshes_token_and_retries_once(self, mock_get, mock_token):
+        mock_get.side_effect = [_json_response(401, {}), _json_response(200, {"ok": True})]
+        assert GraphClient("cid")._get("https://graph/x") == {"ok": True}
+        assert mock_token.call_args_list[-2].kwargs == {"force_refresh": True}
+
+    @patch("poller.get_access_token", return_value="fake-token")
+    @patch("poller.requests.Session.get")
+    def test_second_401_raises(self, mock_get, mock_token):
+        denied = _json_response(401, {})
+        denied.raise_for_status.side_effect = requests.HTTPError("401")
+        mock_get.return_value = denied
+        with pytest.raises(requests.HTTPError):
+            GraphClient("cid")._get("https://graph/x")
+        assert mock_get.call_count == 2
+
+
+class TestFetchAttachments:
+    _LISTING = {"value": [
+        {"@odata.type": "#microsoft.graph.fileAttachment", "id": "a1", "name": "f1.pdf",
+         "contentType": "application/pdf", "size": 10, "isInline": False},
+        {"@odata.type": "#microsoft.graph.fileAttachment", "id": "logo", "name": "logo.png",
+         "contentType": "image/png", "size": 10, "isInline": True},
+        {"@odata.type": "#microsoft.graph.fileAttachment", "id": "a2", "name": "f2.pdf",
+         "contentType": "application/pdf", "size": 10, "isInline": False},
+    ]}
+
+    @patch("poller.get_access_token", return_value="fake-token")
+    @patch("poller.requests.Session.post")
+    @patch("poller.requests.Session.get")
+    def test_contents_fetched_in_one_batch(self, mock_get, mock_post, mock_token):
+        mock_get.return_value = _json_response(200, self._LISTING)
+        mock_post.return_value = _json_response(200, {"responses": [
+            {"id": "1", "status": 200, "body": {"name": "f2.pdf", "contentType": "application/pdf",
+                                                "contentBytes": base64.b64encode(b"two").decode()}},
+            {"id": "0", "status": 200, "body": {"name": "f1.pdf", "contentType": "application/pdf",
+                                                "contentBytes": base64.b64encode(b"one").decode()}},
+        ]})
+
+        atts = GraphClient("cid")._fetch_attachments("msg-1")
+
+        assert [(a.name, a.content_bytes) for a in atts] == [("f1.pdf", b"one"), ("f2.pdf", b"two")]
+        mock_get.assert_called_once()  # listing only — no per-attachment GETs
+        sub_urls = [r["url"] for r in mock_post.call_args.kwargs["json"]["requests"]]
+        assert sub_urls == ["/me/messages/msg-1/attachments/a1", "/me/messages/msg-1/attachments/a2"]
+
+    @patch("poller.get_access_token", return_value="fake-token")
+    @patch("poller.requests.Session.post")
+    @patch("poller.requests.Session.get")
+    def test_throttled_sub_request_retried_individually(self, mock_get, mock_post, mock_token):
+        detail = {"name": "f1.pdf", "contentType": "application/pdf",
+                  "contentBytes": base64.b64encode(b"one").decode()}
+        mock_get.side_effect = [_json_response(200, self._LISTING), _json_response(200, detail)]
+        mock_post.return_value = _json_response(200, {"responses": [
+            {"id": "0", "status": 429, "body": {}},
+            {"id": "1", "status": 404, "body": {}},
+        ]})
+
+        atts = GraphClient("cid")._fetch_attachments("msg-1")
+
+        assert [a.name for a in atts] == ["f1.pdf"]
+        assert mock_get.call_args.args[0].endswith("/me/messages/msg-1/attachments/a1")
+
+    @patch("poller.get_access_token", return_value="fake-token")
+    @patch("poller.requests.Session.post")
+    @patch("poller.requests.Session.get")
+    def test_large_attachment_fetched_raw(self, mock_get, mock_post, mock_token):
+        listing = {"value": [
+            {"@odata.type": "#microsoft.graph.fileAttachment", "id": "big", "name": "scan.pdf",
+             "contentType": "application/pdf", "size": 5 * 1024 * 1024, "isInline": False},
+        ]}
+        raw = MagicMock(status_code=200, content=b"%PDF-raw")
+        mock_get.side_effect = [_json_response(200, listing), raw]
+
+        atts = GraphClient("cid")._fetch_attachments("msg-1")
+
+        assert [(a.name, a.content_type, a.content_bytes) for a in atts] == [
+            ("scan.pdf", "application/pdf", b"%PDF-raw"),
+        ]
+        assert mock_get.call_args.args[0].endswith("/me/messages/msg-1/attachments/big/$value")
+        mock_post.assert_not_called()
+
+    def test_batches_split_at_graph_limit(self):
+        client = GraphClient("cid")
+        paths = [f"/me/messages/m/attachments/{i}" for i in range(45)]
+
+        def fake_post(url, payload):
+            return {"responses": [{"id": r["id"], "status": 200, "body": {"n": r["id"]}}
+                                  for r in payload["requests"]]}
+
+        with patch.object(client, "_post", side_effect=fake_post) as mock_post:
+            results = client._get_many(paths)
+        assert [len(c.args[1]["requests"]) for c in mock_post.call_args_list] == [20, 20, 5]
+        assert [r["n"] for r in results] == [str(i) for i in range(45)]
+
+
+class TestScanFolder:
+    def test_concurrent_fetches_keep_message_order(self):
+        client = GraphClient("cid")
+        page = {"value": [
+            {"id": f"m{i}", "sender": {"emailAddress": {"address": "a@b.com"}}, "subject": "Facture",
+             "receivedDateTime": "2025-03-15T10:00:00Z", "hasAttachments": True, "body": {}}
+            for i in range(12)
+        ]}
+
+        def fake_fetch(message_id, failed=None):
+            return [Attachment(name=f"{message_id}.pdf", content_type="application/pdf", content_bytes=b"%PDF")]
+
+        with patch.object(client, "_get", return_value=page), \
+                patch.object(client, "_fetch_attachments", side_effect=fake_fetch):
+            emails, pages = client._scan_folder(
+                folder="inbox", sender_filter=None, subject_filter=None, keywords=[],
+                since=None, max_results=50, whitelisted_only=False,
+            )
+
+        assert pages == 1
+        assert [e.email_id for e in emails] == [f"m{i}" for i in range(12)]
+        assert [e.attachments[0].name for e in emails] == [f"m{i}.pdf" for i in range(12)]
+
+    def test_next_page_prefetched_while_current_page_processed(self):
+        client = GraphClient("cid")
+
+        def page(ids, next_link=None):
+            data = {"value": [
+                {"id": i, "sender": {"emailAddress": {"address": "a@b.com"}}, "subject": "Facture",
+                 "receivedDateTime": "2025-03-15T10:00:00Z", "hasAttachments": True, "body": {}}
+                for i in ids
+            ]}
+            if next_link:
+                data["@odata.nextLink"] = next_link
+            return data
+
+        pages = {"first": page(["m1", "m2"], "p2"), "p2": page(["m3"], "p3"), "p3": page(["m4"])}
+        fetch_threads = {}
+
+        def fake_get(url, extra_headers=None):
+            fetch_threads[url] = threading.current_thread()
+            return pages["first" if "mailFolders" in url else url]
+
+        def fake_fetch(message_id, failed=None):
+            return [Attachment(name=f"{message_id}.pdf", content_type="application/pdf", content_bytes=b"%PDF")]
+
+        with patch.object(client, "_get", side_effect=fake_get), \
+                patch.object(client, "_fetch_attachments", side_effect=fake_fetch):
+            emails, page_count = client._scan_folder(
+                folder="inbox", sender_filter=None, subject_filter=None, keywords=[],
+                since=None, max_results=50, whitelisted_only=False,
+            )
+
+        assert page_count == 3
+        assert [e.email_id for e in emails] == ["m1", "m2", "m3", "m4"]
+        assert fetch_threads["p2"] is not threading.main_thread()
+        assert fetch_threads["p3"] is not threading.main_thread()
+
+    def test_subject_filter_sent_to_graph_without_whitelist(self):
+        client = GraphClient("cid")
+        with patch.object(client, "_get", return_value={"value": []}) as mock_get:
+            client._scan_folder(
+                folder="inbox", sender_filter=None, subject_filter=["facture", "l'avoir"], keywords=[],
+                since=None, max_results=50, whitelisted_only=False,
+            )
+        url, extra_headers = mock_get.call_args.args
+        query = _query(url)
+        # The sorted property must lead the filter or Graph rejects the query
+        assert query["$filter"] == (
+            "receivedDateTime ge 1900-01-01T00:00:00Z and (subject eq '' or subject eq null"
+            " or contains(subject,'facture') or contains(subject,'l''avoir'))"
+        )
+        assert query["$orderby"] == "receivedDateTime desc"
+        assert extra_headers is None
+
+    def test_subject_filter_follows_since_clause(self):
+        client = GraphClient("cid")
+        with patch.object(client, "_get", return_value={"value": []}) as mock_get:
+            client._scan_folder(
+                folder="inbox", sender_filter=None, subject_filter=["facture"], keywords=[],
+                since="2025-01-01T00:00:00Z", max_results=50, whitelisted_only=False,
+            )
+        assert _query(mock_get.call_args.args[0])["$filter"] == (
+            "receivedDateTime gt 2025-01-01T00:00:00Z and (subject eq '' or subject eq null"
+            " or contains(subject,'facture'))"
+        )
+
+    def test_subject_keywords_percent_encoded(self):
+        client = GraphClient("cid")
+        with patch.object(client, "_get", return_value={"value": []}) as mock_get:
+            client._scan_folder(
+                folder="inbox", sender_filter=None, subject_filter=["c++", "b&q #12"], keywords=[],
+                since=None, max_results=50, whitelisted_only=False,
+            )
+        url = mock_get.call_args.args[0]
+        assert "+" not in url and "#" not in url
+        query = _query(url)
+        assert "contains(subject,'c++') or contains(subject,'b&q #12')" in query["$filter"]
+        assert query["$orderby"] == "receivedDateTime desc"
+        assert query["$top"] == "50"
+
+    def test_body_selected_only_with_link_keywords(self):
+        client = GraphClient("cid")
+        with patch.object(client, "_get", return_value={"value": []}) as mock_get:
+            for keywords in ([], ["facture"]):
+                client._scan_folder(
+                    folder="inbox", sender_filter=None, subject_filter=None, keywords=keywords,
+                    since=None, max_results=50, whitelisted_only=False,
+                )
+        without, with_keywords = (c.args[0] for c in mock_get.call_args_list)
+        assert "$select=id,sender,subject,receivedDateTime,hasAttachments&" in without
+        assert "$select=id,sender,subject,receivedDateTime,hasAttachments,body&" in with_keywords
+
+    def test_subject_filter_not_sent_with_whitelist(self):
+        client = GraphClient("cid")
+        with patch.object(client, "_get", return_value={"value": []}) as mock_get:
+            client._scan_folder(
+                folder="inbox", sender_filter={"a@b.com"}, subject_filter=["facture"], keywords=[],
+                since=None, max_results=50, whitelisted_only=False,
+            )
+        assert "contains(" not in mock_get.call_args.args[0]
+
+    def test_subject_filter_rejected_falls_back_to_local(self):
+        client = GraphClient("cid")
+        rejected = requests.HTTPError("400", response=SimpleNamespace(status_code=400))
+        msg = {"id": "m1", "sender": {"emailAddress": {"address": "a@b.com"}}, "subject": "Newsletter",
+               "receivedDateTime": "2025-03-15T10:00:00Z", "hasAttachments": False, "body": {}}
+        with patch.object(client, "_get", side_effect=[rejected, {"value": [msg]}]) as mock_get:
+            emails, pages = client._scan_folder(
+                folder="inbox", sender_filter=None, subject_filter=["facture"], keywords=[],
+                since=None, max_results=50, whitelisted_only=False,
+            )
+        assert pages == 1 and emails == []
+        assert "contains(" not in mock_get.call_args_list[1].args[0]
+
+    def test_delta_scan_resumes_from_stored_link_and_saves_new_one(self):
+        client = GraphClient("cid")
+        key = "inbox|id,sender,subject,receivedDateTime,hasAttachments|"
+        delta_links = {key: "https://graph/delta?token=old"}
+        removed = {"id": "gone", "@removed": {"reason": "deleted"}}
+        pages = [
+            {"value": [removed], "@odata.nextLink": "https://graph/delta?skip=1"},
+            {"value": [], "@odata.deltaLink": "https://graph/delta?token=new"},
+        ]
+        with patch.object(client, "_get", side_effect=pages) as mock_get:
+            emails, page_count = client._scan_folder(
+                folder="inbox", sender_filter=None, subject_filter=None, keywords=[],
+                since=None, max_results=None, whitelisted_only=False, delta_links=delta_links,
+            )
+        assert emails == [] and page_count == 2
+        assert mock_get.call_args_list[0].args == ("https://graph/delta?token=old", {"Prefer": "odata.maxpagesize=200"})
+        assert delta_links == {key: "https://graph/delta?token=new"}
+
+    def test_first_delta_sync_builds_delta_url(self):
+        client = GraphClient("cid")
+        with patch.object(client, "_get", return_value={"value": [], "@odata.deltaLink": "new"}) as mock_get:
+            client._scan_folder(
+                folder="inbox", sender_filter=None, subject_filter=["facture"], keywords=[],
+                since="2025-01-01T00:00:00Z", max_results=None, whitelisted_only=False, delta_links={},
+            )
+        url = mock_get.call_args.args[0]
+        assert url.startswith(f"{GRAPH_BASE}/me/mailFolders/inbox/messages/delta?")
+        assert "$filter=receivedDateTime ge 2025-01-01T00:00:00Z" in url
+        assert "contains(" not in url and "$expand" not in url
+
+    def test_expired_delta_link_restarts_full_sync(self):
+        client = GraphClient("cid")
+        key = "inbox|id,sender,subject,receivedDateTime,hasAttachments|"
+        delta_links = {key: "https://graph/delta?token=old"}
+        expired = requests.HTTPError("410", response=SimpleNamespace(status_code=410))
+        fresh = {"value": [], "@odata.deltaLink": "https://graph/delta?token=fresh"}
+        with patch.object(client, "_get", side_effect=[expired, fresh]) as mock_get:
+            client._scan_folder(
+                folder="inbox", sender_filter=None, subject_filter=None, keywords=[],
+                since=None, max_results=None, whitelisted_only=False, delta_links=delta_links,
+            )
+        assert mock_get.call_args_list[1].args[0] == (
+            f"{GRAPH_BASE}/me/mailFolders/inbox/messages/delta?$select=id,sender,subject,receivedDateTime,hasAttachments"
+        )
+        assert delta_links == {key: "https://graph/delta?token=fresh"}
+
+    def test_delta_link_kept_when_a_fetch_fails(self):
+        client = GraphClient("cid")
+        key = "inbox|id,sender,subject,receivedDateTime,hasAttachments|"
+        delta_links = {key: "https://graph/delta?token=old"}
+        msg = {"id": "m1", "sender": {"emailAddress": {"address": "a@b.com"}}, "subject": "Facture",
+               "receivedDateTime": "2025-03-15T10:00:00Z", "hasAttachments": True}
+        page = {"value": [msg], "@odata.deltaLink": "https://graph/delta?token=new"}
+
+        def failing_fetch(message_id, failed=None):
+            failed.set()
+            return []
+
+        with patch.object(client, "_get", return_value=page), \
+                patch.object(client, "_fetch_attachments", side_effect=failing_fetch):
+            emails, _ = client._scan_folder(
+                folder="inbox", sender_filter=None, subject_filter=None, keywords=[],
+                since=None, max_results=None, whitelisted_only=False, delta_links=delta_links,
+            )
+        assert emails == []
+        assert delta_links == {key: "https://graph/delta?token=old"}
+
+    @staticmethod
+    def _msg(attachments):
+        return {"id": "m1", "sender": {"emailAddress": {"address": "a@b.com"}}, "subject": "Facture",
+                "receivedDateTime": "2025-03-15T10:00:00Z", "hasAttachments": True, "body": {},
+                "attachments": attachments}
+
+    def _scan(self, client):
+        emails, _ = client._scan_folder(
+            folder="inbox", sender_filter=None, subject_filter=None, keywords=[],
+            since=None, max_results=200, whitelisted_only=False,
+        )
+        return emails
+
+    def test_expanded_attachments_used_without_extra_calls(self):
+        client = GraphClient("cid")
+        page = {"value": [self._msg([
+            {"@odata.type": "#microsoft.graph.fileAttachment", "name": "f.pdf", "contentType": "application/pdf",
+             "size": 3, "isInline": False, "contentBytes": base64.b64encode(b"one").decode()},
+        ])]}
+        with patch.object(client, "_get", return_value=page) as mock_get, \
+                patch.object(client, "_fetch_attachments") as mock_fetch:
+            emails = self._scan(client)
+
+        assert [(a.name, a.content_bytes) for a in emails[0].attachments] == [("f.pdf", b"one")]
+        mock_fetch.assert_not_called()
+        url = mock_get.call_args.args[0]
+        assert "$expand=attachments" in url
+        assert "$top=50" in url
+
+    def test_whitelisted_folders_fetch_attachments_per_message(self):
+        client = GraphClient("cid")
+        msg = self._msg([])
+        del msg["attachments"]
+        fetched = [Attachment(name="f.pdf", content_type="application/pdf", content_bytes=b"%PDF")]
+        for folder, whitelisted_only in (("inbox", False), ("junkemail", True), ("archive", True)):
+            with patch.object(client, "_get", return_value={"value": [msg]}) as mock_get, \
+                    patch.object(client, "_fetch_attachments", return_value=fetched) as mock_fetch:
+                emails, _ = client._scan_folder(
+                    folder=folder, sender_filter={"a@b.com"}, subject_filter=None, keywords=[],
+                    since=None, max_results=None, whitelisted_only=whitelisted_only,
+                )
+            url = mock_get.call_args.args[0]
+            assert "$expand" not in url
+            assert "$top=1000" in url
+            mock_fetch.assert_called_once()
+            assert emails[0].attachments == fetched
+
+    def test_content_type_parameters_do_not_drop_attachment(self):
+        client = GraphClient("cid")
+        page = {"value": [self._msg([
+            {"@odata.type": "#microsoft.graph.fileAttachment", "name": "f.pdf",
+             "contentType": "Application/PDF; name=f.pdf", "size": 3, "isInline": False,
+             "contentBytes": base64.b64encode(b"one").decode()},
+        ])]}
+        with patch.object(client, "_get", return_value=page):
+            emails = self._scan(client)
+        assert [a.name for a in emails[0].attachments] == ["f.pdf"]
+
+    def test_missing_content_bytes_falls_back_to_fetch(self):
+        client = GraphClient("cid")
+        page = {"value": [self._msg([
+            {"@odata.type": "#microsoft.graph.fileAttachment", "id": "a1", "name": "big.pdf",
+             "contentType": "application/pdf", "size": 3, "isInline": False},
+        ])]}
+        fetched = [Attachment(name="big.pdf", content_type="application/pdf", content_bytes=b"%PDF")]
+        with patch.object(client, "_get", return_value=page), \
+                patch.object(client, "_fetch_attachments", return_value=fetched) as mock_fetch:
+            emails = self._scan(client)
+
+        mock_fetch.assert_called_once()
+        assert mock_fetch.call_args.args[0] == "m1"
+        assert emails[0].attachments == fetched
+
 
 class TestDownloadLink:
     def _make_client(self):
         with patch("poller.get_access_token", return_value="fake-token"):
             return GraphClient("test-client-id")
 
-    @patch("poller.requests.get")
+    @patch("poller.requests.Session.get")
     @patch.object(GraphClient, "_is_private_url", return_value=False)
     def test_successful_download(self, mock_ssrf, mock_get):
         mock_resp = MagicMock()
@@ -242,7 +810,7 @@ class TestDownloadLink:
             "Content-Type": "application/pdf",
             "Content-Disposition": 'attachment; filename="facture.pdf"',
         }
-        mock_resp.content = b"%PDF-1.4 data"
+        mock_resp.iter_content.return_value = [b"%PDF-1.4 ", b"data"]
         mock_resp.url = "https://example.com/facture.pdf"
         mock_resp.raise_for_status = MagicMock()
         mock_get.return_value = mock_resp
@@ -252,14 +820,16 @@ class TestDownloadLink:
         assert att is not None
         assert att.name == "facture.pdf"
         assert att.content_type == "application/pdf"
+        assert att.content_bytes == b"%PDF-1.4 data"
+        assert mock_get.call_args.kwargs["stream"] is True
 
-    @patch("poller.requests.get")
+    @patch("poller.requests.Session.get")
     @patch.object(GraphClient, "_is_private_url", return_value=False)
     def test_unsupported_mime_returns_none(self, mock_ssrf, mock_get):
         mock_resp = MagicMock()
         mock_resp.status_code = 200
         mock_resp.headers = {"Content-Type": "text/html"}
-        mock_resp.content = b"<html>page</html>"
+        mock_resp.iter_content.return_value = [b"<html>page</html>"]
         mock_resp.url = "https://example.com/page"
         mock_resp.raise_for_status = MagicMock()
         mock_get.return_value = mock_resp
@@ -268,14 +838,28 @@ class TestDownloadLink:
         att = client._download_link("https://example.com/page")
         assert att is None
 
-    @patch("poller.requests.get", side_effect=requests.RequestException("timeout"))
+    @patch("poller.requests.Session.get", side_effect=requests.RequestException("timeout"))
     @patch.object(GraphClient, "_is_private_url", return_value=False)
     def test_request_error_returns_none(self, mock_ssrf, mock_get):
         client = self._make_client()
         att = client._download_link("https://example.com/fail")
         assert att is None
 
-    @patch("poller.requests.get")
+    @patch.object(GraphClient, "_is_private_url", return_value=False)
+    def test_only_transient_errors_flag_a_retry(self, mock_ssrf):
+        client = self._make_client()
+        errors = {
+            requests.ConnectionError("reset"): True,
+            requests.HTTPError("503", response=SimpleNamespace(status_code=503)): True,
+            requests.HTTPError("404", response=SimpleNamespace(status_code=404)): False,
+        }
+        for error, transient in errors.items():
+            failed = threading.Event()
+            with patch("poller.requests.Session.get", side_effect=error):
+                assert client._download_link("https://example.com/fail", failed) is None
+            assert failed.is_set() is transient
+
+    @patch("poller.requests.Session.get")
     @patch.object(GraphClient, "_is_private_url", return_value=False)
     def test_oversized_content_length_returns_none(self, mock_ssrf, mock_get):
         mock_resp = MagicMock()
@@ -292,6 +876,28 @@ class TestDownloadLink:
         att = client._download_link("https://example.com/huge.pdf")
         assert att is None
 
+    @patch("poller._MAX_DOWNLOAD_BYTES", 10)
+    @patch("poller.requests.Session.get")
+    @patch.object(GraphClient, "_is_private_url", return_value=False)
+    def test_oversized_body_aborted_mid_stream(self, mock_ssrf, mock_get):
+        mock_resp = MagicMock()
+        mock_resp.status_code = 200
+        mock_resp.headers = {"Content-Type": "application/pdf"}  # no Content-Length
+        mock_resp.url = "https://example.com/huge.pdf"
+        chunks_read = []
+
+        def chunks(chunk_size):
+            for c in (b"x" * 8, b"x" * 8, b"x" * 8):
+                chunks_read.append(c)
+                yield c
+
+        mock_resp.iter_content.side_effect = chunks
+        mock_get.return_value = mock_resp
+
+        client = self._make_client()
+        assert client._download_link("https://example.com/huge.pdf") is None
+        assert len(chunks_read) == 2  # stopped as soon as the cap was passed
+
     @patch.object(GraphClient, "_is_private_url", return_value=True)
     def test_private_url_blocked(self, mock_ssrf):
         client = self._make_client()
@@ -5,7 +5,6 @@ import logging
 import tempfile
 
 import pytest
-import yaml
 
 from utils import (
     DEFAULT_DATA_DIR,
@@ -24,43 +23,32 @@ from utils import (
 # ---------------------------------------------------------------------------
 
 class TestConstants:
-    def test_graph_base_url(self):
-        assert GRAPH_BASE == "https://graph.microsoft.com/v1.0"
-
-    def test_default_data_dir(self):
-        assert DEFAULT_DATA_DIR == "/app/data"
-
-    def test_month_names_length(self):
-        assert len(MONTH_NAMES_FR) == 13
-
-    def test_month_names_index_zero_empty(self):
-        assert MONTH_NAMES_FR[0] == ""
-
-    def test_month_names_january(self):
-        assert MONTH_NAMES_FR[1] == "Janvier"
-
-    def test_month_names_december(self):
-        assert MONTH_NAMES_FR[12] == "Décembre"
+    @pytest.mark.parametrize("actual,expected", [
+        (GRAPH_BASE, "https://graph.microsoft.com/v1.0"),
+        (DEFAULT_DATA_DIR, "/app/data"),
+        (len(MONTH_NAMES_FR), 13),
+        (MONTH_NAMES_FR[0], ""),
+        (MONTH_NAMES_FR[1], "Janvier"),
+        (MONTH_NAMES_FR[12], "Décembre"),
+    ], ids=[
+        "graph-base-url", "default-data-dir", "month-names-length",
+        "month-names-index-zero-empty", "month-names-january", "month-names-december",
+    ])
+    def test_constant(self, actual, expected):
+        assert actual == expected
 
 
 class TestNormalizeContentType:
-    def test_simple_type(self):
-        assert normalize_content_type("application/pdf") == "application/pdf"
-
-    def test_strips_charset(self):
-        assert normalize_content_type("text/html; charset=utf-8") == "text/html"
-
-    def test_strips_boundary(self):
-        assert normalize_content_type("multipart/form-data; boundary=----") == "multipart/form-data"
-
-    def test_uppercase_normalised(self):
-        assert normalize_content_type("Application/PDF") == "application/pdf"
-
-    def test_whitespace_stripped(self):
-        assert normalize_content_type("  image/jpeg  ; quality=80") == "image/jpeg"
-
-    def test_empty_string(self):
-        assert normalize_content_type("") == ""
+    @pytest.mark.parametrize("raw,expected", [
+        ("application/pdf", "application/pdf"),
+        ("text/html; charset=utf-8", "text/html"),
+        ("multipart/form-data; boundary=----", "multipart/form-data"),
+        ("Application/PDF", "application/pdf"),
+        ("  image/jpeg  ; quality=80", "image/jpeg"),
+        ("", ""),
+    ], ids=["simple", "charset", "boundary", "uppercase", "whitespace", "empty"])
+    def test_normalize(self, raw, expected):
+        assert normalize_content_type(raw) == expected
 
 
 # ---------------------------------------------------------------------------
@@ -68,29 +56,22 @@ class TestNormalizeContentType:
 # ---------------------------------------------------------------------------
 
 class TestSanitizeFilename:
-    def test_clean_name_unchanged(self):
-        assert sanitize_filename("invoice_2025.pdf") == "invoice_2025.pdf"
-
-    def test_removes_angle_brackets(self):
-        assert sanitize_filename("file<name>.txt") == "file_name_.txt"
-
-    def test_removes_colon(self):
-        assert sanitize_filename("12:30:00.txt") == "12_30_00.txt"
-
-    def test_removes_quotes_and_pipe(self):
-        assert sanitize_filename('my"file|name.pdf') == "my_file_name.pdf"
-
-    def test_removes_question_and_star(self):
-        assert sanitize_filename("what?*.pdf") == "what__.pdf"
-
-    def test_removes_backslash_and_slash(self):
-        assert sanitize_filename("path\\to/file.pdf") == "path_to_file.pdf"
-
-    def test_removes_control_characters(self):
-        assert sanitize_filename("file\x00\x1fname.pdf") == "file__name.pdf"
-
-    def test_empty_string(self):
-        assert sanitize_filename("") == ""
+    @pytest.mark.parametrize("raw,expected", [
+        ("invoice_2025.pdf", "invoice_2025.pdf"),
+        ("file<name>.txt", "file_name_.txt"),
+        ("12:30:00.txt", "12_30_00.txt"),
+        ('my"file|name.pdf', "my_file_name.pdf"),
+        ("what?*.pdf", "what__.pdf"),
+        ("path\\to/file.pdf", "path_to_file.pdf"),
+        ("file\x00\x1fname.pdf", "file__name.pdf"),
+        ("", ""),
+        ("facture_électricité<2025>.pdf", "facture_électricité_2025_.pdf"),
+    ], ids=[
+        "clean", "angle-brackets", "colon", "quote-pipe", "question-star",
+        "slashes", "control-chars", "empty", "non-ascii",
+    ])
+    def test_sanitize(self, raw, expected):
+        assert sanitize_filename(raw) == expected
 
 
 # ---------------------------------------------------------------------------
@@ -98,79 +79,74 @@ class TestSanitizeFilename:
 # ---------------------------------------------------------------------------
 
 class TestSenderToLabel:
-    def test_simple_domain(self):
-        assert sender_to_label("noreply@hotmail.com") == "hotmail"
-
-    def test_subdomain_stripped(self):
-        assert sender_to_label("billing@notifications.amazon.fr") == "amazon"
-
-    def test_compound_tld_co_uk(self):
-        assert sender_to_label("support@company.co.uk") == "company"
-
-    def test_compound_tld_com_au(self):
-        assert sender_to_label("info@bigcorp.com.au") == "bigcorp"
-
-    def test_no_at_sign(self):
-        assert sender_to_label("example.com") == "example"
-
-    def test_single_part_domain(self):
-        assert sender_to_label("localhost") == "localhost"
-
-    def test_uppercase_normalised(self):
-        assert sender_to_label("Admin@BIGCORP.COM") == "bigcorp"
-
-    def test_whitespace_stripped(self):
-        assert sender_to_label("  user@corp.fr  ") == "corp"
-
-    def test_deep_subdomain(self):
-        assert sender_to_label("a@mail.sub.deep.example.org") == "example"
+    @pytest.mark.parametrize("sender,expected", [
+        ("noreply@hotmail.com", "hotmail"),
+        ("billing@notifications.amazon.fr", "amazon"),
+        ("support@company.co.uk", "company"),
+        ("info@bigcorp.com.au", "bigcorp"),
+        ("example.com", "example"),
+        ("localhost", "localhost"),
+        ("Admin@BIGCORP.COM", "bigcorp"),
+        ("  user@corp.fr  ", "corp"),
+        ("a@mail.sub.deep.example.org", "example"),
+        ("a@eu.mail.shop.co.uk", "shop"),
+    ], ids=[
+        "simple", "subdomain", "co-uk", "com-au", "no-at-sign", "single-part",
+        "uppercase", "whitespace", "deep-subdomain", "deep-subdomain-compound-tld",
+    ])
+    def test_label(self, sender, expected):
+        assert sender_to_label(sender) == expected
 
 
 # ---------------------------------------------------------------------------
 # load_config
 # ---------------------------------------------------------------------------
 
+@pytest.fixture(scope="module")
+def cfg_files(tmp_path_factory):
+    """Config files shared by the load_config tests (read-only)."""
+    d = tmp_path_factory.mktemp("cfg")
+    (d / "client_id.yaml").write_text("microsoft:\n  client_id: from-yaml\n")
+    (d / "api_key.yaml").write_text("classifier:\n  api_key: from-yaml\n")
+    (d / "utf8.yaml").write_bytes("onedrive:\n  folder_name: Factures-Été\n".encode("utf-8"))
+    (d / "bad.yaml").write_text("{{{{invalid yaml: [")
+    return d
+
+
 class TestLoadConfig:
-    def test_loads_valid_yaml(self, tmp_path, monkeypatch):
-        cfg_file = tmp_path / "config.yaml"
-        cfg_file.write_text(yaml.dump({"microsoft": {"client_id": "abc"}}))
-        monkeypatch.setenv("CONFIG_PATH", str(cfg_file))
-        # Clear env vars that would overlay
-        monkeypatch.delenv("AZURE_CLIENT_ID", raising=False)
-        monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
+    def test_loads_valid_yaml(self, cfg_files, clean_env):
+        clean_env.setenv("CONFIG_PATH", str(cfg_files / "client_id.yaml"))
 
         cfg = load_config()
-        assert cfg["microsoft"]["client_id"] == "abc"
+        assert cfg["microsoft"]["client_id"] == "from-yaml"
 
-    def test_env_var_overrides_client_id(self, tmp_path, monkeypatch):
-        cfg_file = tmp_path / "config.yaml"
-        cfg_file.write_text(yaml.dump({"microsoft": {"client_id": "from-yaml"}}))
-        monkeypatch.setenv("CONFIG_PATH", str(cfg_file))
-        monkeypatch.setenv("AZURE_CLIENT_ID", "from-env")
-        monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
+    def test_env_var_overrides_client_id(self, cfg_files, clean_env):
+        clean_env.setenv("CONFIG_PATH", str(cfg_files / "client_id.yaml"))
+        clean_env.setenv("AZURE_CLIENT_ID", "from-env")
 
         cfg = load_config()
         assert cfg["microsoft"]["client_id"] == "from-env"
 
-    def test_env_var_overrides_api_key(self, tmp_path, monkeypatch):
-        cfg_file = tmp_path / "config.yaml"
-        cfg_file.write_text(yaml.dump({"classifier": {"api_key": "from-yaml"}}))
-        monkeypatch.setenv("CONFIG_PATH", str(cfg_file))
-        monkeypatch.delenv("AZURE_CLIENT_ID", raising=False)
-        monkeypatch.setenv("ANTHROPIC_API_KEY", "from-env")
+    def test_env_var_overrides_api_key(self, cfg_files, clean_env):
+        clean_env.setenv("CONFIG_PATH", str(cfg_files / "api_key.yaml"))
+        clean_env.setenv("ANTHROPIC_API_KEY", "from-env")
 
         cfg = load_config()
         assert cfg["classifier"]["api_key"] == "from-env"
 
-    def test_missing_file_exits(self, tmp_path, monkeypatch):
-        monkeypatch.setenv("CONFIG_PATH", str(tmp_path / "nonexistent.yaml"))
+    def test_utf8_values_decoded(self, cfg_files, clean_env):
+        clean_env.setenv("CONFIG_PATH", str(cfg_files / "utf8.yaml"))
+
+        cfg = load_config()
+        assert cfg["onedrive"]["folder_name"] == "Factures-Été"
+
+    def test_missing_file_exits(self, cfg_files, clean_env):
+        clean_env.setenv("CONFIG_PATH", str(cfg_files / "nonexistent.yaml"))
         with pytest.raises(SystemExit):
             load_config()
 
-    def test_invalid_yaml_exits(self, tmp_path, monkeypatch):
-        bad_file = tmp_path / "config.yaml"
-        bad_file.write_text("{{{{invalid yaml: [")
-        monkeypatch.setenv("CONFIG_PATH", str(bad_file))
+    def test_invalid_yaml_exits(self, cfg_files, clean_env):
+        clean_env.setenv("CONFIG_PATH", str(cfg_files / "bad.yaml"))
         with pytest.raises(SystemExit):
             load_config()
 
@@ -199,7 +175,21 @@ class TestSetupLogging:
             setup_logging(data_dir=str(tmp_path), log_level="INFO")
             count_after_first = len(root.handlers)
             setup_logging(data_dir=str(tmp_path), log_level="INFO")
-            # Should not add duplicate stdout handlers
-            assert len(root.handlers) <= count_after_first + 1
+            # Should not add duplicate stdout or file handlers
+            assert len(root.handlers) == count_after_first
+        finally:
+            root.handlers = original_handlers
+
+    def test_log_file_opened_lazily(self, tmp_path):
+        root = logging.getLogger()
+        original_handlers = root.handlers[:]
+        root.handlers.clear()
+        try:
+            setup_logging(data_dir=str(tmp_path), log_level="WARNING")
+            assert not (tmp_path / "bot.log").exists()
+            logging.getLogger("test").warning("first record")
+            assert (tmp_path / "bot.log").exists()
         finally:
+            for handler in root.handlers:
+                handler.close()
             root.handlers = original_handlers